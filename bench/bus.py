@@ -0,0 +1,105 @@
+# bench/bus.py — Prueba del bus de invalidación entre procesos en una sola máquina
+"""
+Uso (desde la raíz del repo, Linux):
+
+    python -m bench.bus                 # 4 procesos, 200 invalidaciones
+    python -m bench.bus --workers 8 -n 1000
+
+Levanta N procesos como lo haría `uvicorn --workers N` (cada uno con sus
+singletons y su socket en un directorio temporal). El proceso 0 invalida
+alumnos y registra asistencias; los demás reportan cuándo su directorio
+marcó la fila como sucia y cuándo su índice de scans vio la asistencia.
+Sale con código 1 si algún aviso no llegó.
+"""
+import os
+import sys
+import time
+import uuid
+import tempfile
+import argparse
+import statistics
+import multiprocessing as mp
+from datetime import datetime, timezone
+
+from bench.run import _install_fake
+
+
+def _worker(ready, queue, ids: list, timeout: float):
+    from services.invalidation_bus import invalidation_bus
+    from services.student_cache import student_directory
+    from services.scan_dedup import recent_scans
+    import services.events  # noqa: F401 — registra el tópico "attendance"
+
+    invalidation_bus.start()
+    recent_scans.covered_from = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    ready.release()
+
+    pendientes_stale, pendientes_scan = set(ids), set(ids)
+    vistos = {}
+    limite = time.monotonic() + timeout
+    while (pendientes_stale or pendientes_scan) and time.monotonic() < limite:
+        ahora = time.time()
+        for sid in [s for s in pendientes_stale if s in student_directory._stale]:
+            pendientes_stale.discard(sid)
+            vistos[("stale", sid)] = ahora
+        for sid in [s for s in pendientes_scan if recent_scans._times.get(s)]:
+            pendientes_scan.discard(sid)
+            vistos[("scan", sid)] = ahora
+        time.sleep(0.0005)
+    queue.put((os.getpid(), vistos, len(pendientes_stale) + len(pendientes_scan), invalidation_bus.stats()))
+    invalidation_bus.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("-n", type=int, default=200, help="invalidaciones a enviar")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    bus_dir = tempfile.mkdtemp(prefix="emblema-bus-")
+    os.environ.update({"INVALIDATION_BUS": "1", "INVALIDATION_BUS_DIR": bus_dir})
+    _install_fake(0)
+
+    ids = [str(uuid.uuid4()) for _ in range(args.n)]
+    ctx = mp.get_context("fork")
+    ready, queue = ctx.Semaphore(0), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(ready, queue, ids, args.timeout)) for _ in range(args.workers - 1)]
+    for p in procs:
+        p.start()
+    for _ in procs:
+        ready.acquire()
+
+    # El proceso 0 arranca su bus después del fork: cada hijo tiene el suyo
+    from services.invalidation_bus import invalidation_bus
+    from services.student_cache import student_directory
+    from services.events import attendance_inserted
+    invalidation_bus.start()
+
+    enviados = {}
+    for sid in ids:
+        enviados[sid] = time.time()
+        student_directory.invalidate(sid)
+        attendance_inserted([{"student_id": sid, "created_at": datetime.now(timezone.utc).isoformat()}])
+
+    resultados = [queue.get(timeout=args.timeout + 5) for _ in procs]
+    for p in procs:
+        p.join()
+    invalidation_bus.stop()
+
+    perdidos = sum(r[2] for r in resultados)
+    for tipo in ("stale", "scan"):
+        lat = [(vistos[(tipo, sid)] - enviados[sid]) * 1000
+               for _, vistos, _, _ in resultados for sid in ids if (tipo, sid) in vistos]
+        if lat:
+            lat.sort()
+            print(f"{tipo:6} avisos={len(lat):6}  p50={statistics.median(lat):7.2f} ms  "
+                  f"p95={lat[int(len(lat) * 0.95) - 1]:7.2f} ms  máx={lat[-1]:7.2f} ms")
+    for pid, _, faltan, stats in resultados:
+        print(f"  worker {pid}: slot={stats['slot']} recibidos={stats['received']} faltan={faltan}")
+    print(f"enviados={invalidation_bus.sent} descartados={invalidation_bus.dropped} perdidos={perdidos}")
+    sys.exit(1 if perdidos else 0)
+
+
+if __name__ == "__main__":
+    main()
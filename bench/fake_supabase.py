@@ -0,0 +1,413 @@
+# bench/fake_supabase.py — Doble en memoria de la API de tablas de supabase-py (PostgREST)
+"""
+Implementa el subconjunto del query builder que usa la app:
+select (con count= y embebidos tipo `students(full_name)`), eq, neq, gt, gte,
+lt, lte, in_, is_, or_ (comparaciones simples y and(...)), ilike, order, limit, range, single, insert, update, delete, upsert,
+y rpc() para funciones registradas con `FakeSupabase.register_rpc`.
+
+Cada .execute() cuenta como un round trip (`FakeSupabase.round_trips`), y
+opcionalmente duerme `latency_ms` para simular la red hasta Supabase.
+"""
+import re
+import time
+import uuid
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+
+
+class APIResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeAPIError(Exception):
+    pass
+
+
+def _norm_ts(value):
+    """Timestamps ISO → UTC con formato fijo, para que comparar strings sea comparar fechas."""
+    if not isinstance(value, str) or len(value) < 19 or value[10] != "T":
+        return value
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _split_columns(select: str) -> list:
+    """'id, students(full_name, dni)' → ['id', 'students(full_name, dni)']"""
+    cols, depth, cur = [], 0, ""
+    for ch in select:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0:
+            cols.append(cur.strip())
+            cur = ""
+        else:
+            cur += ch
+    if cur.strip():
+        cols.append(cur.strip())
+    return cols
+
+
+def _split_logic(expr: str) -> list:
+    """'a.eq.1,and(b.gt."x,y",c.is.null)' → ['a.eq.1', 'and(b.gt."x,y",c.is.null)']"""
+    parts, depth, cur, quoted, escaped = [], 0, "", False, False
+    for ch in expr:
+        if escaped:
+            cur += ch
+            escaped = False
+            continue
+        if quoted and ch == "\\":
+            cur += ch
+            escaped = True
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        if ch == "," and depth == 0 and not quoted:
+            parts.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    if cur:
+        parts.append(cur)
+    return parts
+
+
+def _parse_logic(expr: str):
+    """Árbol ('or'|'and', [hijos]) u hoja (op, col, valor) de un filtro lógico de PostgREST."""
+    expr = expr.strip()
+    for kind in ("and", "or"):
+        if expr.startswith(kind + "(") and expr.endswith(")"):
+            return (kind, [_parse_logic(p) for p in _split_logic(expr[len(kind) + 1:-1])])
+    col, op, value = expr.split(".", 2)
+    if value.startswith('"') and value.endswith('"'):
+        value = re.sub(r"\\(.)", r"\1", value[1:-1])
+    if op == "is":
+        value = None if value == "null" else value
+    return (op, col, value)
+
+
+class FakeTable:
+    """Filas de una tabla + índices hash por columna y orden por created_at."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows = []
+        self._by_col = {}           # columna → valor → lista de filas
+        self._by_ts = []            # [(created_at, seq, fila)] ordenado
+        self._seq = 0
+
+    def _index(self, col: str) -> dict:
+        idx = self._by_col.get(col)
+        if idx is None:
+            idx = {}
+            for r in self.rows:
+                idx.setdefault(r.get(col), []).append(r)
+            self._by_col[col] = idx
+        return idx
+
+    def add(self, row: dict, keep_sorted: bool = True):
+        row.setdefault("id", str(uuid.uuid4()))
+        if "created_at" in row or self.name in ("attendance", "biometria", "batido_canjes"):
+            row["created_at"] = _norm_ts(row.get("created_at") or datetime.now(timezone.utc).isoformat())
+        self.rows.append(row)
+        for col, idx in self._by_col.items():
+            idx.setdefault(row.get(col), []).append(row)
+        if "created_at" in row:
+            self._seq += 1
+            if keep_sorted:
+                insort(self._by_ts, (row["created_at"], self._seq, row))
+            else:
+                self._by_ts.append((row["created_at"], self._seq, row))
+
+    def remove(self, targets: list):
+        ids = {id(r) for r in targets}
+        self.rows = [r for r in self.rows if id(r) not in ids]
+        self._by_col = {}
+        self._by_ts = [t for t in self._by_ts if id(t[2]) not in ids]
+
+    def reindex(self):
+        self._by_col = {}
+
+
+class FakeQuery:
+    def __init__(self, client, table: FakeTable):
+        self._client = client
+        self._table = table
+        self._op = "select"
+        self._columns = "*"
+        self._count = None
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._range = None
+        self._single = False
+        self._payload = None
+
+    # ── OPERACIONES ──────────────────────────────────────
+    def select(self, columns: str = "*", count=None):
+        self._op, self._columns, self._count = "select", columns, count
+        return self
+
+    def insert(self, payload, **_):
+        self._op, self._payload = "insert", payload
+        return self
+
+    def upsert(self, payload, **_):
+        self._op, self._payload = "upsert", payload
+        return self
+
+    def update(self, payload):
+        self._op, self._payload = "update", payload
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    # ── FILTROS ──────────────────────────────────────────
+    def _f(self, op, col, value):
+        if col == "created_at":
+            value = _norm_ts(value)
+        self._filters.append((op, col, value))
+        return self
+
+    def eq(self, col, value):  return self._f("eq", col, value)
+    def neq(self, col, value): return self._f("neq", col, value)
+    def gt(self, col, value):  return self._f("gt", col, value)
+    def gte(self, col, value): return self._f("gte", col, value)
+    def lt(self, col, value):  return self._f("lt", col, value)
+    def lte(self, col, value): return self._f("lte", col, value)
+    def in_(self, col, values): return self._f("in", col, set(values))
+    def is_(self, col, value): return self._f("is", col, None if value == "null" else value)
+
+    def or_(self, filters: str):
+        self._filters.append(("logic", None, ("or", [_parse_logic(p) for p in _split_logic(filters)])))
+        return self
+
+    def ilike(self, col, pattern):
+        rx = re.compile("^" + re.escape(pattern).replace("%", ".*").replace("_", ".") + "$", re.I | re.S)
+        return self._f("ilike", col, rx)
+
+    def order(self, col, desc=False, **_):
+        self._orders.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    # ── EJECUCIÓN ────────────────────────────────────────
+    def _candidates(self) -> list:
+        """Usa un índice (eq por hash o rango de created_at) para no recorrer toda la tabla."""
+        t = self._table
+        for op, col, value in self._filters:
+            if op == "eq":
+                return list(t._index(col).get(value, []))
+        for op, col, value in self._filters:
+            if op == "in":
+                idx = t._index(col)
+                return [r for v in value for r in idx.get(v, [])]
+        lo = next((v for op, c, v in self._filters if c == "created_at" and op in ("gte", "gt")), None)
+        hi = next((v for op, c, v in self._filters if c == "created_at" and op in ("lte", "lt")), None)
+        if (lo or hi) and t._by_ts:
+            keys = t._by_ts
+            i = bisect_left(keys, (lo,)) if lo else 0
+            j = bisect_right(keys, (hi, float("inf"))) if hi else len(keys)
+            return [k[2] for k in keys[i:j]]
+        return list(t.rows)
+
+    @classmethod
+    def _match_logic(cls, row, node) -> bool:
+        if node[0] in ("and", "or"):
+            hits = (cls._match_logic(row, n) for n in node[1])
+            return all(hits) if node[0] == "and" else any(hits)
+        return cls._match(row, *node)
+
+    @classmethod
+    def _match(cls, row, op, col, value) -> bool:
+        if op == "logic":
+            return cls._match_logic(row, value)
+        v = row.get(col)
+        if op == "eq":
+            return v == value
+        if op == "neq":
+            return v != value
+        if op == "in":
+            return v in value
+        if op == "is":
+            return v is value
+        if op == "ilike":
+            return v is not None and bool(value.match(str(v)))
+        if v is None:
+            return False
+        if op == "gt":
+            return v > value
+        if op == "gte":
+            return v >= value
+        if op == "lt":
+            return v < value
+        if op == "lte":
+            return v <= value
+        raise FakeAPIError(f"operador no soportado: {op}")
+
+    def _filtered(self) -> list:
+        rows = self._candidates()
+        for op, col, value in self._filters:
+            rows = [r for r in rows if self._match(r, op, col, value)]
+        return rows
+
+    def _project(self, row: dict) -> dict:
+        if self._columns.strip() == "*":
+            return dict(row)
+        out = {}
+        for col in _split_columns(self._columns):
+            m = re.match(r"^(\w+)\((.*)\)$", col)
+            if not m:
+                out[col] = row.get(col)
+                continue
+            rel, sub = m.group(1), m.group(2)
+            fk = row.get(rel.rstrip("s") + "_id")
+            target = self._client._tables.get(rel)
+            match = target._index("id").get(fk, []) if target else []
+            if match:
+                out[rel] = {c: match[0].get(c) for c in _split_columns(sub)}
+            else:
+                out[rel] = None
+        return out
+
+    def execute(self) -> APIResponse:
+        self._client._round_trip(self._table.name)
+        with self._client._lock:
+            return self._execute()
+
+    def _execute(self) -> APIResponse:
+        t = self._table
+        if self._op in ("insert", "upsert"):
+            payload = self._payload if isinstance(self._payload, list) else [self._payload]
+            out = []
+            for p in payload:
+                row = dict(p)
+                if self._op == "upsert" and row.get("id") is not None:
+                    existing = t._index("id").get(row["id"])
+                    if existing:
+                        existing[0].update(row)
+                        t.reindex()
+                        out.append(dict(existing[0]))
+                        continue
+                t.add(row)
+                out.append(dict(row))
+            return APIResponse(out)
+
+        rows = self._filtered()
+
+        if self._op == "update":
+            payload = dict(self._payload)
+            if "created_at" in payload:
+                payload["created_at"] = _norm_ts(payload["created_at"])
+            for r in rows:
+                r.update(payload)
+            t.reindex()
+            return APIResponse([dict(r) for r in rows])
+
+        if self._op == "delete":
+            t.remove(rows)
+            return APIResponse([dict(r) for r in rows])
+
+        count = len(rows) if self._count else None
+        for col, desc in reversed(self._orders):
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col) or ""), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        data = [self._project(r) for r in rows]
+        if self._single:
+            if len(data) != 1:
+                raise FakeAPIError("JSON object requested, multiple (or no) rows returned")
+            return APIResponse(data[0], count)
+        return APIResponse(data, count)
+
+
+class FakeRPC:
+    def __init__(self, client, fn: str, params: dict):
+        self._client, self._fn, self._params = client, fn, params
+
+    def execute(self) -> APIResponse:
+        self._client._round_trip(f"rpc:{self._fn}")
+        impl = self._client._rpcs.get(self._fn)
+        if impl is None:
+            from postgrest.exceptions import APIError
+            raise APIError({"code": "PGRST202", "message": f"Could not find the function {self._fn}"})
+        with self._client._lock:
+            return APIResponse(impl(self._client, **self._params))
+
+
+class _FakeAuth:
+    def get_user(self, token):
+        raise FakeAPIError("auth remota no disponible en el benchmark")
+
+    def sign_in_with_password(self, credentials):
+        raise FakeAPIError("auth remota no disponible en el benchmark")
+
+
+class FakeSupabase:
+    """Reemplazo de `supabase.Client` para los benchmarks."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.auth = _FakeAuth()
+        self.round_trips = 0
+        self.by_table = {}
+        self._tables = {}
+        self._rpcs = {}
+        self._lock = threading.RLock()
+
+    def _round_trip(self, table: str):
+        self.round_trips += 1
+        self.by_table[table] = self.by_table.get(table, 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def table(self, name: str) -> FakeQuery:
+        if name not in self._tables:
+            self._tables[name] = FakeTable(name)
+        return FakeQuery(self, self._tables[name])
+
+    def rpc(self, fn: str, params: dict = None) -> FakeRPC:
+        return FakeRPC(self, fn, params or {})
+
+    def register_rpc(self, fn: str, impl):
+        """impl(client, **params) → data; corre con el lock del cliente (atómica)."""
+        self._rpcs[fn] = impl
+
+    def seed(self, name: str, rows: list):
+        """Carga directa (no cuenta round trips)."""
+        t = self._tables.setdefault(name, FakeTable(name))
+        for r in rows:
+            t.add(r, keep_sorted=False)
+        t._by_ts.sort(key=lambda k: (k[0], k[1]))
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.by_table = {}
@@ -0,0 +1,276 @@
+# bench/run.py — Micro-benchmarks de endpoints contra un Supabase en memoria
+"""
+Uso (desde la raíz del repo):
+
+    python -m bench.run                       # corre y compara contra bench/baseline.json
+    python -m bench.run --save-baseline       # guarda los resultados como nuevo baseline
+    python -m bench.run --latency-ms 40       # simula 40 ms de red por round trip
+    python -m bench.run --students 5000 --attendance 500000 -n 50
+
+Antes de importar la app se reemplaza `supabase.create_client` por el doble de
+bench/fake_supabase.py, así ningún handler sale a la red. Por cada endpoint se
+reporta la latencia (p50/p95/media) y los round trips a Supabase por request.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import statistics
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "bench", "baseline.json")
+
+SIGNING_KEY_HEX = "b" * 64
+JWT_SECRET = "bench-jwt-secret-0123456789abcdef0123"
+ADMIN_EMAIL = "bench@jrstars.local"
+TRAINER_TOKEN = "bench-trainer-token"
+
+NOMBRES = ["Mateo", "Santiago", "Thiago", "Sebastián", "Valentina", "Camila", "Luciana", "Diego",
+           "Gael", "Adriana", "Fabián", "Renata", "Joaquín", "Ximena", "Alonso", "Micaela"]
+APELLIDOS = ["Quispe", "Flores", "Sánchez", "Rojas", "Huamán", "García", "Mendoza", "Torres",
+             "Vargas", "Castillo", "Chávez", "Ramos", "Díaz", "Vásquez", "Paredes", "Salazar"]
+SEDES = ["Norte", "Sur", "Centro"]
+HORARIOS = ["LMV", "MJS"]
+TURNOS = ["Mañana", "Tarde"]
+
+
+# ── ENTORNO ──────────────────────────────────────────────
+def _install_fake(latency_ms: float):
+    os.environ.update({
+        "SUPABASE_URL": "http://bench.invalid",
+        "SUPABASE_KEY": "bench-key",
+        "SUPABASE_JWT_SECRET": JWT_SECRET,
+        "ADMIN_EMAILS": ADMIN_EMAIL,
+        "QR_SIGNING_KEY": SIGNING_KEY_HEX,
+        "DB_MODE": "sync",
+    })
+    from bench.fake_supabase import FakeSupabase
+    import supabase as supabase_pkg
+
+    fake = FakeSupabase(latency_ms=latency_ms)
+    fake.register_rpc("canjear_batido", _rpc_canjear_batido)
+    supabase_pkg.create_client = lambda *a, **k: fake
+    return fake
+
+
+def _rpc_canjear_batido(fake, p_student_id, p_batido_name, p_credits_used, p_emoji="🥤"):
+    """Equivalente en Python de sql/canjear_batido.sql."""
+    from bench.fake_supabase import FakeTable
+    match = fake._tables["students"]._index("id").get(p_student_id)
+    if not match:
+        return {"ok": False, "error": "no_encontrado"}
+    st = match[0]
+    if (st.get("batido_credits") or 0) < p_credits_used:
+        return {"ok": False, "error": "saldo_insuficiente"}
+    st["batido_credits"] = (st.get("batido_credits") or 0) - p_credits_used
+    fake._tables.setdefault("batido_canjes", FakeTable("batido_canjes")).add({
+        "student_id": p_student_id, "batido_name": p_batido_name,
+        "credits_used": p_credits_used, "emoji": p_emoji})
+    return {"ok": True, "alumno": st["full_name"], "saldo_restante": st["batido_credits"]}
+
+
+def _seed(fake, n_students: int, n_attendance: int, rng: random.Random) -> list:
+    hoy = datetime.now(timezone.utc)
+    students = []
+    for i in range(n_students):
+        nombre = f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+        students.append({
+            "id":             str(uuid.UUID(int=rng.getrandbits(128))),
+            "full_name":      nombre,
+            "dni":            f"{70000000 + i}",
+            "is_active":      rng.random() < 0.9,
+            "valid_until":    (hoy + timedelta(days=rng.randint(-20, 30))).strftime("%Y-%m-%d"),
+            "batido_credits": rng.randint(0, 10),
+            "horario":        rng.choice(HORARIOS),
+            "turno":          rng.choice(TURNOS),
+            "sede":           rng.choice(SEDES),
+        })
+    fake.seed("students", students)
+    fake.seed("credentials", [
+        {"student_id": s["id"], "code": f"STU-{i:08d}", "type": "qr", "is_active": True}
+        for i, s in enumerate(students)
+    ])
+    fake.seed("entrenadores", [{"nombre": "Bench", "token": TRAINER_TOKEN, "is_active": True}])
+
+    ids = [s["id"] for s in students]
+    fake.seed("attendance", [
+        {"student_id": rng.choice(ids),
+         "created_at": (hoy - timedelta(days=2, seconds=rng.randint(0, 180 * 86400))).isoformat()}
+        for _ in range(n_attendance)
+    ])
+    bio = []
+    for s in rng.sample(students, n_students // 2):
+        for m in range(6):
+            fecha = hoy - timedelta(days=30 * m)
+            bio.append({"student_id": s["id"], "fecha": fecha.strftime("%Y-%m-%d"),
+                        "talla": round(rng.uniform(1.20, 1.85), 2), "peso": rng.randint(25, 80),
+                        "created_at": fecha.isoformat()})
+    fake.seed("biometria", bio)
+    return students
+
+
+# ── PAYLOADS ─────────────────────────────────────────────
+def _jrs(student: dict) -> str:
+    valid = student["valid_until"].replace("-", "")
+    name = student["full_name"]
+    msg = f"{student['id']}|{valid}|{name}".encode("utf-8")
+    sig = hmac.new(bytes.fromhex(SIGNING_KEY_HEX), msg, hashlib.sha256).digest()[:8].hex()
+    name_b64 = base64.urlsafe_b64encode(name.encode("utf-8")).rstrip(b"=").decode()
+    return f"JRS:{student['id']}:{valid}:{name_b64}:{sig}"
+
+
+def _admin_headers() -> dict:
+    import jwt
+    token = jwt.encode({
+        "sub": str(uuid.uuid4()), "email": ADMIN_EMAIL, "aud": "authenticated",
+        "exp": int(time.time()) + 3600,
+    }, JWT_SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+def _cases(students: list, rng: random.Random) -> list:
+    activos = [s for s in students if s["is_active"]]
+    rng.shuffle(activos)
+    scan_pool = iter(activos)
+    admin = _admin_headers()
+    hoy = datetime.now(timezone.utc)
+    mes = hoy.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+    def scan(c):
+        return c.post("/attendance/scan", json={"code": _jrs(next(scan_pool))})
+
+    def sync_batch(c):
+        records = [{
+            "student_id": rng.choice(activos)["id"],
+            "timestamp":  (hoy - timedelta(minutes=rng.randint(0, 600))).isoformat(),
+            "local_id":   str(uuid.uuid4()),
+        } for _ in range(200)]
+        return c.post("/attendance/sync-batch", json={"records": records, "token": TRAINER_TOKEN})
+
+    def student_info(c):
+        return c.get(f"/public/student/{rng.choice(activos)['dni']}/info")
+
+    def ranking(c):
+        return c.get("/public/ranking", params={"campo": rng.choice(["talla", "peso"]),
+                                                 "sede": rng.choice(SEDES + [None]) or ""})
+
+    def leaderboard(c):
+        return c.get("/public/leaderboard/month")
+
+    def canjear(c):
+        st = rng.choice(activos)
+        st["batido_credits"] = max(st["batido_credits"], 1)
+        return c.post("/batidos/canjear", json={"student_id": st["id"], "batido_name": "Fresa", "credits_used": 1})
+
+    def attendance_range(c):
+        return c.get("/admin/attendance/range", headers=admin,
+                     params={"start": mes.isoformat(), "end": hoy.isoformat()})
+
+    return [
+        ("POST /attendance/scan", scan),
+        ("POST /attendance/sync-batch (200)", sync_batch),
+        ("GET /public/student/{dni}/info", student_info),
+        ("GET /public/ranking", ranking),
+        ("GET /public/leaderboard/month", leaderboard),
+        ("POST /batidos/canjear", canjear),
+        ("GET /admin/attendance/range (mes)", attendance_range),
+    ]
+
+
+# ── MEDICIÓN ─────────────────────────────────────────────
+def _measure(client, fake, fn, iterations: int, warmup: int) -> dict:
+    for _ in range(warmup):
+        fn(client)
+    latencias, trips = [], []
+    for _ in range(iterations):
+        antes = fake.round_trips
+        t0 = time.perf_counter()
+        res = fn(client)
+        latencias.append((time.perf_counter() - t0) * 1000)
+        trips.append(fake.round_trips - antes)
+        if res.status_code >= 500:
+            raise RuntimeError(f"HTTP {res.status_code}: {res.text[:200]}")
+    latencias.sort()
+    return {
+        "p50_ms":        round(statistics.median(latencias), 3),
+        "p95_ms":        round(latencias[max(0, int(len(latencias) * 0.95) - 1)], 3),
+        "mean_ms":       round(statistics.fmean(latencias), 3),
+        "round_trips":   round(statistics.fmean(trips), 2),
+        "iterations":    iterations,
+    }
+
+
+def _delta(actual: float, base: float) -> str:
+    if not base:
+        return ""
+    pct = (actual - base) / base * 100
+    return f"{pct:+.0f}%"
+
+
+def _report(results: dict, baseline: dict):
+    print(f"{'endpoint':38} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'RT/req':>7}  vs baseline (p50 / RT)")
+    for name, r in results.items():
+        b = baseline.get(name, {})
+        comp = ""
+        if b:
+            comp = f"{_delta(r['p50_ms'], b.get('p50_ms')):>6} / {_delta(r['round_trips'], b.get('round_trips')):>6}"
+        print(f"{name:38} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['mean_ms']:9.2f} {r['round_trips']:7.2f}  {comp}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de endpoints con Supabase en memoria")
+    parser.add_argument("--students", type=int, default=3000)
+    parser.add_argument("--attendance", type=int, default=300_000)
+    parser.add_argument("-n", "--iterations", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latencia simulada por round trip")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json-out", help="escribe los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    rng = random.Random(args.seed)
+    fake = _install_fake(args.latency_ms)
+    print(f"Sembrando {args.students} alumnos y {args.attendance} asistencias...")
+    students = _seed(fake, args.students, args.attendance, rng)
+
+    from fastapi.testclient import TestClient
+    from main import app
+
+    results = {}
+    with TestClient(app) as client:
+        for name, fn in _cases(students, rng):
+            fake.reset_counters()
+            results[name] = _measure(client, fake, fn, args.iterations, args.warmup)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    _report(results, baseline)
+
+    payload = {
+        "params": {k: getattr(args, k) for k in ("students", "attendance", "iterations", "latency_ms", "seed")},
+        "results": results,
+    }
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(payload, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(payload, f, indent=2)
+        print(f"Baseline guardado en {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
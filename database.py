@@ -1,11 +1,71 @@
 # database.py
 import os
-from supabase import create_client, Client
+from typing import Optional
+from supabase import create_client, Client, acreate_client, AsyncClient
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from services.metrics import InstrumentedClient
 
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
\ No newline at end of file
+# DB_MODE=async → los routers async usan el cliente asíncrono de Supabase (httpx.AsyncClient).
+# DB_MODE=sync (default) → usan el cliente síncrono dentro del threadpool de Starlette.
+DB_MODE = os.getenv("DB_MODE", "sync").strip().lower()
+
+# Tamaño de página para lecturas completas (PostgREST corta en 1000 filas por defecto)
+PAGE_SIZE = 1000
+
+# Envuelto para medir cada consulta (ver services/metrics.py y /metrics)
+supabase: Client = InstrumentedClient(create_client(SUPABASE_URL, SUPABASE_KEY))
+
+_async_supabase: Optional[AsyncClient] = None
+
+
+async def get_async_supabase() -> AsyncClient:
+    """Cliente asíncrono compartido; se crea en el arranque (ver main.py) o al primer uso."""
+    global _async_supabase
+    if _async_supabase is None:
+        _async_supabase = InstrumentedClient(await acreate_client(SUPABASE_URL, SUPABASE_KEY))
+    return _async_supabase
+
+
+async def db_execute(build):
+    """
+    Ejecuta una consulta PostgREST sin bloquear el event loop.
+    `build` recibe el cliente y devuelve el query builder SIN .execute():
+
+        res = await db_execute(lambda db: db.table("students").select("id").eq("id", sid))
+    """
+    if DB_MODE == "async":
+        client = await get_async_supabase()
+        return await build(client).execute()
+    return await run_in_threadpool(lambda: build(supabase).execute())
+
+
+def fetch_all(build, page_size: int = PAGE_SIZE) -> list:
+    """
+    Lee todas las filas de una consulta paginando con .range() (versión síncrona).
+    `build` debe incluir un .order() estable para que las páginas no se solapen.
+    """
+    rows, start = [], 0
+    while True:
+        page = build(supabase).range(start, start + page_size - 1).execute().data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
+
+
+async def db_fetch_all(build, page_size: int = PAGE_SIZE) -> list:
+    """Versión async de fetch_all()."""
+    rows, start = [], 0
+    while True:
+        res = await db_execute(lambda db: build(db).range(start, start + page_size - 1))
+        page = res.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        start += page_size
@@ -323,16 +323,16 @@ async function verQR(studentId) {
   try {
     const res = await fetch(`/credentials/${studentId}`, { headers: H });
     const data = await res.json();
-    let codeStr = '';
+    let qrImageUrl = '';
     if (data.length > 0) {
-      codeStr = data[0].code;
+      qrImageUrl = data[0].qr_url;
     } else {
       showToast('Generando nuevo QR...', 'ok');
       const gen = await fetch(`/credentials/generate/${studentId}`, { method: 'POST', headers: H });
       const d = await gen.json();
-      codeStr = d.code;
+      qrImageUrl = d.qr_url;
     }
-    const qrImageUrl = `https://api.qrserver.com/v1/create-qr-code/?size=300x300&data=${codeStr}`;
+    // Imagen generada por el backend en /qrs (sin servicios externos)
     window.open(qrImageUrl, '_blank');
   } catch {
     showToast('❌ Error al obtener el QR.', 'error');
@@ -827,31 +827,25 @@ async function loadCalendario() {
   updateCalLabel();
 
   try {
-    const daysInMonth = new Date(calYear, calMonth + 1, 0).getDate();
     const mm = String(calMonth + 1).padStart(2, '0');
-    const dd = String(daysInMonth).padStart(2, '0');
-    const first = `${calYear}-${mm}-01T00:00:00`;
-    const last = `${calYear}-${mm}-${dd}T23:59:59`;
     const ts = Date.now();
 
-    const [studRes, rangeRes] = await Promise.all([
-      fetch(`/admin/students?_=${ts}`, { headers: H }),
-      fetch(`/admin/attendance/range?start=${first}&end=${last}&_=${ts}`, { headers: H })
-    ]);
+    // Alumnos activos + máscara de días asistidos (bit d-1 = día d) en una sola llamada
+    const matrixRes = await fetch(`/admin/attendance/matrix?month=${calYear}-${mm}&_=${ts}`, { headers: H });
 
-    if (studRes.status === 401 || rangeRes.status === 401) { logout(); return; }
-    if (!studRes.ok) throw new Error(`Error alumnos: ${studRes.status}`);
-    if (!rangeRes.ok) throw new Error(`Error asistencia: ${rangeRes.status}`);
+    if (matrixRes.status === 401) { logout(); return; }
+    if (!matrixRes.ok) throw new Error(`Error asistencia: ${matrixRes.status}`);
 
-    _calStudents = await studRes.json();
-    const attData = await rangeRes.json();
+    const matrix = await matrixRes.json();
+    _calStudents = matrix.students;
 
     // Mapear student_id + fecha → true
     _calAttMap = {};
-    attData.forEach(r => {
-      if (r.student_id && r.created_at) {
-        const fecha = r.created_at.substring(0, 10);
-        _calAttMap[`${r.student_id}_${fecha}`] = true;
+    _calStudents.forEach(s => {
+      for (let d = 1; d <= matrix.days; d++) {
+        if (s.mask & (1 << (d - 1))) {
+          _calAttMap[`${s.id}_${calYear}-${mm}-${String(d).padStart(2, '0')}`] = true;
+        }
       }
     });
 
@@ -1018,7 +1012,7 @@ async function buscarParaBio() {
   if (q.length < 2) { el.innerHTML = ''; return; }
 
   if (!_bioStudents.length) {
-    const res = await fetch('/admin/alumnos', { headers: H });
+    const res = await fetch('/admin/alumnos?fields=id,full_name,dni', { headers: H });
     _bioStudents = await res.json();
   }
 
@@ -130,11 +130,23 @@ function addHistory(estado, nombre) {
 
 // ── SINCRONIZACIÓN OFFLINE ────────────────────────────
 function fetchOfflineData() {
-    fetch('/attendance/scanner/offline-data')
-        .then(res => res.json())
+    // Sincronización delta: solo se descargan los alumnos que cambiaron desde la última versión
+    const stored = localStorage.getItem('scanner_offline_db');
+    const version = stored ? localStorage.getItem('scanner_offline_version') : null;
+    const url = '/attendance/scanner/offline-data' + (version ? `?since=${version}` : '?since=0');
+    const headers = version ? { 'If-None-Match': `"${version}"` } : {};
+
+    fetch(url, { headers })
+        .then(res => res.status === 304 ? null : res.json())
         .then(data => {
-            localStorage.setItem('scanner_offline_db', JSON.stringify(data));
-            console.log("Base de datos offline actualizada:", Object.keys(data).length, "registros");
+            if (!data) return;  // sin cambios
+            const db = data.full ? {} : JSON.parse(stored || '{}');
+            Object.assign(db, data.students || {});
+            (data.removed || []).forEach(id => delete db[id]);
+            localStorage.setItem('scanner_offline_db', JSON.stringify(db));
+            localStorage.setItem('scanner_offline_version', String(data.version));
+            console.log("Base de datos offline actualizada:", Object.keys(db).length, "registros",
+                data.full ? "(completa)" : `(${Object.keys(data.students || {}).length} cambios)`);
         })
         .catch(err => console.log("Error actualizando DB offline:", err));
 }
@@ -1,12 +1,29 @@
 # main.py
 import os
+import time
+import asyncio
 import uvicorn
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Request, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse
 from routers import students, credentials, attendance, batidos, admin, entrenador
-from database import supabase
+from routers.admin import verify_admin
+from database import supabase, DB_MODE, get_async_supabase
+from services.student_cache import student_directory
+from services.leaderboard import monthly_counters
+from services.streaks import streak_index
+from services.biometria_index import latest_biometria
+from services.trainer_tokens import trainer_tokens
+from services.scan_dedup import recent_scans
+from services.attendance_journal import attendance_journal, WRITE_BEHIND
+from services.metrics import metrics, start_request, end_request, METRICS_ALLOW
+from services.qr_render import qr_cache
+from services.static_assets import static_assets
+from services.response_cache import public_cache
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
 try:
     from zoneinfo import ZoneInfo
 except ImportError:
@@ -25,10 +42,76 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- MÉTRICAS POR REQUEST ---
+@app.middleware("http")
+async def _medir_request(request: Request, call_next):
+    queries, token = start_request()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Se etiqueta por plantilla de ruta (/admin/alumnos/{student_id}), no por URL cruda
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.observe_request(request.method, route, status, time.perf_counter() - t0, queries)
+        end_request(token)
+
+# --- ARRANQUE ---
+@app.on_event("startup")
+async def _conectar_db():
+    # En modo async el cliente se crea una vez aquí, no en la primera petición
+    if DB_MODE == "async":
+        await get_async_supabase()
+
+# Referencias a las tareas de fondo (evita que el GC las cancele)
+_tareas_de_fondo = []
+
+@app.on_event("startup")
+async def _lanzar_tareas_de_fondo():
+    # Con varios workers (WEB_CONCURRENCY > 1) cada uno escucha las invalidaciones de los demás
+    invalidation_bus.start()
+    _tareas_de_fondo.append(asyncio.create_task(trainer_tokens.run_flusher()))
+    _tareas_de_fondo.append(asyncio.create_task(_precalentar_dedup()))
+    qr_cache.prune()
+    # frontend/ en memoria con gzip/zstd precalculados (ver services/static_assets.py)
+    static_assets.load()
+    if replica.enabled:
+        # Réplica SQLite de las tablas calientes (una por worker, como el diario)
+        replica.path = invalidation_bus.per_worker(replica.path)
+        replica.open()
+        _tareas_de_fondo.append(asyncio.create_task(replica.run()))
+    if WRITE_BEHIND:
+        # Un diario por worker (data/attendance_journal.<slot>.jsonl con el bus activo);
+        # lo que quedó de una ejecución anterior se inserta primero
+        attendance_journal.path = invalidation_bus.per_worker(attendance_journal.path)
+        attendance_journal.load()
+        _tareas_de_fondo.append(asyncio.create_task(attendance_journal.run_flusher()))
+
+async def _precalentar_dedup():
+    # Si falla, el dedup de scans sigue funcionando contra la BD
+    try:
+        await recent_scans.warm()
+    except Exception as e:
+        print(f"[startup] No se pudo precalentar el índice de scans: {e}")
+
+@app.on_event("shutdown")
+async def _vaciar_pendientes():
+    await trainer_tokens.flush()
+    if WRITE_BEHIND:
+        await attendance_journal.flush()
+    qr_cache.shutdown()
+    invalidation_bus.stop()
+    replica.close()
+
 # --- ARCHIVOS ESTÁTICOS ---
 os.makedirs("qrs", exist_ok=True)
 app.mount("/qrs", StaticFiles(directory="qrs"), name="qrs")
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+
+@app.get("/static/{path:path}")
+def static_file(path: str, request: Request):
+    return static_assets.serve(path, request)
 
 # --- ROUTERS ---
 app.include_router(admin.router)
@@ -40,65 +123,62 @@ app.include_router(entrenador.router)
 
 # --- PÁGINAS ---
 @app.get("/")
-def home():
-    return FileResponse("frontend/home/index.html")
+def home(request: Request):
+    return static_assets.page("home/index.html", request)
 
 @app.get("/scanner")
-def scanner():
-    return FileResponse("frontend/scanner/index.html")
+def scanner(request: Request):
+    return static_assets.page("scanner/index.html", request)
 
 
 @app.get("/caja")
-def caja_page():
-    return FileResponse("frontend/caja/index.html")
+def caja_page(request: Request):
+    return static_assets.page("caja/index.html", request)
 
 @app.get("/admin/login")
-def admin_login_page():
-    return FileResponse("frontend/admin/login.html")
+def admin_login_page(request: Request):
+    return static_assets.page("admin/login.html", request)
 
 @app.get("/admin")
-def admin_panel():
-    return FileResponse("frontend/admin/index.html")
+def admin_panel(request: Request):
+    return static_assets.page("admin/index.html", request)
 
 @app.get("/entrenador/login")
-def entrenador_login_page():
-    return FileResponse("frontend/entrenador/login.html")
+def entrenador_login_page(request: Request):
+    return static_assets.page("entrenador/login.html", request)
 
 @app.get("/entrenador")
-def entrenador_panel():
-    return FileResponse("frontend/entrenador/index.html")
+def entrenador_panel(request: Request):
+    return static_assets.page("entrenador/index.html", request)
 
 @app.get("/status")
 def status():
     return {"status": "Backend funcionando 🚀"}
 
+def verify_metrics_access(request: Request, authorization: Optional[str] = Header(None)):
+    """El scraper desde METRICS_ALLOW entra directo; cualquier otro necesita token de admin."""
+    if request.client is not None and request.client.host in METRICS_ALLOW:
+        return
+    verify_admin(authorization)
+
+@app.get("/metrics", dependencies=[Depends(verify_metrics_access)])
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # --- ENDPOINTS PÚBLICOS ---
+# Respuestas cacheadas por ruta+parámetros (ver services/response_cache.py);
+# las escrituras de asistencia (services/events.py) y de biometría las invalidan
 @app.get("/public/leaderboard/month")
+@public_cache.cached("/public/leaderboard/month")
 def leaderboard_mes():
-    from datetime import datetime
-    today = datetime.now(PERU_TZ)
-    first_day = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-
-    res = supabase.table("attendance").select("student_id").gte("created_at", first_day).execute()
-    if not res.data:
-        return []
-
-    counts = {}
-    for r in res.data:
-        sid = r["student_id"]
-        counts[sid] = counts.get(sid, 0) + 1
-
-    top_sids = sorted(counts.items(), key=lambda x: x[1], reverse=True)[:5]
+    # Top-5 desde los contadores mensuales en memoria (ver services/leaderboard.py)
+    top_sids = monthly_counters.top(5)
     if not top_sids:
         return []
 
-    ids = [t[0] for t in top_sids]
-    st_res = supabase.table("students").select("id, full_name").in_("id", ids).execute()
-    st_map = {s["id"]: s for s in (st_res.data or [])}
-
     result = []
     for sid, count in top_sids:
-        st = st_map.get(sid)
+        st = student_directory.get(sid)
         if st:
             parts = st["full_name"].split(" ")
             short = parts[0] + (" " + parts[1][0] + "." if len(parts) > 1 else "")
@@ -129,6 +209,9 @@ def registrar_biometria(payload: dict = __import__('fastapi').Body(...)):
         except: pass
 
     res = supabase.table("biometria").insert(data).execute()
+    if res.data:
+        latest_biometria.record_insert(res.data[0])
+    public_cache.invalidate("/public/ranking", "/public/student/{dni_or_id}/info")
     return res.data[0] if res.data else {}
 
 
@@ -145,66 +228,37 @@ def historial_biometria(student_id: str):
 @app.delete("/admin/biometria/{record_id}")
 def eliminar_biometria(record_id: str):
     """Elimina una medición biométrica."""
-    supabase.table("biometria").delete().eq("id", record_id).execute()
+    res = supabase.table("biometria").delete().eq("id", record_id).execute()
+    latest_biometria.record_delete(res.data or [])
+    public_cache.invalidate("/public/ranking", "/public/student/{dni_or_id}/info")
     return {"ok": True}
 
 
 # ── RANKING PÚBLICO (con filtros) ──────────────────────────────────────────
 
 @app.get("/public/ranking")
+@public_cache.cached("/public/ranking")
 def ranking_publico(categoria: str = None, sede: str = None, campo: str = "talla"):
     """
     Ranking de atletas por campo biométrico (talla o peso).
     Filtra por categoría y/o sede.
     """
-    from datetime import datetime
-
-    # Traer todos los students activos
-    q = supabase.table("students").select("id, full_name, horario, sede")
-    q = q.eq("is_active", True)
-    if sede:
-        q = q.eq("sede", sede)
-    st_res = q.execute()
-    students_list = st_res.data or []
-    if not students_list:
-        return []
-
-    # Filtrar por categoría (horario en students)
-    if categoria:
-        students_list = [s for s in students_list if (s.get("horario") or "") == categoria]
-
-    ids = [s["id"] for s in students_list]
-    if not ids:
+    # Students activos desde el directorio en memoria, filtrados por sede y categoría (horario)
+    alumnos = {
+        s["id"]: s for s in student_directory.active()
+        if (not sede or s.get("sede") == sede)
+        and (not categoria or (s.get("horario") or "") == categoria)
+    }
+    if not alumnos:
         return []
 
-    st_map = {s["id"]: s for s in students_list}
-
-    # Traer la última medición biométrica de cada alumno
-    bio_res = supabase.table("biometria") \
-        .select("student_id, talla, peso, fecha, created_at") \
-        .in_("student_id", ids) \
-        .order("created_at", desc=True).execute()
-
-    # Quedarme solo con la medición más reciente por alumno
-    last_bio = {}
-    for r in (bio_res.data or []):
-        sid = r["student_id"]
-        if sid not in last_bio:
-            last_bio[sid] = r
-
-    # Construir resultados con dato del campo solicitado
+    # Top 20 contra el índice de última medición por alumno
     result = []
-    for sid, bio in last_bio.items():
-        st = st_map.get(sid)
-        if not st:
-            continue
-        val = bio.get(campo)
-        if val is None:
-            continue
+    for st, bio in latest_biometria.top(campo, alumnos, limit=20):
         parts = st["full_name"].split(" ")
         short = parts[0] + (" " + parts[1][0] + "." if len(parts) > 1 else "")
         result.append({
-            "student_id": sid,
+            "student_id": st["id"],
             "name":       short,
             "full_name":  st["full_name"],
             "sede":       st.get("sede") or "",
@@ -212,35 +266,33 @@ def ranking_publico(categoria: str = None, sede: str = None, campo: str = "talla
             "talla":      bio.get("talla"),
             "peso":       bio.get("peso"),
             "fecha":      bio.get("fecha"),
-            "valor":      float(val),
+            "valor":      float(bio[campo]),
         })
-
-    # Ordenar por valor descendente y tomar top 20
-    result.sort(key=lambda x: x["valor"], reverse=True)
-    return result[:20]
+    return result
 
 
 
 @app.get("/public/student/{dni_or_id}/info")
+@public_cache.cached("/public/student/{dni_or_id}/info", private=True)
 def student_public_info(dni_or_id: str):
-    from datetime import datetime, timedelta
+    from datetime import datetime
     from fastapi import HTTPException
 
-    # 1. Buscar atleta activo — por DNI o ID
-    query = supabase.table("students").select("id, full_name, valid_until, horario, sede, batido_credits").eq("is_active", True)
-    
     # Si parece un UUID (JRS offline payload envía el UUID en el código)
-    if len(dni_or_id) > 15:
-        query = query.eq("id", dni_or_id)
+    columna = "id" if len(dni_or_id) > 15 else "dni"
+    desde_replica = replica.ready("students", "biometria")
+
+    # 1. Buscar atleta activo — por DNI o ID
+    if desde_replica:
+        student = replica.student_by(columna, dni_or_id)
     else:
-        query = query.eq("dni", dni_or_id)
-        
-    res = query.execute()
+        res = supabase.table("students").select("id, full_name, valid_until, horario, sede, batido_credits") \
+            .eq("is_active", True).eq(columna, dni_or_id).execute()
+        student = res.data[0] if res.data else None
 
-    if not res.data:
+    if not student:
         raise HTTPException(status_code=404, detail="Atleta no encontrado")
 
-    student = res.data[0]
     sid = student["id"]
 
     # 2. Estado de pago
@@ -253,60 +305,33 @@ def student_public_info(dni_or_id: str):
         debe = True
 
     # 3. Racha consecutiva real (sesiones sin romper la cadena)
-    #    - Trae últimas 90 días de asistencia, ordenado más reciente primero
     #    - Gap permitido: ≤ 4 días (cubre fines de semana + horario LMV/MJS)
-    #    - Si el gap entre dos sesiones > 4 días, la racha se rompe
-    ahora_lima = datetime.now(PERU_TZ)
-    noventa_dias = (ahora_lima - timedelta(days=90)).isoformat()
-    att_res = supabase.table("attendance").select("created_at") \
-        .eq("student_id", sid) \
-        .gte("created_at", noventa_dias) \
-        .order("created_at", desc=True).execute()
-
-    racha = 0
-    if att_res.data:
-        # Convertir timestamps a fechas únicas (1 por día como máximo)
-        fechas_vistas = set()
-        fechas_ord = []
-        for r in att_res.data:
-            try:
-                ts = datetime.fromisoformat(r["created_at"].replace("Z", "+00:00"))
-                dia = ts.astimezone(PERU_TZ).date()
-            except Exception:
-                continue
-            if dia not in fechas_vistas:
-                fechas_vistas.add(dia)
-                fechas_ord.append(dia)
-        # fechas_ord está ordenada de más reciente a más antigua
-        if fechas_ord:
-            racha = 1
-            for i in range(1, len(fechas_ord)):
-                gap = (fechas_ord[i - 1] - fechas_ord[i]).days
-                if gap <= 4:
-                    racha += 1
-                else:
-                    break
+    #    - Estado precalculado por alumno (ver services/streaks.py)
+    racha = streak_index.get(sid)
 
     # 4+5. Biometria real desde tabla biometria — sin datos inventados
-    bio_res = supabase.table("biometria") \
-        .select("fecha, talla, peso") \
-        .eq("student_id", sid) \
-        .order("created_at", desc=True).limit(12).execute()
+    if desde_replica:
+        mediciones = replica.biometria_for(sid, 12)
+    else:
+        mediciones = supabase.table("biometria") \
+            .select("fecha, talla, peso") \
+            .eq("student_id", sid) \
+            .order("created_at", desc=True).limit(12).execute().data
 
     historial     = []
     talla_actual  = None
     peso_actual   = None
     delta_talla   = None
 
-    if bio_res.data:
+    if mediciones:
         # La más reciente es el primer registro
-        ultimo = bio_res.data[0]
+        ultimo = mediciones[0]
         talla_actual = f"{ultimo['talla']}m" if ultimo.get("talla") is not None else None
         peso_actual  = f"{ultimo['peso']}kg" if ultimo.get("peso")  is not None else None
 
         # Delta talla: diferencia entre el último y el anterior
-        if len(bio_res.data) >= 2:
-            anterior = bio_res.data[1]
+        if len(mediciones) >= 2:
+            anterior = mediciones[1]
             if ultimo.get("talla") and anterior.get("talla"):
                 diff = round(float(ultimo["talla"]) - float(anterior["talla"]), 2)
                 delta_talla = f"+{int(diff*100)}cm" if diff >= 0 else f"{int(diff*100)}cm"
@@ -317,7 +342,7 @@ def student_public_info(dni_or_id: str):
                 "talla": f"{r['talla']}m" if r.get("talla") is not None else "—",
                 "peso":  f"{r['peso']}kg"  if r.get("peso")  is not None else "—",
             }
-            for r in bio_res.data
+            for r in mediciones
         ]
 
     horario   = student.get("horario") or "LMV"
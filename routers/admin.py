@@ -1,9 +1,27 @@
 # routers/admin.py
 import os
 from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 from database import supabase
+from services.student_cache import student_directory
+from services.streaks import streak_index
+from services.admin_auth import token_verifier, AuthUser, Unverifiable
+from services.trainer_tokens import trainer_tokens
+from services.scan_dedup import recent_scans
+from services.attendance_journal import attendance_journal
+from services.student_listing import list_students
+from services.attendance_matrix import attendance_matrix
+from services.name_search import name_search
+from services.daily_stats import daily_counters
+from services.qr_render import qr_cache
+from services.jrs_codec import legacy_credentials
+from services.response_cache import public_cache
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
+from services import attendance_export
+import jwt
 from datetime import datetime, timedelta, timezone
 try:
     from zoneinfo import ZoneInfo          # Python 3.9+
@@ -48,19 +66,41 @@ def verify_admin(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Token requerido")
 
     token = authorization.replace("Bearer ", "")
-    try:
-        user = supabase.auth.get_user(token)
-        if not user or not user.user:
-            raise HTTPException(status_code=401, detail="Token inválido")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+
+    # 1. Token ya verificado hace poco → 2. verificación local (firma + exp) →
+    # 3. solo si no se puede verificar localmente, la llamada remota a Supabase Auth
+    user = token_verifier.cached(token)
+    if user is None:
+        try:
+            user = token_verifier.verify(token)
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Token inválido o expirado")
+        except Unverifiable:
+            user = _verify_remote(token)
 
     # Verificar que el email está en la lista de admins (env var ADMIN_EMAILS)
-    email = user.user.email.strip().lower()
+    email = (user.email or "").strip().lower()
     if _ADMIN_EMAILS and email not in _ADMIN_EMAILS:
         raise HTTPException(status_code=403, detail="Acceso denegado: no eres administrador")
 
-    return user.user
+    return user
+
+
+def _verify_remote(token: str) -> AuthUser:
+    """Verificación contra Supabase Auth (red) para tokens que no se pueden validar localmente."""
+    token_verifier.remote_fallbacks += 1
+    try:
+        res = supabase.auth.get_user(token)
+        if not res or not res.user:
+            raise HTTPException(status_code=401, detail="Token inválido")
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+
+    user = AuthUser(id=res.user.id, email=res.user.email or "")
+    token_verifier.remember(token, user)
+    return user
 
 
 
@@ -84,27 +124,22 @@ def admin_login(body: LoginRequest):
 # ── STATS DEL DÍA ─────────────────────────────────────────
 @router.get("/stats")
 def get_stats(admin=Depends(verify_admin)):
-    """Estadísticas rápidas del día de hoy."""
-    hoy = datetime.now(PERU_TZ).strftime("%Y-%m-%d")
-
-    total = supabase.table("students").select("id", count="exact").eq("is_active", True).execute()
-    presentes_hoy = supabase.table("attendance").select("id", count="exact") \
-        .gte("created_at", f"{hoy}T00:00:00-05:00") \
-        .lte("created_at", f"{hoy}T23:59:59-05:00").execute()
-
-    return {
-        "total_alumnos": total.count or 0,
-        "presentes_hoy": presentes_hoy.count or 0,
-        "ausentes_hoy": max(0, (total.count or 0) - (presentes_hoy.count or 0)),
-        "fecha": hoy
-    }
+    """Estadísticas rápidas del día de hoy (contadores en memoria, ver services/daily_stats.py)."""
+    return daily_counters.snapshot()
 
 
 # ── ALUMNOS (Inscripción con Cobro Inicial) ───────────────
 @router.get("/alumnos")
-def get_alumnos(admin=Depends(verify_admin)):
-    res = supabase.table("students").select("*").order("full_name").execute()
-    return res.data or []
+def get_alumnos(fields: Optional[str] = None, cursor: Optional[str] = None,
+                limit: Optional[int] = None, format: Optional[str] = None,
+                admin=Depends(verify_admin)):
+    """
+    Sin parámetros devuelve el arreglo completo. `limit`/`cursor` paginan por
+    (full_name, id), `fields=id,full_name,dni` proyecta columnas y
+    `format=ndjson` transmite una fila por línea.
+    """
+    return list_students(lambda db, select: db.table("students").select(select),
+                         "*", fields, cursor, limit, format)
 
 class AlumnoCreate(BaseModel):
     full_name: str
@@ -148,18 +183,21 @@ def crear_alumno(body: AlumnoCreate, admin=Depends(verify_admin)):
     res = supabase.table("students").insert(insert_data).execute()
     
     nuevo_alumno = res.data[0]
-    
+    student_directory.invalidate(nuevo_alumno["id"])
+
     # 2. Generar el código de credencial automáticamente
     try:
         alphabet = string.ascii_uppercase + string.digits
         codigo_qr = f"STU-{''.join(secrets.choice(alphabet) for _ in range(8))}"
         
-        supabase.table("credentials").insert({
+        cred = supabase.table("credentials").insert({
             "student_id": nuevo_alumno["id"],
             "code": codigo_qr,
             "type": "qr",
             "is_active": True
         }).execute()
+        for c in (cred.data or []):
+            legacy_credentials.add(c["code"], c["id"], c["student_id"])
     except Exception as e:
         print(f"Error generando credencial automática: {e}")
 
@@ -222,6 +260,9 @@ def actualizar_alumno(student_id: str, body: StudentUpdate, admin=Depends(verify
         .eq("id", student_id)
         .execute()
     )
+    student_directory.invalidate(student_id)
+    if "valid_until" in payload or "full_name" in payload:
+        qr_cache.evict_student(student_id)     # el QR firmado incluye ambos
     if not res.data:
         raise HTTPException(status_code=404, detail="Alumno no encontrado")
 
@@ -235,6 +276,7 @@ def eliminar_alumno(student_id: str, admin=Depends(verify_admin)):
     if alumno_actual.data:
         nuevo_estado = not alumno_actual.data["is_active"]
         supabase.table("students").update({"is_active": nuevo_estado}).eq("id", student_id).execute()
+        student_directory.invalidate(student_id)
     return {"ok": True}
 
 
@@ -262,28 +304,13 @@ def get_alumno_by_dni(dni: str, admin=Depends(verify_admin)):
 
 @router.get("/alumnos/buscar")
 def buscar_alumno_por_nombre(q: str = "", admin=Depends(verify_admin)):
-    """Busca alumnos por nombre completo (búsqueda parcial). Devuelve hasta 10 coincidencias."""
+    """
+    Busca alumnos por nombre (sin importar tildes) o DNI, en memoria.
+    Devuelve hasta 10 coincidencias, las más parecidas primero.
+    """
     if len(q.strip()) < 2:
         return []
-    res = supabase.table("students") \
-        .select("id, full_name, dni, batido_credits, valid_until, is_active, horario") \
-        .ilike("full_name", f"%{q.strip()}%") \
-        .order("full_name") \
-        .limit(10) \
-        .execute()
-    
-    hoy = datetime.now(PERU_TZ).date()
-    alumnos = []
-    for alumno in (res.data or []):
-        dias_restantes = 0
-        if alumno.get("valid_until"):
-            vencimiento = datetime.strptime(alumno["valid_until"], "%Y-%m-%d").date()
-            dias_restantes = (vencimiento - hoy).days
-            if dias_restantes < 0:
-                dias_restantes = 0
-        alumno["dias_restantes"] = dias_restantes
-        alumnos.append(alumno)
-    return alumnos
+    return name_search.search(q, limit=10)
 
 
 # ── BÓVEDA FINANCIERA (Renovación de Mensualidades) ─────────
@@ -320,6 +347,8 @@ def pagar_mensualidad(body: PagoMensualidad, admin=Depends(verify_admin)):
     supabase.table("students").update({
         "valid_until": fecha_str
     }).eq("id", body.student_id).execute()
+    student_directory.invalidate(body.student_id)
+    qr_cache.evict_student(body.student_id)
 
     # Registrar en el libro contable
     fecha_inicio_str = hoy.strftime("%Y-%m-%d")
@@ -375,6 +404,7 @@ def recargar_creditos(body: CreditoUpdate, admin=Depends(verify_admin)):
 
     nuevo = (alumno.data.get("batido_credits") or 0) + body.cantidad
     supabase.table("students").update({"batido_credits": nuevo}).eq("id", body.student_id).execute()
+    student_directory.invalidate(body.student_id)
 
     return {
         "ok": True,
@@ -384,15 +414,43 @@ def recargar_creditos(body: CreditoUpdate, admin=Depends(verify_admin)):
     }
 
 
+# ── CACHÉ DEL DIRECTORIO DE ALUMNOS ─────────────────────
+@router.get("/cache/stats")
+def cache_stats(admin=Depends(verify_admin)):
+    """Contadores de aciertos/fallos del directorio de alumnos en memoria."""
+    return {
+        "students":       student_directory.stats(),
+        "admin_auth":     token_verifier.stats(),
+        "trainer_tokens": trainer_tokens.stats(),
+        "recent_scans":   recent_scans.stats(),
+        "attendance_journal": attendance_journal.stats(),
+        "attendance_matrix":  attendance_matrix.stats(),
+        "name_search":        name_search.stats(),
+        "qr_cache":           qr_cache.stats(),
+        "legacy_credentials": legacy_credentials.stats(),
+        "public_cache":       public_cache.stats(),
+        "invalidation_bus":   invalidation_bus.stats(),
+        "replica":            replica.stats(),
+    }
+
+
+# ── RACHAS ────────────────────────────────────────────────
+@router.post("/rachas/recalcular")
+def recalcular_rachas(admin=Depends(verify_admin)):
+    """Recalcula la racha de todos los alumnos (usar después de backfills manuales)."""
+    streak_index.rebuild_all()
+    return {"ok": True}
+
+
 # ── CALENDARIO — ASISTENCIA GLOBAL ──────────────────────
 @router.get("/students")
-def get_students_for_calendar(admin=Depends(verify_admin)):
-    """Lista de alumnos activos para el calendario de asistencia global."""
-    res = supabase.table("students") \
-        .select("id, full_name, horario, turno, sede") \
-        .eq("is_active", True) \
-        .order("full_name").execute()
-    return res.data or []
+def get_students_for_calendar(fields: Optional[str] = None, cursor: Optional[str] = None,
+                              limit: Optional[int] = None, format: Optional[str] = None,
+                              admin=Depends(verify_admin)):
+    """Lista de alumnos activos para el calendario de asistencia global (mismos parámetros que /alumnos)."""
+    return list_students(lambda db, select: db.table("students").select(select).eq("is_active", True),
+                         "id, full_name, horario, turno, sede", fields, cursor, limit, format,
+                         replica_active=True)
 
 
 @router.get("/attendance/range")
@@ -413,6 +471,54 @@ def get_attendance_range(
     return res.data or []
 
 
+@router.get("/attendance/export")
+def export_attendance(
+    period: Optional[str] = None,
+    format: str = "csv",
+    sede: Optional[str] = None,
+    horario: Optional[str] = None,
+    admin=Depends(verify_admin)
+):
+    """
+    Asistencias de un mes (YYYY-MM) o un año (YYYY) con nombre, DNI, sede y
+    horario del alumno, en CSV o XLSX. Se lee y se escribe por páginas, así
+    la memoria no crece con el período.
+    Ejemplo: /admin/attendance/export?period=2026-02&format=xlsx&sede=Norte
+    """
+    period = period or datetime.now(PERU_TZ).strftime("%Y-%m")
+    if format not in attendance_export.FORMATS:
+        raise HTTPException(status_code=400, detail="format debe ser csv o xlsx")
+    try:
+        body = attendance_export.export_stream(period, format, sede=sede, horario=horario)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="period debe tener formato YYYY-MM o YYYY")
+    return StreamingResponse(body, media_type=attendance_export.MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="asistencia-{period}.{format}"',
+        "Cache-Control": "no-store",
+    })
+
+
+@router.get("/attendance/matrix")
+def get_attendance_matrix(
+    month: Optional[str] = None,
+    sede: Optional[str] = None,
+    horario: Optional[str] = None,
+    turno: Optional[str] = None,
+    admin=Depends(verify_admin)
+):
+    """
+    Matriz alumno × día del mes (hora de Lima) para el calendario.
+    Ejemplo: /admin/attendance/matrix?month=2026-02&sede=Norte
+    Cada alumno activo trae `mask`: el bit d-1 indica asistencia el día d.
+    """
+    month = month or datetime.now(PERU_TZ).strftime("%Y-%m")
+    try:
+        return attendance_matrix.build(month, student_directory.active(),
+                                       sede=sede, horario=horario, turno=turno)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month debe tener formato YYYY-MM")
+
+
 # ── ENTRENADORES (gestión desde admin) ───────────────────
 class EntrenadorCreate(BaseModel):
     nombre: str
@@ -455,4 +561,5 @@ def crear_entrenador(body: EntrenadorCreate, request_info=None, admin=Depends(ve
 @router.delete("/entrenadores/{ent_id}")
 def toggle_entrenador(ent_id: str, reactivar: bool = False, admin=Depends(verify_admin)):
     supabase.table("entrenadores").update({"is_active": reactivar}).eq("id", ent_id).execute()
+    trainer_tokens.invalidate_trainer(ent_id)
     return {"ok": True}
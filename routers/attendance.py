@@ -1,59 +1,30 @@
 # routers/attendance.py
-import os
-import hmac
-import hashlib
-import base64
-from fastapi import APIRouter, HTTPException
+import uuid
+from bisect import bisect_left, insort
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
-from database import supabase
+from database import db_execute, db_fetch_all
+from services.student_cache import student_directory
+from services.offline_snapshot import offline_snapshot
+from services.events import attendance_inserted
+from services.streaks import streak_index
+from services.trainer_tokens import trainer_tokens
+from services.scan_dedup import recent_scans, parse_ts as _parse_ts
+from services.attendance_journal import attendance_journal, WRITE_BEHIND
+from services.jrs_codec import parse as parse_jrs, legacy_credentials
+from services.replica import replica
 from datetime import datetime, timedelta, timezone
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
 
-# ── CLAVE HMAC ────────────────────────────────────────────
-# Setear QR_SIGNING_KEY=64_hex_chars en .env para producción
-_raw_key = os.getenv("QR_SIGNING_KEY", "a" * 64)
-try:
-    SIGNING_KEY = bytes.fromhex(_raw_key)
-except ValueError:
-    SIGNING_KEY = _raw_key.encode()
-
-
-def _sign(student_id: str, valid_until: str, name: str) -> str:
-    """Devuelve los primeros 8 bytes del HMAC-SHA256 como hex (16 chars)."""
-    msg = f"{student_id}|{valid_until}|{name}".encode("utf-8")
-    return hmac.new(SIGNING_KEY, msg, hashlib.sha256).digest()[:8].hex()
-
-
-def _b64u_encode(text: str) -> str:
-    return base64.urlsafe_b64encode(text.encode("utf-8")).rstrip(b"=").decode()
-
-
-def _b64u_decode(text: str) -> str:
-    padding = 4 - len(text) % 4
-    return base64.urlsafe_b64decode(text + "=" * padding).decode("utf-8")
-
-
-def _parse_jrs(code: str):
-    """
-    Parsea payload JRS:{uuid}:{YYYYMMDD}:{name_b64url}:{hmac16hex}
-    Devuelve dict o None si es inválido/manipulado.
-    """
+def _is_uuid(value: str) -> bool:
     try:
-        parts = code[4:].split(":")          # quitar "JRS:"
-        if len(parts) != 4:
-            return None
-        student_id, valid_date, name_b64, sig = parts
-        name = _b64u_decode(name_b64)
-
-        expected = _sign(student_id, valid_date, name)
-        if not hmac.compare_digest(expected, sig):
-            return None                      # firma inválida
-
-        return {"student_id": student_id, "valid_date": valid_date, "name": name}
-    except Exception:
-        return None
+        uuid.UUID(value)
+        return True
+    except (ValueError, AttributeError, TypeError):
+        return False
 
 
 # ── MODELO ───────────────────────────────────────────────
@@ -73,14 +44,58 @@ class BatchScanRequest(BaseModel):
     token: str                      # JWT del entrenador para autenticar
 
 
+# ── REGISTRO CON DEDUP DE 12H ────────────────────────────
+async def _registrar_asistencia(fila: dict, nombre_final: str) -> dict:
+    """
+    Inserta la asistencia salvo que el alumno ya tenga una en las últimas 12h.
+    El índice en memoria decide sin ir a la BD; solo si no cubre la ventana
+    (índice frío o timestamp muy antiguo) se consulta `attendance`.
+
+    Con ATTENDANCE_WRITE_BEHIND=1 y el índice cubriendo la ventana, la fila va
+    al diario local y se responde sin esperar el INSERT (services/attendance_journal.py).
+    """
+    student_id = fila["student_id"]
+    ts = _parse_ts(fila["created_at"])
+    ya_registrado = {"status": "warning", "message": f"Ya registrado: {nombre_final}", "student_name": nombre_final}
+
+    reservado = recent_scans.claim(student_id, ts)
+    if reservado is False:
+        return ya_registrado
+    if reservado is None:
+        twelve_ago = (ts - timedelta(hours=12)).isoformat()
+        recent = await db_execute(lambda db: db.table("attendance").select("id").eq("student_id", student_id)
+                                  .gte("created_at", twelve_ago))
+        if recent.data:
+            return ya_registrado
+
+    if WRITE_BEHIND and reservado:
+        # El claim ya lo registró en el índice: un segundo scan dentro de 12h
+        # verá "Ya registrado" aunque el INSERT todavía esté en cola
+        try:
+            await attendance_journal.enqueue(fila)
+        except OSError:
+            recent_scans.release(student_id, ts)
+            raise
+        return {"status": "success", "message": f"¡Bienvenido, {nombre_final}!", "student_name": nombre_final}
+
+    try:
+        await db_execute(lambda db: db.table("attendance").insert(fila))
+    except Exception:
+        if reservado:
+            recent_scans.release(student_id, ts)
+        raise
+    attendance_inserted([fila])
+    return {"status": "success", "message": f"¡Bienvenido, {nombre_final}!", "student_name": nombre_final}
+
+
 # ── SCAN ─────────────────────────────────────────────────
 @router.post("/scan")
-def scan_credential(scan: ScanRequest):
+async def scan_credential(scan: ScanRequest):
     code = scan.code.strip()
 
     # ── FORMATO NUEVO: JRS:uuid:YYYYMMDD:name_b64:hmac ──
     if code.startswith("JRS:"):
-        parsed = _parse_jrs(code)
+        parsed = parse_jrs(code)
         if not parsed:
             raise HTTPException(status_code=400, detail="Credencial JRS inválida o manipulada")
 
@@ -89,11 +104,10 @@ def scan_credential(scan: ScanRequest):
         valid_date_str = parsed["valid_date"]  # YYYYMMDD
 
         # Verificar si el alumno existe y está activo
-        st_res = supabase.table("students").select("id, is_active, valid_until").eq("id", student_id).execute()
-        if not st_res.data:
+        st = await student_directory.aget(student_id)
+        if not st:
             raise HTTPException(status_code=404, detail="Alumno no encontrado")
 
-        st = st_res.data[0]
         if not st.get("is_active"):
             return {"status": "debe", "message": f"{nombre_final} — Alumno inactivo",
                     "student_name": nombre_final, "detalle": "Este alumno está marcado como inactivo."}
@@ -113,33 +127,17 @@ def scan_credential(scan: ScanRequest):
 
         # Registrar asistencia (usar student_id directamente, sin credential_id)
         fecha_registro = scan.timestamp if scan.timestamp else datetime.now(timezone.utc).isoformat()
-        
-        twelve_ago = (datetime.fromisoformat(fecha_registro.replace("Z", "+00:00")) - timedelta(hours=12)).isoformat()
-        recent = supabase.table("attendance").select("id").eq("student_id", student_id)\
-            .gte("created_at", twelve_ago).execute()
-        if recent.data:
-            return {"status": "warning", "message": f"Ya registrado: {nombre_final}", "student_name": nombre_final}
-
-        supabase.table("attendance").insert({"student_id": student_id, "created_at": fecha_registro}).execute()
-        return {"status": "success", "message": f"¡Bienvenido, {nombre_final}!", "student_name": nombre_final}
+        return await _registrar_asistencia({"student_id": student_id, "created_at": fecha_registro}, nombre_final)
 
     # ── FORMATO LEGACY: STU-XXXXX o código libre ─────────
-    res = supabase.table("credentials") \
-        .select("id, student_id, students(full_name, valid_until, is_active)") \
-        .eq("code", code).eq("is_active", True).execute()
-
-    if not res.data:
+    # code → student_id desde el índice en memoria; los datos del alumno, del directorio
+    cred = await legacy_credentials.lookup(code)
+    if not cred:
         raise HTTPException(status_code=404, detail="Credencial inválida")
 
-    raw_data = res.data[0]
-    student_id = raw_data["student_id"]
-
-    st_info = raw_data.get("students")
-    if isinstance(st_info, list) and st_info:
-        nombre_final = st_info[0].get("full_name", "Sin Nombre")
-        valid_until  = st_info[0].get("valid_until")
-        is_active    = st_info[0].get("is_active", True)
-    elif isinstance(st_info, dict):
+    credential_id, student_id = cred
+    st_info = await student_directory.aget(student_id)
+    if st_info:
         nombre_final = st_info.get("full_name", "Sin Nombre")
         valid_until  = st_info.get("valid_until")
         is_active    = st_info.get("is_active", True)
@@ -160,114 +158,153 @@ def scan_credential(scan: ScanRequest):
                     "detalle": f"Venció hace {dias} día{'s' if dias != 1 else ''}. Contactar al administrador."}
 
     fecha_registro = scan.timestamp if scan.timestamp else datetime.now(timezone.utc).isoformat()
-    twelve_ago = (datetime.fromisoformat(fecha_registro.replace("Z", "+00:00")) - timedelta(hours=12)).isoformat()
-    recent = supabase.table("attendance").select("id").eq("student_id", student_id)\
-        .gte("created_at", twelve_ago).execute()
-    if recent.data:
-        return {"status": "warning", "message": f"Ya registrado: {nombre_final}", "student_name": nombre_final}
-
-    supabase.table("attendance").insert({"credential_id": raw_data["id"], "student_id": student_id, "created_at": fecha_registro}).execute()
-    return {"status": "success", "message": f"¡Bienvenido, {nombre_final}!", "student_name": nombre_final}
+    return await _registrar_asistencia(
+        {"credential_id": credential_id, "student_id": student_id, "created_at": fecha_registro}, nombre_final)
 
 
 # ── SYNC BATCH (desde Web Worker offline) ─────────────────
 @router.post("/sync-batch")
-def sync_batch(req: BatchScanRequest):
+async def sync_batch(req: BatchScanRequest, background_tasks: BackgroundTasks):
     """
     Acepta lotes de registros de asistencia generados offline.
     Autentica el Magic Token del entrenador contra la tabla `entrenadores`.
+    Devuelve el resultado de cada registro por `local_id`:
+    "inserted", "duplicate" o "error".
     """
     # Verificar Magic Token del entrenador (igual que entrenador.py)
-    ent_res = supabase.table("entrenadores") \
-        .select("id, is_active") \
-        .eq("token", req.token).execute()
+    ent = await trainer_tokens.lookup(req.token)
 
-    if not ent_res.data:
+    if not ent:
         raise HTTPException(status_code=401, detail="Token de entrenador inválido")
-    if not ent_res.data[0].get("is_active"):
+    if not ent.get("is_active"):
         raise HTTPException(status_code=403, detail="Acceso revocado por el administrador")
 
-    inserted = 0
-    duplicates = 0
+    ventana = timedelta(hours=12)
+    results = {}
+    candidatos = []                 # (timestamp, record) válidos, en el orden del lote
+
+    # Alumnos existentes: 1 snapshot del directorio y, para los ids que no
+    # están (p. ej. creados en otra instancia), 1 sola consulta para todos
+    conocidos = {s["id"] for s in await student_directory.aall()}
+    faltan = list({rec.student_id for rec in req.records
+                   if _is_uuid(rec.student_id) and rec.student_id not in conocidos})
+    if faltan:
+        res = await db_execute(lambda db: db.table("students").select("id").in_("id", faltan))
+        conocidos.update(r["id"] for r in res.data or [])
 
     for rec in req.records:
         try:
-            ts = datetime.fromisoformat(rec.timestamp.replace("Z", "+00:00"))
-            window_start = (ts - timedelta(hours=12)).isoformat()
-            window_end   = (ts + timedelta(hours=12)).isoformat()
-
-            # Verificar duplicado en ventana de 12h alrededor del timestamp offline
-            dup = supabase.table("attendance").select("id").eq("student_id", rec.student_id)\
-                .gte("created_at", window_start).lte("created_at", window_end).execute()
-
-            if dup.data:
-                duplicates += 1
-                continue
-
-            supabase.table("attendance").insert({
-                "student_id": rec.student_id,
-                "created_at": rec.timestamp,
-                "source": "offline_sync"
-            }).execute()
-            inserted += 1
+            ts = _parse_ts(rec.timestamp)
+        except (ValueError, AttributeError):
+            print(f"[sync-batch] Timestamp inválido en {rec.student_id}: {rec.timestamp}")
+            results[rec.local_id] = "error"
+            continue
+        if not _is_uuid(rec.student_id) or rec.student_id not in conocidos:
+            print(f"[sync-batch] Alumno desconocido: {rec.student_id}")
+            results[rec.local_id] = "error"
+            continue
+        candidatos.append((ts, rec))
+
+    # Asistencias existentes de los alumnos del lote en todo el rango ±12h:
+    # desde el índice en memoria si lo cubre, si no con 1 sola consulta
+    vistos = {}                     # student_id → lista ordenada de timestamps
+    if candidatos:
+        ids = list({rec.student_id for _, rec in candidatos})
+        desde = min(ts for ts, _ in candidatos) - ventana
+        hasta = max(ts for ts, _ in candidatos) + ventana
+        en_memoria = {sid: recent_scans.times_since(sid, desde) for sid in ids}
+        if all(v is not None for v in en_memoria.values()):
+            vistos = en_memoria
+        else:
+            existentes = await db_fetch_all(lambda db: db.table("attendance").select("student_id, created_at")
+                                            .in_("student_id", ids)
+                                            .gte("created_at", desde.isoformat()).lte("created_at", hasta.isoformat())
+                                            .order("created_at"))
+            for r in existentes:
+                try:
+                    vistos.setdefault(r["student_id"], []).append(_parse_ts(r["created_at"]))
+                except (ValueError, AttributeError):
+                    continue
+            for lista in vistos.values():
+                lista.sort()
+
+    # Dedup en memoria: contra la BD y contra registros anteriores del mismo lote
+    nuevos = []
+    for ts, rec in candidatos:
+        lista = vistos.setdefault(rec.student_id, [])
+        i = bisect_left(lista, ts - ventana)
+        if i < len(lista) and lista[i] <= ts + ventana:
+            results[rec.local_id] = "duplicate"
+            continue
+        insort(lista, ts)
+        nuevos.append(rec)
+
+    # 1 solo INSERT masivo con los sobrevivientes
+    if nuevos:
+        filas = [{"student_id": rec.student_id, "created_at": rec.timestamp, "source": "offline_sync"}
+                 for rec in nuevos]
+        try:
+            await db_execute(lambda db: db.table("attendance").insert(filas))
         except Exception as e:
-            print(f"[sync-batch] Error en {rec.student_id}: {e}")
-
-    return {"ok": True, "inserted": inserted, "duplicates": duplicates}
+            print(f"[sync-batch] Error en inserción masiva ({len(nuevos)} registros): {e}")
+            raise HTTPException(status_code=503, detail="No se pudo guardar el lote, reintentar")
+        attendance_inserted(filas)
+        # Los registros offline suelen llegar desordenados: recalcular rachas fuera del request
+        background_tasks.add_task(streak_index.recompute_dirty)
+        for rec in nuevos:
+            results[rec.local_id] = "inserted"
+
+    estados = list(results.values())
+    return {
+        "ok":         True,
+        "inserted":   estados.count("inserted"),
+        "duplicates": estados.count("duplicate"),
+        "errors":     estados.count("error"),
+        "results":    results,
+    }
 
 
 # ── ENDPOINTS EXISTENTES ──────────────────────────────────
 @router.get("/scanner/offline-data")
-def scanner_offline_data():
+async def scanner_offline_data(request: Request, since: Optional[int] = None):
     """
     Descarga una copia ligera del estado de los alumnos para que el kiosko de scanner
     funcione offline.
+
+    - Sin parámetros: snapshot completo {student_id: {name, status, detalle}}.
+    - `If-None-Match` con la versión actual → 304 sin cuerpo.
+    - `since=<versión>` → {version, full, students, removed} solo con lo que
+      cambió después de esa versión (o el snapshot completo si este worker no la conoce).
     """
-    res = supabase.table("students").select("id, full_name, is_active, valid_until").execute()
-    alumnos = res.data or []
-    
-    hoy = datetime.now(timezone.utc).date()
-    offline_db = {}
-    
-    for a in alumnos:
-        if not a.get("is_active"):
-            status = "debe"
-            detalle = "Alumno inactivo"
-        else:
-            fecha_str = a.get("valid_until")
-            if not fecha_str:
-                status = "debe"
-                detalle = "Sin pago registrado"
-            else:
-                try:
-                    fecha_venc = datetime.strptime(fecha_str, "%Y-%m-%d").date()
-                    if fecha_venc < hoy:
-                        status = "debe"
-                        dias = (hoy - fecha_venc).days
-                        detalle = f"Venció hace {dias} día{'s' if dias != 1 else ''}."
-                    else:
-                        status = "success"
-                        detalle = "OK"
-                except Exception:
-                    status = "success"
-                    detalle = "OK"
-                    
-        offline_db[a["id"]] = {
-            "name": a["full_name"],
-            "status": status,
-            "detalle": detalle
-        }
-        
-    return offline_db
+    await offline_snapshot.refresh()
+    version = offline_snapshot.version
+    etag = f'"{version}"'
+    headers = {"ETag": etag, "X-Snapshot-Version": str(version), "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if since is None:
+        return Response(offline_snapshot.full_body(), media_type="application/json", headers=headers)
+
+    delta = offline_snapshot.delta(since)
+    if delta is None:
+        body = b'{"version":%d,"full":true,"removed":[],"students":' % version + offline_snapshot.full_body() + b"}"
+        return Response(body, media_type="application/json", headers=headers)
+    return JSONResponse(delta, headers=headers)
 
 @router.get("/today")
-def get_today_attendance():
+async def get_today_attendance():
     today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-    all_students = supabase.table("students").select("id, full_name").eq("is_active", True).order("full_name").execute()
-    attended = supabase.table("attendance").select("student_id, created_at").gte("created_at", today_start).execute()
-    attended_ids = {r["student_id"]: r["created_at"] for r in attended.data}
+    if replica.ready("attendance"):
+        rows = replica.attendance_since(today_start)
+    else:
+        attended = await db_execute(lambda db: db.table("attendance").select("student_id, created_at")
+                                    .gte("created_at", today_start))
+        rows = attended.data
+    attended_ids = {r["student_id"]: r["created_at"] for r in rows}
     result = []
-    for student in all_students.data:
+    for student in await student_directory.aactive():
         sid = student["id"]
         result.append({"id": sid, "full_name": student["full_name"],
                         "present": sid in attended_ids, "time": attended_ids.get(sid)})
@@ -275,12 +312,14 @@ def get_today_attendance():
 
 
 @router.get("/range")
-def get_attendance_range(start: str, end: str):
-    return supabase.table("attendance").select("student_id, created_at")\
-        .gte("created_at", start).lte("created_at", end).execute().data
+async def get_attendance_range(start: str, end: str):
+    res = await db_execute(lambda db: db.table("attendance").select("student_id, created_at")
+                           .gte("created_at", start).lte("created_at", end))
+    return res.data
 
 
 @router.get("/history")
-def get_history(limit: int = 50):
-    return supabase.table("attendance").select("id, created_at, students(full_name)")\
-        .order("created_at", desc=True).limit(limit).execute().data
+async def get_history(limit: int = 50):
+    res = await db_execute(lambda db: db.table("attendance").select("id, created_at, students(full_name)")
+                           .order("created_at", desc=True).limit(limit))
+    return res.data
@@ -1,48 +1,16 @@
 # routers/batidos.py
 import os
-import hmac
-import hashlib
-import base64
+import asyncio
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-from database import supabase
+from postgrest.exceptions import APIError
+from database import db_execute
+from services.student_cache import student_directory
+from services.jrs_codec import parse as parse_jrs, legacy_credentials
 from routers.admin import verify_admin
 
 router = APIRouter(prefix="/batidos", tags=["batidos"])
 
-# ── CLAVE HMAC (misma que attendance.py y entrenador.py) ──
-_raw_key = os.getenv("QR_SIGNING_KEY", "a" * 64)
-try:
-    SIGNING_KEY = bytes.fromhex(_raw_key)
-except ValueError:
-    SIGNING_KEY = _raw_key.encode()
-
-
-def _b64u_decode(text: str) -> str:
-    padding = 4 - len(text) % 4
-    return base64.urlsafe_b64decode(text + "=" * padding).decode("utf-8")
-
-
-def _parse_jrs(code: str):
-    """
-    Parsea y valida un payload JRS:{uuid}:{YYYYMMDD}:{name_b64url}:{hmac16hex}.
-    Devuelve dict con 'student_id' y 'name', o None si la firma es inválida.
-    """
-    try:
-        parts = code[4:].split(":")   # quita "JRS:"
-        if len(parts) != 4:
-            return None
-        student_id, valid_date, name_b64, sig = parts
-        name = _b64u_decode(name_b64)
-        msg = f"{student_id}|{valid_date}|{name}".encode("utf-8")
-        expected = hmac.new(SIGNING_KEY, msg, hashlib.sha256).digest()[:8].hex()
-        if not hmac.compare_digest(expected, sig):
-            return None
-        return {"student_id": student_id, "name": name}
-    except Exception:
-        return None
-
-
 # ── MODELOS ──────────────────────────────────────────────
 class PinRequest(BaseModel):
     pin: str
@@ -56,7 +24,7 @@ class CanjeRequest(BaseModel):
 
 # ── AUTH KIOSKO ──────────────────────────────────────────
 @router.post("/auth")
-def auth_caja(body: PinRequest):
+async def auth_caja(body: PinRequest):
     """Valida el PIN del kiosko contra la variable de entorno CAJA_PIN."""
     correcto = os.getenv("CAJA_PIN", "1234")
     if body.pin != correcto:
@@ -67,7 +35,7 @@ def auth_caja(body: PinRequest):
 # ── RUTAS ────────────────────────────────────────────────
 
 @router.get("/nfc/{code}")
-def get_alumno_por_codigo(code: str):
+async def get_alumno_por_codigo(code: str):
     """
     Busca al alumno por su QR (STU-legacy o JRS firmado) para la Caja Registradora.
     """
@@ -75,19 +43,15 @@ def get_alumno_por_codigo(code: str):
 
     # ── FORMATO JRS FIRMADO ───────────────────────────────
     if codigo_limpio.startswith("JRS:"):
-        parsed = _parse_jrs(codigo_limpio)
+        parsed = parse_jrs(codigo_limpio)
         if not parsed:
             raise HTTPException(status_code=400, detail="QR JRS inválido o manipulado")
 
         student_id = parsed["student_id"]
-        student = supabase.table("students") \
-            .select("id, full_name, batido_credits") \
-            .eq("id", student_id).eq("is_active", True).execute()
-
-        if not student.data:
+        alumno = await student_directory.aget(student_id)
+        if not alumno or not alumno.get("is_active"):
             raise HTTPException(status_code=404, detail="Alumno inactivo o no existe")
 
-        alumno = student.data[0]
         return {
             "id":             alumno["id"],
             "name":           alumno["full_name"],
@@ -95,19 +59,15 @@ def get_alumno_por_codigo(code: str):
         }
 
     # ── FORMATO LEGACY STU-XXXXX ─────────────────────────
-    cred = supabase.table("credentials").select("student_id") \
-        .eq("code", codigo_limpio).eq("is_active", True).execute()
-    if not cred.data:
+    cred = await legacy_credentials.lookup(codigo_limpio)
+    if not cred:
         raise HTTPException(status_code=404, detail="Credencial inválida")
 
-    student_id = cred.data[0]["student_id"]
-    student = supabase.table("students") \
-        .select("id, full_name, batido_credits") \
-        .eq("id", student_id).eq("is_active", True).execute()
-    if not student.data:
+    student_id = cred[1]
+    alumno = await student_directory.aget(student_id)
+    if not alumno or not alumno.get("is_active"):
         raise HTTPException(status_code=404, detail="Alumno inactivo o no existe")
 
-    alumno = student.data[0]
     return {
         "id":             alumno["id"],
         "name":           alumno["full_name"],
@@ -116,55 +76,110 @@ def get_alumno_por_codigo(code: str):
 
 
 @router.get("/history/{student_id}")
-def get_historial(student_id: str, admin=Depends(verify_admin)):
+async def get_historial(student_id: str, admin=Depends(verify_admin)):
     """Últimos canjes de un alumno (protegido por token admin)."""
-    res = (
-        supabase.table("batido_canjes")
+    res = await db_execute(
+        lambda db: db.table("batido_canjes")
         .select("*")
         .eq("student_id", student_id)
         .order("created_at", desc=True)
         .limit(20)
-        .execute()
     )
     return res.data or []
 
 
-@router.post("/canjear")
-def canjear_batido(body: CanjeRequest):
-    """Descuenta créditos y registra el canje."""
-
-    alumno_res = (
-        supabase.table("students")
-        .select("id, full_name, batido_credits")
-        .eq("id", body.student_id)
-        .execute()
-    )
+# ── CANJE ATÓMICO ────────────────────────────────────────
+# La función SQL está en sql/canjear_batido.sql. Si todavía no se creó en
+# Supabase (PGRST202), se usa un camino de respaldo serializado por alumno.
+_rpc_disponible = True
+
+# Lock striping: canjes del mismo alumno en este proceso van uno detrás de otro
+_CANJE_LOCKS = [asyncio.Lock() for _ in range(64)]
 
-    if not alumno_res.data:
-        raise HTTPException(status_code=404, detail="Alumno no encontrado")
+_ERRORES_CANJE = {
+    "no_encontrado":      (404, "Alumno no encontrado"),
+    "saldo_insuficiente": (400, "Saldo insuficiente"),
+    "creditos_invalidos": (400, "Cantidad de créditos inválida"),
+}
 
-    alumno = alumno_res.data[0]
-    saldo = alumno.get("batido_credits") or 0
 
-    if saldo < body.credits_used:
-        raise HTTPException(status_code=400, detail="Saldo insuficiente")
+async def _canjear_rpc(body: CanjeRequest) -> dict:
+    res = await db_execute(lambda db: db.rpc("canjear_batido", {
+        "p_student_id":   body.student_id,
+        "p_batido_name":  body.batido_name,
+        "p_credits_used": body.credits_used,
+        "p_emoji":        body.emoji,
+    }))
+    return res.data
 
-    nuevo_saldo = saldo - body.credits_used
-    supabase.table("students").update(
-        {"batido_credits": nuevo_saldo}
-    ).eq("id", body.student_id).execute()
 
-    supabase.table("batido_canjes").insert({
-        "student_id":  body.student_id,
-        "batido_name": body.batido_name,
-        "credits_used": body.credits_used,
-        "emoji":       body.emoji,
-    }).execute()
+async def _canjear_respaldo(body: CanjeRequest) -> dict:
+    """
+    Sin la RPC: lectura + UPDATE condicionado al saldo leído (compare-and-swap)
+    + INSERT. El lock evita carreras dentro del proceso; el `.eq` sobre el
+    saldo evita pisar un canje hecho desde otro proceso.
+    """
+    async with _CANJE_LOCKS[hash(body.student_id) % len(_CANJE_LOCKS)]:
+        for _ in range(3):
+            alumno_res = await db_execute(lambda db: db.table("students")
+                                          .select("id, full_name, batido_credits")
+                                          .eq("id", body.student_id))
+            if not alumno_res.data:
+                return {"ok": False, "error": "no_encontrado"}
+            alumno = alumno_res.data[0]
+            saldo = alumno.get("batido_credits") or 0
+            if saldo < body.credits_used:
+                return {"ok": False, "error": "saldo_insuficiente"}
+
+            nuevo_saldo = saldo - body.credits_used
+
+            def _cas(db):
+                q = db.table("students").update({"batido_credits": nuevo_saldo}).eq("id", body.student_id)
+                if alumno.get("batido_credits") is None:
+                    return q.is_("batido_credits", "null")
+                return q.eq("batido_credits", saldo)
+
+            if not (await db_execute(_cas)).data:
+                continue            # otro proceso cambió el saldo: releer
+            await db_execute(lambda db: db.table("batido_canjes").insert({
+                "student_id":   body.student_id,
+                "batido_name":  body.batido_name,
+                "credits_used": body.credits_used,
+                "emoji":        body.emoji,
+            }))
+            return {"ok": True, "alumno": alumno["full_name"], "saldo_restante": nuevo_saldo}
+    raise HTTPException(status_code=409, detail="El saldo cambió durante el canje, reintentar")
+
+
+@router.post("/canjear")
+async def canjear_batido(body: CanjeRequest):
+    """Descuenta créditos y registra el canje en una sola operación atómica."""
+    global _rpc_disponible
+    if body.credits_used <= 0:
+        raise HTTPException(status_code=400, detail="Cantidad de créditos inválida")
+
+    resultado = None
+    if _rpc_disponible:
+        try:
+            resultado = await _canjear_rpc(body)
+        except APIError as e:
+            if e.code != "PGRST202":
+                raise
+            print("[batidos] Falta la función canjear_batido (ver sql/canjear_batido.sql); usando respaldo")
+            _rpc_disponible = False
+    if resultado is None:
+        resultado = await _canjear_respaldo(body)
+
+    if not resultado.get("ok"):
+        status, detalle = _ERRORES_CANJE.get(resultado.get("error"), (400, "No se pudo canjear"))
+        raise HTTPException(status_code=status, detail=detalle)
+
+    student_directory.invalidate(body.student_id)
 
     return {
         "ok":             True,
-        "alumno":         alumno["full_name"],
+        "alumno":         resultado["alumno"],
         "batido":         body.batido_name,
         "creditos_usados": body.credits_used,
-        "saldo_restante": nuevo_saldo,
-    }
\ No newline at end of file
+        "saldo_restante": resultado["saldo_restante"],
+    }
@@ -2,6 +2,8 @@
 from fastapi import APIRouter, HTTPException, Depends
 from database import supabase
 from routers.admin import verify_admin
+from services.qr_render import qr_cache
+from services.jrs_codec import legacy_credentials
 import secrets
 import string
 
@@ -19,16 +21,19 @@ def generate_credential(student_id: str, admin=Depends(verify_admin)):
     code = f"STU-{''.join(secrets.choice(alphabet) for _ in range(8))}"
 
     # 3. Lo guardamos en la Bóveda de Supabase
-    supabase.table("credentials").insert({
+    res = supabase.table("credentials").insert({
         "student_id": student_id,
         "code": code,
         "type": "qr",
         "is_active": True
     }).execute()
+    for cred in (res.data or []):
+        legacy_credentials.add(cred["code"], cred["id"], cred["student_id"])
 
     return {
         "message": "Credencial creada",
-        "code": code
+        "code": code,
+        "qr_url": qr_cache.url_for_sync(code)
     }
 
 @router.get("/{student_id}")
@@ -39,4 +44,6 @@ def get_credential(student_id: str, admin=Depends(verify_admin)):
         .eq("student_id", student_id) \
         .eq("is_active", True) \
         .execute()
+    for cred in (response.data or []):
+        cred["qr_url"] = qr_cache.url_for_sync(cred["code"])
     return response.data
\ No newline at end of file
@@ -1,65 +1,48 @@
 # routers/entrenador.py — Magic Token Auth (sin passwords ni emails en login)
-import os
-import hmac
-import hashlib
-import base64
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, List
 
 from fastapi import APIRouter, HTTPException, Depends, Header
 from pydantic import BaseModel
-from database import supabase
+from database import db_execute
+from services.student_cache import student_directory
+from services.trainer_tokens import trainer_tokens
+from services.qr_render import qr_cache, FORMATS
+from services import jrs_codec
+from services.jrs_codec import SIGNING_KEY_HEX
+from services.replica import replica
 
 router = APIRouter(prefix="/entrenador", tags=["entrenador"])
 
-# ── CLAVE HMAC QR ─────────────────────────────────────────
-_raw_key = os.getenv("QR_SIGNING_KEY", "a" * 64)
-try:
-    SIGNING_KEY = bytes.fromhex(_raw_key)
-except ValueError:
-    SIGNING_KEY = _raw_key.encode()
 
-SIGNING_KEY_HEX = SIGNING_KEY.hex()
-
-
-def _b64u_encode(text: str) -> str:
-    return base64.urlsafe_b64encode(text.encode()).rstrip(b"=").decode()
-
-
-def _sign_qr(student_id: str, valid_yyyymmdd: str, name: str) -> str:
-    msg = f"{student_id}|{valid_yyyymmdd}|{name}".encode()
-    return hmac.new(SIGNING_KEY, msg, hashlib.sha256).digest()[:8].hex()
+class SignedBatchRequest(BaseModel):
+    student_ids: List[str]
 
 
 # ── DEPENDENCIA: VERIFICAR TOKEN ──────────────────────────
-def verify_token(authorization: Optional[str] = Header(None)) -> dict:
+async def verify_token(authorization: Optional[str] = Header(None)) -> dict:
     """Lee el token mágico del header y verifica que esté activo en la BD."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Token requerido")
 
     token = authorization.replace("Bearer ", "").strip()
-    res = supabase.table("entrenadores") \
-        .select("id, nombre, is_active") \
-        .eq("token", token).execute()
+    ent = await trainer_tokens.lookup(token)
 
-    if not res.data:
+    if not ent:
         raise HTTPException(status_code=403, detail="Token inválido")
 
-    ent = res.data[0]
     if not ent.get("is_active"):
         raise HTTPException(status_code=403, detail="Acceso revocado por el administrador")
 
-    # Actualizar last_used_at
-    supabase.table("entrenadores").update({
-        "last_used_at": datetime.now(timezone.utc).isoformat()
-    }).eq("token", token).execute()
+    # last_used_at se escribe en bloque en segundo plano (ver services/trainer_tokens.py)
+    trainer_tokens.touch(ent["id"])
 
     return {"id": ent["id"], "nombre": ent["nombre"]}
 
 
 # ── VERIFY ENDPOINT (llamado al cargar el panel) ──────────
 @router.get("/verify")
-def verify_entrenador_token(ent=Depends(verify_token)):
+async def verify_entrenador_token(ent=Depends(verify_token)):
     """El frontend llama a este endpoint para validar el token al iniciar."""
     return {
         "ok":          True,
@@ -70,9 +53,11 @@ def verify_entrenador_token(ent=Depends(verify_token)):
 
 # ── GENERAR CREDENCIAL FIRMADA PARA UN ALUMNO ─────────────
 @router.post("/credentials/generate-signed/{student_id}")
-def generate_signed_credential(student_id: str, ent=Depends(verify_token)):
-    st = supabase.table("students").select("id, full_name, valid_until, is_active") \
-        .eq("id", student_id).execute()
+async def generate_signed_credential(student_id: str, formato: str = "png", ent=Depends(verify_token)):
+    if formato not in FORMATS:
+        raise HTTPException(status_code=400, detail="formato debe ser png o svg")
+    st = await db_execute(lambda db: db.table("students").select("id, full_name, valid_until, is_active")
+                          .eq("id", student_id))
     if not st.data:
         raise HTTPException(status_code=404, detail="Alumno no encontrado")
 
@@ -81,43 +66,67 @@ def generate_signed_credential(student_id: str, ent=Depends(verify_token)):
         raise HTTPException(status_code=400, detail="El alumno está inactivo")
 
     valid_until = alumno.get("valid_until") or ""
-    try:
-        valid_yyyymmdd = datetime.strptime(valid_until, "%Y-%m-%d").strftime("%Y%m%d")
-    except ValueError:
-        valid_yyyymmdd = "00000000"
-
-    name     = alumno["full_name"]
-    name_b64 = _b64u_encode(name)
-    sig      = _sign_qr(student_id, valid_yyyymmdd, name)
-    payload  = f"JRS:{student_id}:{valid_yyyymmdd}:{name_b64}:{sig}"
+    name        = alumno["full_name"]
+    payload     = jrs_codec.encode(student_id, jrs_codec.to_yyyymmdd(valid_until), name)
 
     return {
         "payload":      payload,
         "student_name": name,
         "valid_until":  valid_until,
-        "qr_url": f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={payload}"
+        # Imagen local en /qrs (se dibuja una sola vez por payload)
+        "qr_url":       await qr_cache.url_for(payload, formato, student_id=student_id),
+    }
+
+
+@router.post("/credentials/generate-signed")
+async def generate_signed_credentials_batch(body: SignedBatchRequest, ent=Depends(verify_token)):
+    """
+    Payloads JRS de varios alumnos a la vez (impresión de carnets por grupo):
+    una sola consulta a `students` y la firma en bloque con el códec compartido.
+    """
+    ids = list(dict.fromkeys(body.student_ids))
+    if not ids:
+        return {"credentials": [], "errors": {}}
+    if len(ids) > 500:
+        raise HTTPException(status_code=400, detail="Máximo 500 alumnos por lote")
+
+    res = await db_execute(lambda db: db.table("students").select("id, full_name, valid_until, is_active")
+                           .in_("id", ids))
+    por_id = {r["id"]: r for r in (res.data or [])}
+    activos = [por_id[sid] for sid in ids if por_id.get(sid, {}).get("is_active")]
+    errores = {sid: ("inactivo" if sid in por_id else "no_encontrado")
+               for sid in ids if sid not in {a["id"] for a in activos}}
+
+    return {
+        "credentials": [{
+            "student_id":   a["id"],
+            "payload":      payload,
+            "student_name": a["full_name"],
+            "valid_until":  a.get("valid_until") or "",
+        } for a, payload in zip(activos, jrs_codec.encode_many(activos))],
+        "errors": errores,
     }
 
 
 # ── ASISTENCIA DEL DÍA ────────────────────────────────────
 @router.get("/asistencia/hoy")
-def get_asistencia_hoy(ent=Depends(verify_token)):
+async def get_asistencia_hoy(ent=Depends(verify_token)):
     today_start = datetime.now(timezone.utc).replace(
         hour=0, minute=0, second=0, microsecond=0
     ).isoformat()
 
-    all_students = supabase.table("students") \
-        .select("id, full_name, horario, turno, valid_until") \
-        .eq("is_active", True).order("full_name").execute()
-
-    attended = supabase.table("attendance") \
-        .select("student_id, created_at").gte("created_at", today_start).execute()
+    if replica.ready("attendance"):
+        rows = replica.attendance_since(today_start)
+    else:
+        attended = await db_execute(lambda db: db.table("attendance")
+                                    .select("student_id, created_at").gte("created_at", today_start))
+        rows = attended.data or []
 
-    attended_ids = {r["student_id"]: r["created_at"] for r in (attended.data or [])}
+    attended_ids = {r["student_id"]: r["created_at"] for r in rows}
     hoy = datetime.now(timezone.utc).date()
 
     result = []
-    for student in (all_students.data or []):
+    for student in await student_directory.aactive():
         sid = student["id"]
         valid_until = student.get("valid_until")
         debe = False
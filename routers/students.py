@@ -3,6 +3,8 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional
 from database import supabase
+from services.student_cache import student_directory
+from services.student_listing import list_students
 from routers.admin import verify_admin
 
 router = APIRouter(prefix="/students", tags=["students"])
@@ -11,21 +13,27 @@ class StudentCreate(BaseModel):
     full_name: str
 
 @router.get("")
-def get_students(admin=Depends(verify_admin)):
-    response = supabase.table("students").select("*").order("full_name").execute()
-    return response.data
+def get_students(fields: Optional[str] = None, cursor: Optional[str] = None,
+                 limit: Optional[int] = None, format: Optional[str] = None,
+                 admin=Depends(verify_admin)):
+    """Todos los alumnos; ver services/student_listing.py para cursor, fields= y format=ndjson."""
+    return list_students(lambda db, select: db.table("students").select(select),
+                         "*", fields, cursor, limit, format)
 
 @router.post("")
 def create_student(student: StudentCreate, admin=Depends(verify_admin)):
     response = supabase.table("students").insert({
         "full_name": student.full_name
     }).execute()
+    for row in (response.data or []):
+        student_directory.invalidate(row["id"])
     return response.data
 
 @router.delete("/{student_id}")
 def delete_student(student_id: str, admin=Depends(verify_admin)):
     # Baja lógica (no borrado físico) — el borrado real lo maneja admin.py
     supabase.table("students").update({"is_active": False}).eq("id", student_id).execute()
+    student_directory.invalidate(student_id)
     return {"message": "Estudiante desactivado"}
 
 @router.get("/by-dni/{dni}")
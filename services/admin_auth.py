@@ -0,0 +1,111 @@
+# services/admin_auth.py — Verificación local de JWT de Supabase Auth
+import os
+import time
+import hashlib
+import threading
+from typing import Optional
+
+import jwt
+from cachetools import TTLCache
+
+SUPABASE_URL = (os.getenv("SUPABASE_URL") or "").rstrip("/")
+
+# Secreto HS256 del proyecto (Settings → API → JWT Secret). Si no está, se usan las
+# claves públicas (JWKS) para tokens RS256/ES256, y si tampoco se puede, la llamada remota.
+SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
+JWKS_URL = f"{SUPABASE_URL}/auth/v1/.well-known/jwks.json" if SUPABASE_URL else ""
+
+# Cuánto tiempo se recuerda un token ya verificado (nunca más allá de su `exp`)
+AUTH_CACHE_TTL = int(os.getenv("ADMIN_AUTH_CACHE_TTL", "60"))
+
+
+class AuthUser:
+    """Lo mínimo del usuario de Supabase que usan las rutas admin."""
+
+    def __init__(self, id: str, email: str):
+        self.id = id
+        self.email = email
+
+
+class Unverifiable(Exception):
+    """El token no se puede verificar localmente (sin secreto, kid desconocido, JWKS caído)."""
+
+
+class TokenVerifier:
+    """
+    Verifica JWT de Supabase en proceso: firma, expiración y audiencia.
+
+    - HS256 con SUPABASE_JWT_SECRET; RS256/ES256 con la JWKS del proyecto
+      (PyJWKClient la cachea).
+    - Resultado positivo cacheado por hash del token durante AUTH_CACHE_TTL.
+    - `Unverifiable` indica al llamador que debe caer a supabase.auth.get_user().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=1024, ttl=AUTH_CACHE_TTL)
+        self._jwks = jwt.PyJWKClient(JWKS_URL, cache_keys=True, lifespan=3600) if JWKS_URL else None
+        self.local_hits = 0
+        self.cache_hits = 0
+        self.remote_fallbacks = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    # ── CACHÉ POSITIVA ───────────────────────────────────
+    def cached(self, token: str) -> Optional[AuthUser]:
+        with self._lock:
+            hit = self._cache.get(self._key(token))
+        if not hit:
+            return None
+        user, exp = hit
+        if exp and exp <= time.time():
+            return None
+        self.cache_hits += 1
+        return user
+
+    def remember(self, token: str, user: AuthUser, exp: Optional[float] = None):
+        with self._lock:
+            self._cache[self._key(token)] = (user, exp)
+
+    # ── VERIFICACIÓN LOCAL ───────────────────────────────
+    def _signing_key(self, token: str):
+        header = jwt.get_unverified_header(token)
+        alg = header.get("alg")
+        if alg == "HS256":
+            if not SUPABASE_JWT_SECRET:
+                raise Unverifiable("sin SUPABASE_JWT_SECRET")
+            return SUPABASE_JWT_SECRET, alg
+        if alg in ("RS256", "ES256") and self._jwks:
+            try:
+                return self._jwks.get_signing_key_from_jwt(token).key, alg
+            except jwt.PyJWKClientError as e:
+                raise Unverifiable(str(e))
+        raise Unverifiable(f"algoritmo no soportado localmente: {alg}")
+
+    def verify(self, token: str) -> AuthUser:
+        """
+        Devuelve el usuario si el token es válido.
+        Lanza jwt.InvalidTokenError si es inválido/expirado, o Unverifiable.
+        """
+        key, alg = self._signing_key(token)
+        claims = jwt.decode(
+            token, key, algorithms=[alg], audience="authenticated",
+            options={"require": ["exp", "sub"]},
+        )
+        user = AuthUser(id=claims["sub"], email=claims.get("email") or "")
+        self.local_hits += 1
+        self.remember(token, user, exp=float(claims["exp"]))
+        return user
+
+    def stats(self) -> dict:
+        return {
+            "local_verifications": self.local_hits,
+            "cache_hits":          self.cache_hits,
+            "remote_fallbacks":    self.remote_fallbacks,
+            "cached_tokens":       len(self._cache),
+        }
+
+
+token_verifier = TokenVerifier()
@@ -0,0 +1,192 @@
+# services/attendance_export.py — Exportación de asistencias (CSV/XLSX) en streaming, página por página
+import io
+import re
+import csv
+import zipfile
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import escape
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import db_execute, PAGE_SIZE
+from services.scan_dedup import parse_ts
+from services.student_cache import student_directory
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+FORMATS = ("csv", "xlsx")
+COLUMNS = ("fecha", "hora", "alumno", "dni", "sede", "horario", "turno", "student_id", "attendance_id")
+
+MEDIA_TYPES = {
+    "csv":  "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+# Caracteres de control que XML 1.0 no admite (romperían el archivo en Excel)
+_XML_INVALIDO = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def period_bounds(period: str) -> tuple:
+    """'2026-02' → el mes, '2026' → el año; (inicio, fin) en hora de Lima, fin exclusivo."""
+    if re.fullmatch(r"\d{4}", period):
+        inicio = datetime(int(period), 1, 1, tzinfo=PERU_TZ)
+        return inicio, inicio.replace(year=inicio.year + 1)
+    inicio = datetime.strptime(period, "%Y-%m").replace(tzinfo=PERU_TZ)
+    if inicio.month == 12:
+        return inicio, inicio.replace(year=inicio.year + 1, month=1)
+    return inicio, inicio.replace(month=inicio.month + 1)
+
+
+# ── LECTURA POR KEYSET (created_at, id) ──────────────────
+async def _pages(inicio: datetime, fin: datetime) -> AsyncIterator[list]:
+    """Páginas de PAGE_SIZE asistencias en orden; nunca hay más de una en memoria."""
+    after = None
+    while True:
+        def build(db, after=after):
+            q = db.table("attendance").select("id, student_id, created_at") \
+                .gte("created_at", inicio.isoformat()).lt("created_at", fin.isoformat())
+            if after is not None:
+                ts, aid = after
+                q = q.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt."{aid}")')
+            return q.order("created_at").order("id").limit(PAGE_SIZE)
+
+        res = await db_execute(build)
+        rows = res.data or []
+        if rows:
+            yield rows
+        if len(rows) < PAGE_SIZE:
+            return
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+async def _records(inicio: datetime, fin: datetime, sede: Optional[str],
+                   horario: Optional[str]) -> AsyncIterator[list]:
+    """Páginas ya unidas con los datos del alumno (directorio en memoria) y filtradas."""
+    alumnos = {s["id"]: s for s in await student_directory.aall()}
+    async for rows in _pages(inicio, fin):
+        salida = []
+        for r in rows:
+            st = alumnos.get(r["student_id"], {})
+            if sede and (st.get("sede") or "").lower() != sede.lower():
+                continue
+            if horario and (st.get("horario") or "").lower() != horario.lower():
+                continue
+            try:
+                local = parse_ts(r["created_at"]).astimezone(PERU_TZ)
+                fecha, hora = local.strftime("%Y-%m-%d"), local.strftime("%H:%M:%S")
+            except (ValueError, TypeError):
+                fecha, hora = "", ""
+            salida.append((fecha, hora, st.get("full_name") or "", st.get("dni") or "",
+                           st.get("sede") or "", st.get("horario") or "", st.get("turno") or "",
+                           r["student_id"], str(r["id"])))
+        if salida:
+            yield salida
+
+
+# ── CSV ──────────────────────────────────────────────────
+async def _csv(records: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    # BOM: Excel abre el CSV como UTF-8 (tildes y ñ) sin pasar por el asistente
+    buf.write("\ufeff")
+    writer.writerow(COLUMNS)
+    async for filas in records:
+        writer.writerows(filas)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    resto = buf.getvalue()
+    if resto:
+        yield resto.encode("utf-8")
+
+
+# ── XLSX (SpreadsheetML mínimo, sin dependencias) ────────
+class _Sink(io.RawIOBase):
+    """Destino no seekable de zipfile: junta lo escrito hasta que se lo drena."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Asistencia" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+
+def _xlsx_row(valores) -> str:
+    # Celdas inlineStr: no hace falta la tabla sharedStrings (que obligaría a juntar todo antes)
+    return "<row>" + "".join(
+        f'<c t="inlineStr"><is><t>{escape(_XML_INVALIDO.sub("", v))}</t></is></c>' for v in valores
+    ) + "</row>"
+
+
+async def _xlsx(records: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for nombre, xml in _XLSX_PARTS.items():
+            zf.writestr(nombre, xml)
+        # force_zip64: el tamaño final no se conoce al abrir la entrada
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as hoja:
+            hoja.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                       b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                       b'<sheetData>')
+            hoja.write(_xlsx_row(COLUMNS).encode("utf-8"))
+            async for filas in records:
+                hoja.write("".join(_xlsx_row(f) for f in filas).encode("utf-8"))
+                data = sink.drain()
+                if data:
+                    yield data
+            hoja.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+def export_stream(period: str, fmt: str, sede: Optional[str] = None,
+                  horario: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Cuerpo del StreamingResponse de /admin/attendance/export. ValueError si el período no es válido."""
+    inicio, fin = period_bounds(period)
+    records = _records(inicio, fin, sede, horario)
+    return _xlsx(records) if fmt == "xlsx" else _csv(records)
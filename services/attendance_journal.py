@@ -0,0 +1,291 @@
+# services/attendance_journal.py — Cola write-behind de asistencias con diario local
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from postgrest.exceptions import APIError
+from starlette.concurrency import run_in_threadpool
+
+from database import db_execute, db_fetch_all
+from services.events import attendance_inserted
+from services.metrics import metrics
+from services.scan_dedup import parse_ts
+
+# ATTENDANCE_WRITE_BEHIND=1 → el scan responde apenas la asistencia queda en el diario
+WRITE_BEHIND = os.getenv("ATTENDANCE_WRITE_BEHIND", "0") == "1"
+JOURNAL_PATH = os.getenv("ATTENDANCE_JOURNAL_PATH", "data/attendance_journal.jsonl")
+FLUSH_BATCH = int(os.getenv("ATTENDANCE_FLUSH_BATCH", "50"))
+FLUSH_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS", "1"))
+MAX_BACKOFF_SECONDS = 30.0
+# El diario se reescribe (solo con lo pendiente) cuando supera este tamaño
+COMPACT_BYTES = 1_000_000
+
+
+def _rejected(e: Exception) -> bool:
+    """
+    True si PostgREST rechazó las filas (HTTP 4xx: tipo inválido, FK, NOT NULL...):
+    reintentar el mismo lote no sirve. Caídas de red, 5xx, timeouts, 429 y
+    permisos (se arreglan sin tocar las filas) se tratan como transitorios.
+    """
+    if not isinstance(e, APIError):
+        return False
+    code = str(e.code or "")
+    if len(code) == 3:      # respuesta sin JSON: el código es el status HTTP
+        return code.startswith("4") and code not in ("401", "403", "408", "429")
+    if code == "42501":
+        return False
+    return code.startswith(("22", "23", "42", "PGRST1", "PGRST2"))
+
+
+class AttendanceJournal:
+    """
+    Asistencias aceptadas pero aún no insertadas en `attendance`.
+
+    Cada scan se agrega al diario con fsync antes de responder
+    ({"op": "add", "id", "row"}); cuando el INSERT masivo termina se anota
+    {"op": "done", "ids"}. Al arrancar, `load()` recupera lo que quedó sin
+    "done". Esas filas recuperadas pueden haberse insertado justo antes de
+    una caída, así que antes de reinsertarlas se comparan contra la BD.
+
+    Si PostgREST rechaza el lote (4xx), se parte en mitades hasta aislar las
+    filas malas; esas van a `dead_path` y salen del diario para no trabar
+    al resto. Los errores transitorios dejan el lote entero para reintentar.
+    """
+
+    def __init__(self, path: str = JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}          # entry_id → (fila, aceptada_en monotonic)
+        self._recovered = set()     # entry_ids leídos del diario al arrancar
+        self._wake: Optional[asyncio.Event] = None
+        self._file = None
+        self.flushed = 0
+        self.failures = 0
+        self.dead_letters = 0
+        self.last_flush_ms = 0.0
+
+    # ── DIARIO ───────────────────────────────────────────
+    @property
+    def dead_path(self) -> str:
+        """'data/x.jsonl' → 'data/x.dead.jsonl' (sigue al diario si main.py lo hace por worker)."""
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.dead{ext}"
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def _write(self, records: list):
+        f = self._open()
+        f.write("".join(json.dumps(r, separators=(",", ":")) + "\n" for r in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def load(self):
+        """Recupera las entradas sin confirmar de una ejecución anterior."""
+        if not os.path.exists(self.path):
+            return
+        adds, done = {}, set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue        # última línea a medio escribir
+                if rec.get("op") == "add":
+                    adds[rec["id"]] = rec["row"]
+                elif rec.get("op") == "done":
+                    done.update(rec["ids"])
+        ahora = time.monotonic()
+        with self._lock:
+            for entry_id, fila in adds.items():
+                if entry_id not in done:
+                    self._pending[entry_id] = (fila, ahora)
+                    self._recovered.add(entry_id)
+            self._compact()
+        if self._pending:
+            print(f"[journal] {len(self._pending)} asistencias pendientes recuperadas")
+
+    def _compact(self):
+        """Reescribe el diario solo con lo pendiente (llamar con el lock tomado)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry_id, (fila, _) in self._pending.items():
+                f.write(json.dumps({"op": "add", "id": entry_id, "row": fila}, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    # ── ENCOLAR ──────────────────────────────────────────
+    def _append(self, fila: dict) -> str:
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._write([{"op": "add", "id": entry_id, "row": fila}])
+            self._pending[entry_id] = (fila, time.monotonic())
+            lleno = len(self._pending) >= FLUSH_BATCH
+        if lleno and self._wake is not None:
+            self._wake.set()
+        return entry_id
+
+    async def enqueue(self, fila: dict) -> str:
+        """Agrega la fila al diario (con fsync) y vuelve sin esperar a Supabase."""
+        return await run_in_threadpool(self._append, fila)
+
+    # ── VACIADO ──────────────────────────────────────────
+    async def _filter_already_inserted(self, lote: list) -> list:
+        """Descarta filas recuperadas del diario que ya están en `attendance`."""
+        recuperadas = [(eid, fila) for eid, fila in lote if eid in self._recovered]
+        if not recuperadas:
+            return lote
+        ids = list({fila["student_id"] for _, fila in recuperadas})
+        tiempos = [parse_ts(fila["created_at"]) for _, fila in recuperadas]
+        desde, hasta = min(tiempos).isoformat(), max(tiempos).isoformat()
+        existentes = await db_fetch_all(lambda db: db.table("attendance").select("student_id, created_at")
+                                        .in_("student_id", ids)
+                                        .gte("created_at", desde).lte("created_at", hasta)
+                                        .order("id"))
+        vistos = set()
+        for r in existentes:
+            try:
+                vistos.add((r["student_id"], parse_ts(r["created_at"])))
+            except (ValueError, TypeError):
+                continue
+        ya = {eid for eid, fila in recuperadas
+              if (fila["student_id"], parse_ts(fila["created_at"])) in vistos}
+        if ya:
+            self._confirm(list(ya), [])
+        return [(eid, fila) for eid, fila in lote if eid not in ya]
+
+    def _confirm(self, entry_ids: list, filas: list):
+        with self._lock:
+            self._write([{"op": "done", "ids": entry_ids}])
+            for eid in entry_ids:
+                self._pending.pop(eid, None)
+                self._recovered.discard(eid)
+            if not self._pending and os.path.getsize(self.path) > COMPACT_BYTES:
+                self._compact()
+        self.flushed += len(filas)
+
+    def _dead_letter(self, lote: list, error: APIError):
+        """Aparta filas rechazadas por PostgREST en `dead_path` y las saca del diario."""
+        motivo = f"{error.code}: {error.message or error.details}"
+        en = datetime.now(timezone.utc).isoformat()
+        os.makedirs(os.path.dirname(self.dead_path) or ".", exist_ok=True)
+        with open(self.dead_path, "a", encoding="utf-8") as f:
+            for eid, fila in lote:
+                f.write(json.dumps({"id": eid, "row": fila, "error": motivo, "at": en},
+                                   separators=(",", ":"), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._confirm([eid for eid, _ in lote], [])
+        self.dead_letters += len(lote)
+        print(f"[journal] {len(lote)} asistencia(s) rechazada(s) → {self.dead_path}: {motivo}")
+
+    async def _insert(self, lote: list):
+        """INSERT del lote; ante un 4xx lo parte en mitades hasta aislar las filas malas."""
+        filas = [fila for _, fila in lote]
+        try:
+            await db_execute(lambda db: db.table("attendance").insert(filas))
+        except Exception as e:
+            if not _rejected(e):
+                raise
+            if len(lote) == 1:
+                await run_in_threadpool(self._dead_letter, lote, e)
+                return
+            mitad = len(lote) // 2
+            await self._insert(lote[:mitad])
+            await self._insert(lote[mitad:])
+            return
+        await run_in_threadpool(self._confirm, [eid for eid, _ in lote], filas)
+        attendance_inserted(filas)
+
+    async def flush_once(self) -> int:
+        """Procesa hasta FLUSH_BATCH filas pendientes. Devuelve cuántas tomó; lanza si falla
+        por un error transitorio (lo ya insertado del lote queda confirmado)."""
+        with self._lock:
+            lote = [(eid, fila) for eid, (fila, _) in list(self._pending.items())[:FLUSH_BATCH]]
+        if not lote:
+            return 0
+        tomadas = len(lote)
+        t0 = time.perf_counter()
+        lote = await self._filter_already_inserted(lote)
+        if lote:
+            await self._insert(lote)
+        self.last_flush_ms = (time.perf_counter() - t0) * 1000
+        return tomadas
+
+    async def flush(self):
+        """Vacía todo lo pendiente (apagado ordenado)."""
+        while self._pending:
+            try:
+                if not await self.flush_once():
+                    return
+            except Exception as e:
+                print(f"[journal] No se pudo vaciar al apagar ({len(self._pending)} quedan en el diario): {e}")
+                return
+
+    async def run_flusher(self, interval: float = FLUSH_SECONDS):
+        """Tarea de fondo (se lanza en el arranque de main.py): vacía en lotes y reintenta con backoff."""
+        self._wake = asyncio.Event()
+        espera = interval
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                while await self.flush_once() >= FLUSH_BATCH:
+                    pass
+                espera = interval
+            except Exception as e:
+                # Los rechazos (4xx) ya se apartaron en _insert: acá solo llegan transitorios
+                self.failures += 1
+                espera = min(espera * 2, MAX_BACKOFF_SECONDS)
+                print(f"[journal] Error insertando asistencias ({len(self._pending)} pendientes), "
+                      f"reintento en {espera:.0f}s: {e}")
+
+    # ── MÉTRICAS ─────────────────────────────────────────
+    def lag_seconds(self) -> float:
+        """Antigüedad de la asistencia pendiente más vieja."""
+        with self._lock:
+            if not self._pending:
+                return 0.0
+            return time.monotonic() - min(t for _, t in self._pending.values())
+
+    def stats(self) -> dict:
+        return {
+            "enabled":       WRITE_BEHIND,
+            "pending":       len(self._pending),
+            "lag_seconds":   round(self.lag_seconds(), 3),
+            "flushed":       self.flushed,
+            "failures":      self.failures,
+            "dead_letters":  self.dead_letters,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+attendance_journal = AttendanceJournal()
+
+metrics.register_gauge("emblema_attendance_queue_depth", "Asistencias aceptadas pendientes de INSERT",
+                       lambda: len(attendance_journal._pending))
+metrics.register_gauge("emblema_attendance_flush_lag_seconds", "Antigüedad de la asistencia pendiente más vieja",
+                       attendance_journal.lag_seconds)
+metrics.register_gauge("emblema_attendance_flushed_total", "Asistencias insertadas desde el diario",
+                       lambda: attendance_journal.flushed)
+metrics.register_gauge("emblema_attendance_flush_failures_total", "Vaciados del diario que fallaron",
+                       lambda: attendance_journal.failures)
+metrics.register_gauge("emblema_attendance_dead_letters_total",
+                       "Asistencias rechazadas por PostgREST (4xx) y apartadas al archivo dead-letter",
+                       lambda: attendance_journal.dead_letters)
@@ -0,0 +1,191 @@
+# services/attendance_matrix.py — Matriz alumno × día del calendario admin con bitmaps roaring
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from pyroaring import BitMap
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import fetch_all
+from services.scan_dedup import parse_ts
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+# Meses que se mantienen en memoria (el calendario suele mirar el actual y los anteriores)
+MAX_MONTHS = 13
+
+
+def month_bounds(month: str) -> tuple:
+    """'2026-02' → (inicio, fin) en hora de Lima, fin exclusivo. ValueError si no es YYYY-MM."""
+    inicio = datetime.strptime(month, "%Y-%m").replace(tzinfo=PERU_TZ)
+    if inicio.month == 12:
+        fin = inicio.replace(year=inicio.year + 1, month=1)
+    else:
+        fin = inicio.replace(month=inicio.month + 1)
+    return inicio, fin
+
+
+class AttendanceMatrix:
+    """
+    Por cada mes cargado, un BitMap por día con los índices densos de los
+    alumnos que asistieron (día en hora de Lima).
+
+    - Los student_id (uuid) se traducen a enteros 0..N una sola vez (`_index`).
+    - Un mes se carga completo la primera vez que se pide; después cada
+      inserción lo actualiza vía `record()` (services.events). Lo que llega
+      mientras el mes se está cargando se guarda en `_loading` y se aplica al
+      terminar (la consulta pudo haber leído antes de esos INSERT).
+    - Los filtros (sede, horario, turno) también son bitmaps, así que filtrar
+      es una intersección y "asistió algún día" es una unión.
+    """
+
+    def __init__(self, max_months: int = MAX_MONTHS):
+        self.max_months = max_months
+        self._lock = threading.Lock()
+        self._index = {}            # student_id → entero denso
+        self._ids = []              # entero denso → student_id
+        self._months = OrderedDict()  # "YYYY-MM" → {día: BitMap}
+        self._loading = {}          # "YYYY-MM" en carga → [(día, índice)] recibidos mientras tanto
+
+    def _idx(self, sid: str) -> int:
+        i = self._index.get(sid)
+        if i is None:
+            i = self._index[sid] = len(self._ids)
+            self._ids.append(sid)
+        return i
+
+    # ── CARGA ────────────────────────────────────────────
+    def _load(self, month: str) -> dict:
+        inicio, fin = month_bounds(month)
+        with self._lock:
+            self._loading.setdefault(month, [])
+        try:
+            rows = fetch_all(lambda db: db.table("attendance").select("student_id, created_at")
+                             .gte("created_at", inicio.isoformat()).lt("created_at", fin.isoformat())
+                             .order("id"))
+        except Exception:
+            with self._lock:
+                self._loading.pop(month, None)
+            raise
+        dias = {}
+        with self._lock:
+            for r in rows:
+                try:
+                    dia = parse_ts(r["created_at"]).astimezone(PERU_TZ).day
+                except (KeyError, ValueError, TypeError):
+                    continue
+                dias.setdefault(dia, BitMap()).add(self._idx(r["student_id"]))
+            # Si otro request cargó el mismo mes en paralelo, se combinan ambos
+            actual = self._months.get(month)
+            if actual is not None:
+                for dia, bm in actual.items():
+                    dias.setdefault(dia, BitMap()).update(bm)
+            for dia, i in self._loading.pop(month, ()):
+                dias.setdefault(dia, BitMap()).add(i)
+            self._months[month] = dias
+            self._months.move_to_end(month)
+            while len(self._months) > self.max_months:
+                self._months.popitem(last=False)
+        return dias
+
+    def month(self, month: str) -> dict:
+        """{día: BitMap} del mes (lo carga si hace falta)."""
+        with self._lock:
+            dias = self._months.get(month)
+            if dias is not None:
+                self._months.move_to_end(month)
+                return dias
+        return self._load(month)
+
+    # ── ACTUALIZACIÓN INCREMENTAL ────────────────────────
+    def record(self, rows: list):
+        """rows: asistencias recién insertadas ({student_id, created_at})."""
+        with self._lock:
+            for r in rows:
+                try:
+                    local = parse_ts(r["created_at"]).astimezone(PERU_TZ)
+                except (KeyError, ValueError, TypeError):
+                    continue
+                mes = local.strftime("%Y-%m")
+                dias = self._months.get(mes)
+                if dias is not None:
+                    dias.setdefault(local.day, BitMap()).add(self._idx(r["student_id"]))
+                elif mes in self._loading:
+                    self._loading[mes].append((local.day, self._idx(r["student_id"])))
+
+    # ── CONSULTA ─────────────────────────────────────────
+    def build(self, month: str, students: list, sede: Optional[str] = None,
+              horario: Optional[str] = None, turno: Optional[str] = None) -> dict:
+        """
+        students: filas del directorio (id, full_name, horario, turno, sede).
+        Devuelve la matriz del mes para los alumnos que pasan los filtros:
+        una máscara de bits por alumno (bit d-1 = asistió el día d) y totales.
+        """
+        inicio, fin = month_bounds(month)
+        n_dias = (fin - inicio).days
+        dias = self.month(month)
+
+        # Bitmaps por valor de cada filtro; el filtro final es su intersección
+        por_campo = {"sede": {}, "horario": {}, "turno": {}}
+        todos = BitMap()
+        with self._lock:
+            por_id = {}
+            for st in students:
+                i = self._idx(st["id"])
+                por_id[i] = st
+                todos.add(i)
+                for campo, grupos in por_campo.items():
+                    grupos.setdefault((st.get(campo) or "").lower(), BitMap()).add(i)
+            dias = {d: BitMap(bm) for d, bm in dias.items()}
+
+        filtro = todos
+        for campo, valor in (("sede", sede), ("horario", horario), ("turno", turno)):
+            if valor:
+                filtro = filtro & por_campo[campo].get(valor.lower(), BitMap())
+
+        masks = {}
+        por_dia = [0] * n_dias
+        alguna = BitMap()
+        for dia, bm in dias.items():
+            if not 1 <= dia <= n_dias:
+                continue
+            presentes = bm & filtro
+            por_dia[dia - 1] = len(presentes)
+            alguna |= presentes
+            bit = 1 << (dia - 1)
+            for i in presentes:
+                masks[i] = masks.get(i, 0) | bit
+
+        alumnos = sorted((por_id[i] for i in filtro), key=lambda s: s.get("full_name") or "")
+        return {
+            "month": month,
+            "days":  n_dias,
+            "students": [{
+                "id":        st["id"],
+                "full_name": st.get("full_name"),
+                "horario":   st.get("horario"),
+                "turno":     st.get("turno"),
+                "sede":      st.get("sede"),
+                "mask":      masks.get(self._index[st["id"]], 0),
+            } for st in alumnos],
+            "totals": {
+                "per_day":    por_dia,
+                "presencias": sum(por_dia),
+                "alumnos":    len(filtro),
+                "con_asistencia": len(alguna),
+            },
+        }
+
+    def stats(self) -> dict:
+        return {
+            "students": len(self._ids),
+            "months":   list(self._months),
+        }
+
+
+attendance_matrix = AttendanceMatrix()
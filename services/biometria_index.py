@@ -0,0 +1,89 @@
+# services/biometria_index.py — Última medición biométrica por alumno (ranking público)
+import threading
+from heapq import nlargest
+from typing import List
+
+from database import fetch_all, supabase
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
+
+BIO_FIELDS = "id, student_id, talla, peso, fecha, created_at"
+
+
+class LatestBiometria:
+    """
+    Índice student_id → medición más reciente (por created_at).
+
+    Se carga una vez desde `biometria` y luego se mantiene con cada alta y baja
+    hecha por /admin/biometria: un alta es siempre la última del alumno; una
+    baja solo obliga a releer a ese alumno si borró justamente su última medición.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}           # student_id → fila de biometria
+        self._loaded = False
+
+    def _load(self):
+        rows = fetch_all(lambda db: db.table("biometria").select(BIO_FIELDS)
+                         .order("created_at", desc=True).order("id"))
+        latest = {}
+        for r in rows:
+            latest.setdefault(r["student_id"], r)
+        with self._lock:
+            self._latest = latest
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._load()
+
+    def _refresh_student(self, student_id: str):
+        res = supabase.table("biometria").select(BIO_FIELDS).eq("student_id", student_id) \
+            .order("created_at", desc=True).limit(1).execute()
+        with self._lock:
+            if res.data:
+                self._latest[student_id] = res.data[0]
+            else:
+                self._latest.pop(student_id, None)
+
+    # ── MANTENIMIENTO ────────────────────────────────────
+    def record_insert(self, row: dict):
+        """Fila devuelta por el INSERT en `biometria`."""
+        invalidation_bus.publish("biometria_insert", row)
+        replica.record_biometria(row)
+        if not self._loaded or not row.get("student_id"):
+            return
+        with self._lock:
+            self._latest[row["student_id"]] = row
+
+    def record_delete(self, rows: List[dict]):
+        """Filas devueltas por el DELETE en `biometria`."""
+        invalidation_bus.publish("biometria_delete", rows)
+        replica.delete_biometria(rows)
+        if not self._loaded:
+            return
+        for row in rows:
+            sid = row.get("student_id")
+            actual = self._latest.get(sid)
+            if actual and actual.get("id") == row.get("id"):
+                self._refresh_student(sid)
+
+    # ── LECTURA ──────────────────────────────────────────
+    def top(self, campo: str, alumnos: dict, limit: int = 20) -> List[tuple]:
+        """
+        [(alumno, medición)] con el mayor valor de `campo`, entre los alumnos dados
+        (dict student_id → fila de students ya filtrada por sede/categoría).
+        """
+        self._ensure_loaded()
+        with self._lock:
+            candidatos = [
+                (alumnos[sid], bio) for sid, bio in self._latest.items()
+                if sid in alumnos and bio.get(campo) is not None
+            ]
+        return nlargest(limit, candidatos, key=lambda t: float(t[1][campo]))
+
+
+latest_biometria = LatestBiometria()
+invalidation_bus.subscribe("biometria_insert", latest_biometria.record_insert)
+invalidation_bus.subscribe("biometria_delete", latest_biometria.record_delete)
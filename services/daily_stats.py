@@ -0,0 +1,95 @@
+# services/daily_stats.py — Contadores del día para /admin/stats (sin COUNT sobre attendance)
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import supabase
+from services.scan_dedup import parse_ts
+from services.student_cache import student_directory
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+
+class DailyCounters:
+    """
+    Asistencias de hoy (hora de Lima) y alumnos activos, leídos de memoria.
+
+    - `presentes`: se cuenta UNA vez con count="exact" si el proceso arranca a
+      mitad del día; desde ahí suma con cada INSERT (services.events) y
+      vuelve a 0 en la medianoche de Lima sin consultar la BD.
+    - `activos`: sale del directorio de alumnos, que ya se invalida en cada
+      alta, baja o reactivación; se recuenta solo cuando cambia su `generation`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day: Optional[str] = None
+        self._present = 0
+        self._active_gen = None
+        self._active = 0
+
+    # ── ASISTENCIAS DE HOY ───────────────────────────────
+    def _seed(self, hoy: str):
+        inicio = datetime.strptime(hoy, "%Y-%m-%d").replace(tzinfo=PERU_TZ)
+        res = supabase.table("attendance").select("id", count="exact") \
+            .gte("created_at", inicio.isoformat()) \
+            .lt("created_at", (inicio + timedelta(days=1)).isoformat()) \
+            .limit(1).execute()
+        with self._lock:
+            if self._day != hoy:
+                self._day, self._present = hoy, res.count or 0
+
+    def _roll(self, hoy: str) -> bool:
+        """Pasa al día nuevo en cero. False si todavía no hay conteo base."""
+        if self._day is None:
+            return False
+        if self._day != hoy:
+            self._day, self._present = hoy, 0
+        return True
+
+    def record(self, rows: list):
+        """rows: asistencias recién insertadas ({student_id, created_at})."""
+        hoy = datetime.now(PERU_TZ).strftime("%Y-%m-%d")
+        with self._lock:
+            if not self._roll(hoy):
+                return                      # el primer conteo ya las incluirá
+            for r in rows:
+                try:
+                    if parse_ts(r["created_at"]).astimezone(PERU_TZ).strftime("%Y-%m-%d") == hoy:
+                        self._present += 1
+                except (KeyError, ValueError, TypeError):
+                    continue
+
+    # ── ALUMNOS ACTIVOS ──────────────────────────────────
+    def _active_count(self) -> int:
+        alumnos = student_directory.all()
+        generation = student_directory.generation
+        with self._lock:
+            if generation != self._active_gen:
+                self._active = sum(1 for a in alumnos if a.get("is_active"))
+                self._active_gen = generation
+            return self._active
+
+    # ── LECTURA ──────────────────────────────────────────
+    def snapshot(self) -> dict:
+        hoy = datetime.now(PERU_TZ).strftime("%Y-%m-%d")
+        with self._lock:
+            listo = self._roll(hoy)
+        if not listo:
+            self._seed(hoy)
+        total = self._active_count()
+        presentes = self._present
+        return {
+            "total_alumnos": total,
+            "presentes_hoy": presentes,
+            "ausentes_hoy": max(0, total - presentes),
+            "fecha": hoy,
+        }
+
+
+daily_counters = DailyCounters()
@@ -0,0 +1,42 @@
+# services/events.py — Avisos de escritura para mantener al día las vistas en memoria
+from services.leaderboard import monthly_counters
+from services.streaks import streak_index
+from services.scan_dedup import recent_scans
+from services.attendance_matrix import attendance_matrix
+from services.daily_stats import daily_counters
+from services.response_cache import public_cache
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
+from services.student_cache import student_directory
+
+# Filas por aviso al resto de los workers (cada aviso es un datagrama)
+BUS_CHUNK = 200
+
+
+def attendance_inserted(rows: list):
+    """
+    Llamar después de cada INSERT exitoso en `attendance`.
+    rows: [{"student_id": ..., "created_at": ...}, ...]
+    """
+    monthly_counters.record(rows)
+    streak_index.record(rows)
+    recent_scans.record(rows)
+    attendance_matrix.record(rows)
+    daily_counters.record(rows)
+    replica.record_attendance(rows)
+    # Leaderboard y racha de la ficha pública dependen de la asistencia. Solo
+    # local: los demás workers invalidan lo suyo al recibir el aviso "attendance".
+    # La ficha se pide por id o por DNI; si el alumno no está en memoria, la
+    # entrada por DNI vence por TTL.
+    public_cache.invalidate("/public/leaderboard/month", broadcast=False)
+    claves = set()
+    for r in rows:
+        sid = r.get("student_id")
+        claves.add(sid)
+        claves.add((student_directory.peek(sid) or {}).get("dni"))
+    public_cache.invalidate_keys("/public/student/{dni_or_id}/info", "dni_or_id", claves, broadcast=False)
+    for i in range(0, len(rows), BUS_CHUNK):
+        invalidation_bus.publish("attendance", rows[i:i + BUS_CHUNK])
+
+
+invalidation_bus.subscribe("attendance", attendance_inserted)
@@ -0,0 +1,201 @@
+# services/invalidation_bus.py — Avisos de invalidación entre workers (sockets Unix datagrama)
+import os
+import json
+import queue
+import time
+import fcntl
+import socket
+import threading
+from collections import defaultdict
+from typing import Callable, Optional
+
+# uvicorn lee WEB_CONCURRENCY como valor por defecto de --workers
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+# INVALIDATION_BUS=1 lo fuerza con un solo worker (p. ej. varias instancias de uvicorn detrás de nginx)
+ENABLED = WORKERS > 1 or os.getenv("INVALIDATION_BUS", "0") == "1"
+# Un directorio por despliegue: dos apps en la misma máquina no se mezclan
+BUS_DIR = os.getenv("INVALIDATION_BUS_DIR", f"/tmp/emblema-bus-{os.getenv('PORT', '8000')}")
+
+# Un datagrama Unix entra holgado bajo ~200 KB; los lotes grandes se parten antes
+MAX_DATAGRAM = 64 * 1024
+# Avisos en cola para enviar; la cola del kernel por socket es corta (net.unix.max_dgram_qlen)
+OUTBOX_SIZE = 10_000
+# Cuánto puede esperar el envío a un worker ocupado antes de descartar el aviso
+SEND_TIMEOUT = 1.0
+# Cada cuánto se relista BUS_DIR para descubrir workers nuevos
+PEERS_REFRESH = 1.0
+
+_local = threading.local()
+
+
+class InvalidationBus:
+    """
+    Cada worker abre un socket Unix datagrama `BUS_DIR/<pid>.sock` y
+    `publish()` manda el aviso a todos los demás sockets del directorio.
+
+    - Los módulos con estado en memoria se suscriben a su tópico junto a su
+      singleton (`subscribe`) y publican al invalidar localmente. Lo que un
+      handler hace al recibir no se vuelve a publicar (marca por hilo).
+    - `publish()` solo encola: un hilo aparte envía (bloqueante, con timeout),
+      así una ráfaga de scans no bloquea a los requests. Es best-effort: si un
+      worker no lee en SEND_TIMEOUT, o la cola se llena, el aviso se descarta
+      (`dropped`) y esa copia queda vieja hasta su TTL.
+    - Un socket sin dueño (worker muerto) se borra al primer envío fallido.
+    - `slot` es un número chico y estable por worker (lock sobre
+      BUS_DIR/slot.N.lock), para archivos propios como el diario de asistencia.
+    """
+
+    def __init__(self, directory: str = BUS_DIR, enabled: bool = ENABLED):
+        self.directory = directory
+        self.enabled = enabled
+        self._handlers = defaultdict(list)
+        self._sock: Optional[socket.socket] = None
+        self._send: Optional[socket.socket] = None
+        self._path: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+        self._outbox = queue.Queue(maxsize=OUTBOX_SIZE)
+        self._slot_fd = None
+        self.slot: Optional[int] = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+
+    # ── SUSCRIPCIÓN ──────────────────────────────────────
+    def subscribe(self, topic: str, handler: Callable):
+        """`handler(payload)` corre en el hilo receptor del bus."""
+        self._handlers[topic].append(handler)
+
+    # ── CICLO DE VIDA ────────────────────────────────────
+    def _claim_slot(self) -> int:
+        n = 0
+        while True:
+            fd = os.open(os.path.join(self.directory, f"slot.{n}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                n += 1
+                continue
+            self._slot_fd = fd      # el lock se libera solo cuando el proceso muere
+            return n
+
+    def start(self):
+        if not self.enabled or self._sock is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.slot = self._claim_slot()
+        self._path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._path)
+        self._send = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send.settimeout(SEND_TIMEOUT)
+        self._thread = threading.Thread(target=self._receive_loop, name="invalidation-bus", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._send_loop, name="invalidation-bus-send", daemon=True).start()
+
+    def stop(self):
+        if self._sock is None:
+            return
+        sock, self._sock = self._sock, None
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+        sock.close()
+        self._outbox.put(None)      # el hilo de envío vacía lo pendiente y cierra
+
+    def per_worker(self, path: str) -> str:
+        """'data/x.jsonl' → 'data/x.<slot>.jsonl' si el bus está activo (sin cambios si no)."""
+        if self.slot is None:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.slot}{ext}"
+
+    # ── ENVÍO ────────────────────────────────────────────
+    def _peers(self) -> list:
+        try:
+            nombres = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in nombres
+                if n.endswith(".sock") and os.path.join(self.directory, n) != self._path]
+
+    def publish(self, topic: str, payload=None):
+        """Avisa a los demás workers. No hace nada si el bus está apagado o si se
+        llama desde un handler del propio bus (evita ecos)."""
+        if self._sock is None or getattr(_local, "delivering", False):
+            return
+        data = json.dumps({"t": topic, "p": payload}, separators=(",", ":"), default=str).encode("utf-8")
+        if len(data) > MAX_DATAGRAM:
+            print(f"[bus] Aviso '{topic}' de {len(data)} bytes descartado (máximo {MAX_DATAGRAM})")
+            self.dropped += 1
+            return
+        try:
+            self._outbox.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+
+    def _send_loop(self):
+        send = self._send
+        peers, listed_at = [], 0.0
+        while True:
+            data = self._outbox.get()
+            if data is None:
+                send.close()
+                return
+            # Un worker recién arrancado carga todo de la BD: perder su primer segundo de avisos no importa
+            if time.monotonic() - listed_at > PEERS_REFRESH:
+                peers, listed_at = self._peers(), time.monotonic()
+            for peer in peers:
+                try:
+                    send.sendto(data, peer)
+                    self.sent += 1
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Nadie escucha ahí: socket de un worker que murió
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                except OSError:     # timeout incluido: worker saturado
+                    self.dropped += 1
+
+    # ── RECEPCIÓN ────────────────────────────────────────
+    def _receive_loop(self):
+        _local.delivering = True
+        sock = self._sock
+        sock.settimeout(1.0)
+        while self._sock is sock:
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError:
+                return              # socket cerrado por stop()
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            self.received += 1
+            for handler in self._handlers.get(msg.get("t"), ()):
+                try:
+                    handler(msg.get("p"))
+                except Exception as e:
+                    print(f"[bus] Error aplicando '{msg.get('t')}': {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled":  self._sock is not None,
+            "slot":     self.slot,
+            "peers":    len(self._peers()) if self._sock is not None else 0,
+            "sent":     self.sent,
+            "received": self.received,
+            "queued":   self._outbox.qsize(),
+            "dropped":  self.dropped,
+        }
+
+
+invalidation_bus = InvalidationBus()
@@ -0,0 +1,149 @@
+# services/jrs_codec.py — Códec único de credenciales: JRS firmadas (HMAC) y códigos legacy STU-
+import os
+import hmac
+import time
+import base64
+import hashlib
+import threading
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from database import db_execute, db_fetch_all
+from services.replica import replica
+
+# ── CLAVE HMAC ────────────────────────────────────────────
+# Setear QR_SIGNING_KEY=64_hex_chars en .env para producción
+_raw_key = os.getenv("QR_SIGNING_KEY", "a" * 64)
+try:
+    SIGNING_KEY = bytes.fromhex(_raw_key)
+except ValueError:
+    SIGNING_KEY = _raw_key.encode()
+
+SIGNING_KEY_HEX = SIGNING_KEY.hex()
+
+# Estado HMAC con la clave ya procesada (ipad/opad): cada firma solo hace .copy()
+_HMAC_BASE = hmac.new(SIGNING_KEY, digestmod=hashlib.sha256)
+
+# Cada cuánto se relee completo el índice de credenciales legacy
+LEGACY_INDEX_TTL = int(os.getenv("LEGACY_CREDENTIALS_TTL", "600"))
+
+
+# ── BASE64URL ─────────────────────────────────────────────
+def b64u_encode(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).rstrip(b"=").decode()
+
+
+def b64u_decode(text: str) -> str:
+    padding = 4 - len(text) % 4
+    return base64.urlsafe_b64decode(text + "=" * padding).decode("utf-8")
+
+
+# ── JRS:{uuid}:{YYYYMMDD}:{name_b64url}:{hmac16hex} ───────
+def sign(student_id: str, valid_yyyymmdd: str, name: str) -> str:
+    """Devuelve los primeros 8 bytes del HMAC-SHA256 como hex (16 chars)."""
+    h = _HMAC_BASE.copy()
+    h.update(f"{student_id}|{valid_yyyymmdd}|{name}".encode("utf-8"))
+    return h.digest()[:8].hex()
+
+
+def to_yyyymmdd(valid_until: Optional[str]) -> str:
+    """'2026-02-28' → '20260228' ('00000000' si no hay fecha válida)."""
+    try:
+        return datetime.strptime(valid_until or "", "%Y-%m-%d").strftime("%Y%m%d")
+    except ValueError:
+        return "00000000"
+
+
+def encode(student_id: str, valid_yyyymmdd: str, name: str) -> str:
+    return f"JRS:{student_id}:{valid_yyyymmdd}:{b64u_encode(name)}:{sign(student_id, valid_yyyymmdd, name)}"
+
+
+def parse(code: str) -> Optional[dict]:
+    """
+    Parsea un payload JRS y verifica la firma.
+    Devuelve {student_id, valid_date, name} o None si es inválido/manipulado.
+    """
+    if not code.startswith("JRS:"):
+        return None
+    try:
+        parts = code[4:].split(":")
+        if len(parts) != 4:
+            return None
+        student_id, valid_date, name_b64, sig = parts
+        name = b64u_decode(name_b64)
+        # Bytes: compare_digest lanza TypeError con str no ASCII
+        if not hmac.compare_digest(sign(student_id, valid_date, name).encode(), sig.encode("utf-8")):
+            return None                      # firma inválida
+    except Exception:
+        return None
+    return {"student_id": student_id, "valid_date": valid_date, "name": name}
+
+
+def encode_many(students: Iterable[dict]) -> List[str]:
+    """Payloads JRS para filas {id, full_name, valid_until} (para las rutas masivas)."""
+    return [encode(s["id"], to_yyyymmdd(s.get("valid_until")), s["full_name"]) for s in students]
+
+
+# ── CÓDIGOS LEGACY (STU-XXXXXXXX) ─────────────────────────
+class LegacyCredentials:
+    """
+    code → (credential_id, student_id) de las credenciales activas.
+
+    Reemplaza el join credentials⇄students del scan: con el student_id, los
+    datos del alumno salen del directorio en memoria. Se carga completo al
+    primer uso y cada LEGACY_INDEX_TTL; un código que no está se busca solo
+    (sin join) y se agrega. `add()` lo llama la ruta que crea credenciales.
+    """
+
+    def __init__(self, ttl: int = LEGACY_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._loaded_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, code: str, credential_id: str, student_id: str):
+        with self._lock:
+            self._codes[code] = (credential_id, student_id)
+        replica.mark_dirty("credentials", credential_id)
+
+    async def _reload(self):
+        rows = await db_fetch_all(lambda db: db.table("credentials").select("id, code, student_id")
+                                  .eq("is_active", True).order("id"))
+        with self._lock:
+            self._codes = {r["code"]: (r["id"], r["student_id"]) for r in rows}
+            self._loaded_at = time.monotonic()
+
+    async def lookup(self, code: str) -> Optional[Tuple[str, str]]:
+        """(credential_id, student_id) del código activo, o None si no existe."""
+        if time.monotonic() - self._loaded_at > self.ttl:
+            await self._reload()
+        with self._lock:
+            found = self._codes.get(code)
+        if found is not None:
+            self.hits += 1
+            return found
+
+        self.misses += 1
+        fila = replica.credential_by_code(code) if replica.ready("credentials") else None
+        if fila is None:
+            res = await db_execute(lambda db: db.table("credentials").select("id, student_id")
+                                   .eq("code", code).eq("is_active", True))
+            if not res.data:
+                return None
+            fila = res.data[0]
+        found = (fila["id"], fila["student_id"])
+        with self._lock:
+            self._codes[code] = found
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "size":   len(self._codes),
+            "hits":   self.hits,
+            "misses": self.misses,
+        }
+
+
+legacy_credentials = LegacyCredentials()
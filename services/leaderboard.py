@@ -0,0 +1,99 @@
+# services/leaderboard.py — Contadores mensuales de asistencia (ranking público)
+import threading
+from datetime import datetime, timezone
+from heapq import nlargest
+from typing import List, Tuple
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import fetch_all
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+
+def _month_key(ts: datetime) -> str:
+    return ts.astimezone(PERU_TZ).strftime("%Y-%m")
+
+
+class MonthlyCounters:
+    """
+    Asistencias por alumno en el mes en curso (hora de Lima).
+
+    - Se reconstruye desde `attendance` una vez al arrancar y cuando cambia el mes.
+    - Cada inserción (scan, sync-batch) suma +1 en memoria vía `record()`.
+    - Mantiene aparte el top-K ordenado: como los contadores solo crecen
+      dentro del mes, un alumno entra al top únicamente si supera al último.
+      Leer el ranking cuesta O(K) sin importar el tamaño de `attendance`.
+    """
+
+    def __init__(self, top_k: int = 20):
+        self.top_k = top_k
+        self._lock = threading.Lock()
+        self._month = None
+        self._counts = {}
+        self._top: List[Tuple[int, str]] = []      # (count, student_id), desc
+
+    # ── RECONSTRUCCIÓN ───────────────────────────────────
+    def _rebuild(self, month: str):
+        now = datetime.now(PERU_TZ)
+        first_day = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
+        rows = fetch_all(lambda db: db.table("attendance").select("student_id")
+                         .gte("created_at", first_day).order("id"))
+        counts = {}
+        for r in rows:
+            sid = r["student_id"]
+            counts[sid] = counts.get(sid, 0) + 1
+        top = nlargest(self.top_k, ((c, sid) for sid, c in counts.items()), key=lambda t: t[0])
+        with self._lock:
+            self._month, self._counts, self._top = month, counts, top
+
+    def ensure_current(self):
+        """Reconstruye desde cero si aún no hay datos o si cambió el mes."""
+        month = _month_key(datetime.now(timezone.utc))
+        if month != self._month:
+            self._rebuild(month)
+
+    # ── ACTUALIZACIÓN INCREMENTAL ────────────────────────
+    def _bump(self, sid: str):
+        c = self._counts.get(sid, 0) + 1
+        self._counts[sid] = c
+        for i, (_, s) in enumerate(self._top):
+            if s == sid:
+                self._top[i] = (c, sid)
+                break
+        else:
+            if len(self._top) < self.top_k:
+                self._top.append((c, sid))
+            elif c > self._top[-1][0]:
+                self._top[-1] = (c, sid)
+            else:
+                return
+        self._top.sort(key=lambda t: t[0], reverse=True)
+
+    def record(self, rows: list):
+        """rows: asistencias recién insertadas ({student_id, created_at})."""
+        with self._lock:
+            if self._month is None:
+                return                      # la primera reconstrucción ya las incluirá
+            for r in rows:
+                try:
+                    ts = datetime.fromisoformat(str(r["created_at"]).replace("Z", "+00:00"))
+                except (KeyError, ValueError):
+                    continue
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                if _month_key(ts) == self._month:
+                    self._bump(r["student_id"])
+
+    # ── LECTURA ──────────────────────────────────────────
+    def top(self, k: int = 5) -> List[Tuple[str, int]]:
+        """[(student_id, asistencias)] de los k con más asistencias este mes."""
+        self.ensure_current()
+        with self._lock:
+            return [(sid, c) for c, sid in self._top[:k]]
+
+
+monthly_counters = MonthlyCounters()
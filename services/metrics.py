@@ -0,0 +1,245 @@
+# services/metrics.py — Métricas de requests y de consultas a Supabase (formato Prometheus)
+import os
+import json
+import time
+import inspect
+import itertools
+import threading
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Requests más lentos que esto se loguean con el detalle de sus consultas
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+# Se mide el tamaño de 1 de cada N respuestas (json.dumps de cada resultado costaba más que la consulta)
+PAYLOAD_SAMPLE = max(1, int(os.getenv("METRICS_PAYLOAD_SAMPLE", "10")))
+# /metrics sin token para estas IPs (el scraper local); el resto necesita un token de admin
+METRICS_ALLOW = {h.strip() for h in os.getenv("METRICS_ALLOW", "127.0.0.1,::1").split(",") if h.strip()}
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_OPS = {"select", "insert", "update", "upsert", "delete"}
+
+# Consultas del request en curso (la lista se comparte con el threadpool y las tareas hijas)
+_request_queries: ContextVar[Optional[list]] = ContextVar("supabase_queries", default=None)
+
+
+def _labels(**kv) -> str:
+    def esc(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in kv.items()) + "}"
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.total += 1
+        self.sum += value
+        for i, b in enumerate(BUCKETS):
+            if value <= b:
+                self.counts[i] += 1
+
+    def render(self, name: str, labels: dict) -> list:
+        lines = [f"{name}_bucket{_labels(**labels, le=b)} {c}" for b, c in zip(BUCKETS, self.counts)]
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {self.total}")
+        lines.append(f"{name}_sum{_labels(**labels)} {self.sum:.6f}")
+        lines.append(f"{name}_count{_labels(**labels)} {self.total}")
+        return lines
+
+
+class Metrics:
+    """
+    Registro en memoria del proceso:
+    - latencia por ruta (histograma), requests por status y consultas por request;
+    - por tabla/operación de Supabase: cantidad, errores, latencia y bytes devueltos;
+    - gauges registrados por otros módulos (cachés, colas) con `register_gauge`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}           # (method, route) → Histogram
+        self._status = {}           # (method, route, status) → n
+        self._route_queries = {}    # (method, route) → consultas totales
+        self._queries = {}          # (table, op) → Histogram
+        self._errors = {}           # (table, op) → n
+        self._bytes = {}            # (table, op) → bytes
+        self._gauges = []           # (name, help, fn)
+
+    # ── REGISTRO ─────────────────────────────────────────
+    def observe_query(self, table: str, op: str, seconds: float, nbytes: Optional[int], error: bool):
+        """nbytes: tamaño de la respuesta si esta consulta cayó en la muestra, si no None."""
+        key = (table, op)
+        with self._lock:
+            self._queries.setdefault(key, Histogram()).observe(seconds)
+            if nbytes is not None:
+                self._bytes[key] = self._bytes.get(key, 0) + nbytes * PAYLOAD_SAMPLE
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+        queries = _request_queries.get()
+        if queries is not None:
+            queries.append((table, op, seconds, nbytes, error))
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, queries: list):
+        key = (method, route)
+        with self._lock:
+            self._routes.setdefault(key, Histogram()).observe(seconds)
+            skey = (method, route, status)
+            self._status[skey] = self._status.get(skey, 0) + 1
+            self._route_queries[key] = self._route_queries.get(key, 0) + len(queries)
+        if seconds * 1000 >= SLOW_REQUEST_MS:
+            detalle = "; ".join(
+                f"{t}.{op} {s * 1000:.1f}ms{f' {b / 1024:.1f}KB' if b is not None else ''}{' ERROR' if err else ''}"
+                for t, op, s, b, err in queries
+            )
+            print(f"[slow] {method} {route} {status} {seconds * 1000:.1f} ms · "
+                  f"{len(queries)} consultas: {detalle or '—'}")
+
+    def register_gauge(self, name: str, help_text: str, fn: Callable):
+        """`fn()` devuelve un número o un dict {tupla de labels (k, v) → número}."""
+        self._gauges.append((name, help_text, fn))
+
+    # ── EXPOSICIÓN ───────────────────────────────────────
+    def render(self) -> str:
+        out = []
+        with self._lock:
+            out += ["# HELP emblema_http_request_duration_seconds Latencia de requests por ruta",
+                    "# TYPE emblema_http_request_duration_seconds histogram"]
+            for (method, route), h in sorted(self._routes.items()):
+                out += h.render("emblema_http_request_duration_seconds", {"method": method, "route": route})
+
+            out += ["# HELP emblema_http_requests_total Requests por ruta y status",
+                    "# TYPE emblema_http_requests_total counter"]
+            for (method, route, status), n in sorted(self._status.items()):
+                out.append(f"emblema_http_requests_total{_labels(method=method, route=route, status=status)} {n}")
+
+            out += ["# HELP emblema_http_request_db_queries_total Consultas a Supabase emitidas por ruta",
+                    "# TYPE emblema_http_request_db_queries_total counter"]
+            for (method, route), n in sorted(self._route_queries.items()):
+                out.append(f"emblema_http_request_db_queries_total{_labels(method=method, route=route)} {n}")
+
+            out += ["# HELP emblema_supabase_query_duration_seconds Latencia de consultas a Supabase",
+                    "# TYPE emblema_supabase_query_duration_seconds histogram"]
+            for (table, op), h in sorted(self._queries.items()):
+                out += h.render("emblema_supabase_query_duration_seconds", {"table": table, "op": op})
+
+            out += ["# HELP emblema_supabase_response_bytes_total Bytes (JSON) devueltos por Supabase (estimado por muestreo)",
+                    "# TYPE emblema_supabase_response_bytes_total counter"]
+            for (table, op), n in sorted(self._bytes.items()):
+                out.append(f"emblema_supabase_response_bytes_total{_labels(table=table, op=op)} {n}")
+
+            out += ["# HELP emblema_supabase_query_errors_total Consultas a Supabase que lanzaron error",
+                    "# TYPE emblema_supabase_query_errors_total counter"]
+            for (table, op), n in sorted(self._errors.items()):
+                out.append(f"emblema_supabase_query_errors_total{_labels(table=table, op=op)} {n}")
+
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            if isinstance(value, dict):
+                for labels, v in value.items():
+                    out.append(f"{name}{_labels(**dict(labels))} {v}")
+            else:
+                out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+
+metrics = Metrics()
+
+
+# ── CONTEXTO POR REQUEST ─────────────────────────────────
+def start_request() -> tuple:
+    queries = []
+    return queries, _request_queries.set(queries)
+
+
+def end_request(token):
+    _request_queries.reset(token)
+
+
+# ── CLIENTE INSTRUMENTADO ────────────────────────────────
+_sample = itertools.count()
+
+
+def _payload_bytes(res) -> Optional[int]:
+    """Tamaño en JSON de 1 de cada PAYLOAD_SAMPLE respuestas; None para las demás."""
+    if next(_sample) % PAYLOAD_SAMPLE:
+        return None
+    data = getattr(res, "data", None)
+    if data is None:
+        return 0
+    try:
+        return len(json.dumps(data, separators=(",", ":"), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class _TracedQuery:
+    """Envuelve un query builder: cada eslabón devuelve otro _TracedQuery y execute() se mide."""
+
+    def __init__(self, builder, table: str, op: str = "select"):
+        self._builder = builder
+        self._table = table
+        self._op = op
+
+    def __getattr__(self, name):
+        attr = getattr(self._builder, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if hasattr(res, "execute"):
+                return _TracedQuery(res, self._table, name if name in _OPS else self._op)
+            return res
+        return call
+
+    def _record(self, t0: float, res, error: bool):
+        metrics.observe_query(self._table, self._op, time.perf_counter() - t0,
+                              _payload_bytes(res) if res is not None else None, error)
+
+    def execute(self):
+        t0 = time.perf_counter()
+        try:
+            res = self._builder.execute()
+        except Exception:
+            self._record(t0, None, True)
+            raise
+        if inspect.isawaitable(res):
+            return self._aexecute(res, t0)
+        self._record(t0, res, False)
+        return res
+
+    async def _aexecute(self, pending, t0: float):
+        try:
+            res = await pending
+        except Exception:
+            self._record(t0, None, True)
+            raise
+        self._record(t0, res, False)
+        return res
+
+
+class InstrumentedClient:
+    """Proxy del cliente de Supabase (sync o async) que mide cada consulta a PostgREST."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def table(self, name: str):
+        return _TracedQuery(self._client.table(name), name)
+
+    def from_(self, name: str):
+        return self.table(name)
+
+    def rpc(self, fn: str, params: Optional[dict] = None, *args, **kwargs):
+        return _TracedQuery(self._client.rpc(fn, params or {}, *args, **kwargs), f"rpc:{fn}", "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
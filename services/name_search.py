@@ -0,0 +1,150 @@
+# services/name_search.py — Índice de n-gramas en memoria para buscar alumnos por nombre o DNI
+import threading
+import unicodedata
+from datetime import datetime
+from heapq import nsmallest
+from typing import List
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from services.student_cache import student_directory
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+RESULT_FIELDS = ("id", "full_name", "dni", "batido_credits", "valid_until", "is_active", "horario")
+
+
+def normalize(text: str) -> str:
+    """'  José  ÑAHUI ' → 'jose nahui' (sin tildes, minúsculas, espacios simples)."""
+    sin_tildes = "".join(c for c in unicodedata.normalize("NFKD", text or "")
+                         if not unicodedata.combining(c))
+    return " ".join(sin_tildes.lower().split())
+
+
+def _grams(text: str) -> set:
+    """Bigramas y trigramas: los bigramas cubren las consultas de 2 caracteres."""
+    return {text[i:i + n] for n in (2, 3) for i in range(len(text) - n + 1)}
+
+
+def _ordinal(valid_until) -> int:
+    try:
+        return datetime.strptime(valid_until, "%Y-%m-%d").date().toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+class NameSearchIndex:
+    """
+    Postings n-grama → {student_id} sobre el nombre normalizado y el DNI.
+
+    Se sincroniza con el directorio de alumnos: cuando su `generation` cambia
+    (alta, edición, baja o recarga con cambios) se reindexan solo las filas que
+    cambiaron. Una búsqueda intersecta las postings de los n-gramas de cada
+    palabra de la consulta, verifica las coincidencias y ordena:
+    nombre exacto < empieza con la consulta < alguna palabra empieza con ella < contiene.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._docs = {}             # student_id → (fila, nombre normalizado, dni, vencimiento ordinal)
+        self._postings = {}         # n-grama → set(student_id)
+
+    # ── SINCRONIZACIÓN ───────────────────────────────────
+    def _unindex(self, sid: str):
+        _, nombre, dni, _ = self._docs.pop(sid)
+        for g in _grams(nombre) | _grams(dni):
+            ids = self._postings.get(g)
+            if ids is not None:
+                ids.discard(sid)
+                if not ids:
+                    del self._postings[g]
+
+    def _index(self, row: dict):
+        sid = row["id"]
+        nombre, dni = normalize(row.get("full_name")), str(row.get("dni") or "")
+        self._docs[sid] = (row, nombre, dni, _ordinal(row.get("valid_until")))
+        for g in _grams(nombre) | _grams(dni):
+            self._postings.setdefault(g, set()).add(sid)
+
+    def _sync(self):
+        alumnos = student_directory.all()
+        generation = student_directory.generation
+        with self._lock:
+            if generation == self._generation:
+                return
+            vigentes = {r["id"]: r for r in alumnos}
+            for sid in [s for s in self._docs if s not in vigentes]:
+                self._unindex(sid)
+            for sid, row in vigentes.items():
+                doc = self._docs.get(sid)
+                if doc is not None and doc[0] == row:
+                    continue
+                if doc is not None:
+                    self._unindex(sid)
+                self._index(row)
+            self._generation = generation
+
+    # ── BÚSQUEDA ─────────────────────────────────────────
+    def _candidates(self, palabras: list) -> set:
+        grupos = []
+        for p in palabras:
+            grams = _grams(p)
+            if not grams:                       # palabra de 1 letra: la verifica el filtro
+                continue
+            grupos.extend(self._postings.get(g, set()) for g in grams)
+        if not grupos:
+            return set(self._docs)
+        grupos.sort(key=len)
+        out = set(grupos[0])
+        for ids in grupos[1:]:
+            out &= ids
+            if not out:
+                break
+        return out
+
+    def search(self, q: str, limit: int = 10) -> List[dict]:
+        """Top `limit` alumnos cuyo nombre (sin tildes) o DNI contiene todas las palabras de q."""
+        consulta = normalize(q)
+        palabras = consulta.split()
+        if not palabras:
+            return []
+        self._sync()
+
+        with self._lock:
+            ranked = []
+            for sid in self._candidates(palabras):
+                row, nombre, dni, vence = self._docs[sid]
+                if consulta in dni:
+                    rango = 0 if dni == consulta else 1
+                elif all(p in nombre for p in palabras):
+                    if nombre == consulta:
+                        rango = 0
+                    elif nombre.startswith(consulta):
+                        rango = 1
+                    elif any(w.startswith(palabras[0]) for w in nombre.split()):
+                        rango = 2
+                    else:
+                        rango = 3
+                else:
+                    continue
+                ranked.append((rango, nombre, sid, row, vence))
+            top = nsmallest(limit, ranked, key=lambda t: (t[0], t[1], t[2]))
+
+        # Días restantes en bloque: un solo "hoy" y los vencimientos ya convertidos a ordinal
+        hoy = datetime.now(PERU_TZ).date().toordinal()
+        dias = [max(0, vence - hoy) if vence else 0 for *_, vence in top]
+        return [dict({k: row.get(k) for k in RESULT_FIELDS}, dias_restantes=d)
+                for (_, _, _, row, _), d in zip(top, dias)]
+
+    def stats(self) -> dict:
+        return {
+            "students": len(self._docs),
+            "grams":    len(self._postings),
+        }
+
+
+name_search = NameSearchIndex()
@@ -0,0 +1,99 @@
+# services/offline_snapshot.py — Snapshot versionado para el modo offline del scanner
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+from services.student_cache import student_directory
+
+# Vistas anteriores que se guardan para responder deltas
+SNAPSHOT_HISTORY = int(os.getenv("OFFLINE_SNAPSHOT_HISTORY", "64"))
+
+
+def _entry(alumno: dict, hoy) -> dict:
+    """Estado offline de un alumno tal como lo consume scanner.js."""
+    if not alumno.get("is_active"):
+        return {"name": alumno["full_name"], "status": "debe", "detalle": "Alumno inactivo"}
+
+    fecha_str = alumno.get("valid_until")
+    if not fecha_str:
+        return {"name": alumno["full_name"], "status": "debe", "detalle": "Sin pago registrado"}
+
+    try:
+        fecha_venc = datetime.strptime(fecha_str, "%Y-%m-%d").date()
+    except Exception:
+        return {"name": alumno["full_name"], "status": "success", "detalle": "OK"}
+
+    if fecha_venc < hoy:
+        dias = (hoy - fecha_venc).days
+        return {"name": alumno["full_name"], "status": "debe",
+                "detalle": f"Venció hace {dias} día{'s' if dias != 1 else ''}."}
+    return {"name": alumno["full_name"], "status": "success", "detalle": "OK"}
+
+
+class OfflineSnapshot:
+    """
+    Vista derivada del directorio de alumnos para /attendance/scanner/offline-data.
+
+    Solo se recalcula cuando cambia el directorio (`generation`) o el día, y
+    no fuerza la recarga del directorio por TTL: usa lo que ya está en
+    memoria (más los alumnos marcados sucios).
+
+    La versión es un hash del contenido (52 bits, entra en un número de JS),
+    así que todos los workers con los mismos datos entregan la misma versión
+    y el mismo ETag. Cada worker guarda las últimas SNAPSHOT_HISTORY vistas
+    por versión para armar el delta; un `since` que no conoce (vista que este
+    worker nunca tuvo, o muy antigua) recibe el snapshot completo.
+    """
+
+    def __init__(self, history: int = SNAPSHOT_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._entries = {}          # student_id → entry
+        self._versions = OrderedDict()  # versión → entries de esa vista
+        self._source = None         # (generation del directorio, día)
+        self._body = b"{}"          # snapshot completo ya serializado
+        self.version = 0
+
+    def _rebuild(self, alumnos: list, source: tuple):
+        hoy = source[1]
+        nuevas = {a["id"]: _entry(a, hoy) for a in alumnos}
+        self._source = source
+        if self.version and nuevas == self._entries:
+            return
+        # sort_keys: el mismo contenido da los mismos bytes (y versión) en cualquier worker
+        body = json.dumps(nuevas, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        self._entries = nuevas
+        self._body = body
+        self.version = int(hashlib.sha256(body).hexdigest()[:13], 16)
+        self._versions[self.version] = nuevas
+        self._versions.move_to_end(self.version)
+        while len(self._versions) > self.history:
+            self._versions.popitem(last=False)
+
+    async def refresh(self):
+        """Chequeo barato: solo reconstruye si el directorio o el día cambiaron."""
+        alumnos = await student_directory.aall(allow_expired=True)
+        source = (student_directory.generation, datetime.now(timezone.utc).date())
+        with self._lock:
+            if source != self._source:
+                self._rebuild(alumnos, source)
+
+    def full_body(self) -> bytes:
+        return self._body
+
+    def delta(self, since: int) -> Optional[dict]:
+        """Cambios posteriores a `since`, o None si hace falta el snapshot completo."""
+        with self._lock:
+            antes = self._versions.get(since)
+            if antes is None:
+                return None
+            changed = {sid: e for sid, e in self._entries.items() if antes.get(sid) != e}
+            removed = [sid for sid in antes if sid not in self._entries]
+            return {"version": self.version, "full": False, "students": changed, "removed": removed}
+
+
+offline_snapshot = OfflineSnapshot()
@@ -0,0 +1,156 @@
+# services/qr_render.py — QR en PNG/SVG generados localmente y cacheados en qrs/
+import os
+import glob
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from services.invalidation_bus import invalidation_bus
+
+QR_DIR = "qrs"
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", "2"))
+# Los QR firmados cambian con cada mensualidad; los huérfanos más viejos se borran al arrancar
+QR_MAX_AGE_DAYS = int(os.getenv("QR_MAX_AGE_DAYS", "45"))
+
+FORMATS = ("png", "svg")
+
+
+def qr_filename(payload: str, fmt: str, student_id: Optional[str] = None) -> str:
+    """Nombre direccionado por contenido: el mismo payload siempre da el mismo archivo.
+    Los QR de un alumno llevan su id adelante, para poder borrarlos sin conocer el payload."""
+    nombre = f"{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}.{fmt}"
+    return f"{student_id}-{nombre}" if student_id else nombre
+
+
+def _render_file(payload: str, fmt: str, path: str):
+    """Corre en el pool de hilos: dibuja el QR y lo publica con un rename atómico."""
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_M
+
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECT_M, box_size=10, border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if fmt == "svg":
+        from qrcode.image.svg import SvgPathImage
+        qr.make_image(image_factory=SvgPathImage).save(tmp)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(tmp, format="PNG")
+    os.replace(tmp, path)
+
+
+class QrCache:
+    """
+    Archivos qrs/[<student_id>-]<sha256(payload)>.<png|svg>, servidos por el mount /qrs de main.py.
+
+    - Si el archivo ya existe no se vuelve a dibujar; dos pedidos simultáneos
+      del mismo payload comparten el mismo render (`_inflight`).
+    - El dibujo corre en un ThreadPoolExecutor para no ocupar el event loop.
+      No un pool de procesos: hacer fork() de un worker con hilos (bus,
+      threadpool de Starlette) puede heredar locks tomados y colgar al hijo.
+    - `evict_student()` borra los QR firmados de un alumno cuando cambia su
+      valid_until o su nombre (el payload JRS los incluye). Busca por el
+      prefijo del id, así alcanza también a los que dibujó otro worker o un
+      arranque anterior, y avisa por el bus: el otro worker vuelve a barrer
+      por si terminaba de dibujar el QR viejo en ese momento.
+    """
+
+    def __init__(self, directory: str = QR_DIR, workers: int = QR_RENDER_WORKERS):
+        self.directory = directory
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inflight = {}         # nombre de archivo → Future
+        self.hits = 0
+        self.renders = 0
+        self.evictions = 0
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr-render")
+        return self._pool
+
+    def _submit(self, payload: str, fmt: str, student_id: Optional[str]) -> tuple:
+        """(nombre, Future o None si ya estaba en disco)."""
+        if fmt not in FORMATS:
+            raise ValueError(f"formato no soportado: {fmt}")
+        nombre = qr_filename(payload, fmt, student_id)
+        path = os.path.join(self.directory, nombre)
+        with self._lock:
+            fut = self._inflight.get(nombre)
+            if fut is not None:
+                return nombre, fut
+            if os.path.exists(path):
+                self.hits += 1
+                os.utime(path)      # en uso: que prune() no lo borre
+                return nombre, None
+            fut = self._executor().submit(_render_file, payload, fmt, path)
+            self._inflight[nombre] = fut
+            self.renders += 1
+        fut.add_done_callback(lambda _f: self._done(nombre))
+        return nombre, fut
+
+    def _done(self, nombre: str):
+        with self._lock:
+            self._inflight.pop(nombre, None)
+
+    async def url_for(self, payload: str, fmt: str = "png", student_id: Optional[str] = None) -> str:
+        """URL local (/qrs/...) del QR, dibujándolo si hace falta. Para rutas async."""
+        nombre, fut = self._submit(payload, fmt, student_id)
+        if fut is not None:
+            await asyncio.wrap_future(fut)
+        return f"/qrs/{nombre}"
+
+    def url_for_sync(self, payload: str, fmt: str = "png", student_id: Optional[str] = None) -> str:
+        """Igual que url_for(), para rutas síncronas (corren en el threadpool)."""
+        nombre, fut = self._submit(payload, fmt, student_id)
+        if fut is not None:
+            fut.result()
+        return f"/qrs/{nombre}"
+
+    # ── DESALOJO ─────────────────────────────────────────
+    def evict_student(self, student_id: str):
+        patron = os.path.join(glob.escape(self.directory), f"{glob.escape(student_id)}-*")
+        for path in glob.glob(patron):
+            if path.endswith(".tmp"):
+                continue            # render en curso: lo publica su rename
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+        invalidation_bus.publish("qr_evict", student_id)
+
+    def prune(self, max_age_days: int = QR_MAX_AGE_DAYS):
+        """Borra QR no usados en `max_age_days` (huérfanos de reinicios anteriores)."""
+        limite = time.time() - max_age_days * 86400
+        try:
+            entradas = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for e in entradas:
+            if e.name.endswith(FORMATS) and e.stat().st_mtime < limite:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "hits":      self.hits,
+            "renders":   self.renders,
+            "inflight":  len(self._inflight),
+            "evictions": self.evictions,
+        }
+
+
+qr_cache = QrCache()
+invalidation_bus.subscribe("qr_evict", qr_cache.evict_student)
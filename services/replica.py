@@ -0,0 +1,504 @@
+# services/replica.py — Réplica local en SQLite de las tablas que más se leen
+import os
+import time
+import asyncio
+import sqlite3
+import pathlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List
+
+from database import db_execute, db_fetch_all
+from services.metrics import metrics
+from services.scan_dedup import parse_ts
+
+# READ_REPLICA=1 → las lecturas calientes salen de data/replica.sqlite3 en vez de Supabase
+READ_REPLICA = os.getenv("READ_REPLICA", "0") == "1"
+REPLICA_PATH = os.getenv("REPLICA_PATH", "data/replica.sqlite3")
+REPLICA_SYNC_SECONDS = float(os.getenv("REPLICA_SYNC_SECONDS", "15"))
+# Relectura completa periódica: trae las bajas y lo que no tiene updated_at
+REPLICA_FULL_SECONDS = float(os.getenv("REPLICA_FULL_SECONDS", "600"))
+# Con más atraso que esto la réplica no se usa y se lee de Supabase
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "120"))
+REPLICA_ATTENDANCE_DAYS = int(os.getenv("REPLICA_ATTENDANCE_DAYS", "3"))
+
+# Margen de los pulls incrementales: filas con created_at/updated_at apenas
+# anterior a la marca que se confirmaron tarde
+OVERLAP = timedelta(seconds=60)
+
+
+class TableSpec:
+    def __init__(self, name: str, columns: tuple, bools: tuple = (), mutable: bool = True,
+                 window_days: Optional[int] = None):
+        self.name = name
+        self.columns = columns
+        self.bools = bools
+        # mutable: filas que se editan (pull por updated_at si existe, si no relectura completa)
+        # no mutable: solo altas (pull por inserted_at si existe, si no por created_at);
+        # las bajas llegan con la relectura completa
+        self.mutable = mutable
+        self.window_days = window_days
+
+
+TABLES = {t.name: t for t in (
+    TableSpec("students", ("id", "full_name", "dni", "is_active", "valid_until", "batido_credits",
+                           "horario", "turno", "sede"), bools=("is_active",)),
+    TableSpec("credentials", ("id", "code", "student_id", "is_active"), bools=("is_active",)),
+    TableSpec("entrenadores", ("id", "nombre", "token", "is_active"), bools=("is_active",)),
+    TableSpec("attendance", ("id", "student_id", "created_at"), mutable=False,
+              window_days=REPLICA_ATTENDANCE_DAYS),
+    TableSpec("biometria", ("id", "student_id", "fecha", "talla", "peso", "created_at"), mutable=False),
+)}
+
+
+class LocalReplica:
+    """
+    Copia en SQLite de students, credentials, entrenadores, biometria y los
+    últimos días de attendance.
+
+    - Cada REPLICA_SYNC_SECONDS se piden solo las filas nuevas: por `updated_at`
+      en las tablas editables que lo tengan (ver sql/replica_updated_at.sql)
+      y por `inserted_at` en attendance y biometria (sql/replica_inserted_at.sql).
+      Cada REPLICA_FULL_SECONDS se relee todo (bajas, tablas sin updated_at).
+    - Sin inserted_at, attendance y biometria van por `created_at`, y una fila
+      que llega con created_at anterior a la marca (subida offline, diario
+      vaciado tarde) no entra en el pull: si la escritura propia es así de
+      atrasada, la tabla se relee completa en el siguiente ciclo.
+    - Las escrituras propias entran directo: asistencias y biometría con la
+      fila ya conocida; alumnos, credenciales y entrenadores se marcan sucios
+      (`mark_dirty`) y se vuelven a pedir por id en el siguiente ciclo, que se
+      adelanta. Mientras una tabla tiene filas sucias no se lee de la réplica.
+    - Todas las escrituras (propias y del ciclo, incluida la relectura
+      completa) corren en un único hilo escritor con su conexión; quien
+      escribe solo encola y no espera. Las lecturas usan una conexión de solo
+      lectura por hilo: en modo WAL no esperan al escritor, así que las rutas
+      async pueden consultar la réplica desde el event loop.
+    - `ready(tabla)` es False si la réplica está apagada, nunca sincronizó o
+      tiene más de REPLICA_MAX_LAG de atraso: el llamador usa Supabase.
+    """
+
+    def __init__(self, path: str = REPLICA_PATH, enabled: bool = READ_REPLICA):
+        self.path = path
+        self.enabled = enabled
+        self._lock = threading.Lock()          # la conexión de escritura
+        self._dirty_lock = threading.Lock()    # _dirty
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()        # conexión de lectura del hilo
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._dirty = {name: set() for name in TABLES}
+        self._cursor_column = {}    # tabla editable → "updated_at" o None
+        self._synced_at = {}        # tabla → última sincronización (epoch), copia de _meta
+        self._wake: Optional[asyncio.Event] = None
+        self._loop = None
+        self.pulls = 0
+        self.failures = 0
+
+    # ── ESQUEMA ──────────────────────────────────────────
+    def open(self):
+        if not self.enabled or self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Columnas sin tipo: SQLite guarda cada valor tal cual llegó de PostgREST.
+        # _ts = created_at en epoch para comparar sin depender del formato del texto.
+        conn.execute("CREATE TABLE IF NOT EXISTS _meta (name TEXT PRIMARY KEY, watermark TEXT, "
+                     "synced_at REAL, full_at REAL, cursor TEXT)")
+        try:
+            conn.execute("ALTER TABLE _meta ADD COLUMN cursor TEXT")     # réplicas creadas antes
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("CREATE TABLE IF NOT EXISTS students (id PRIMARY KEY, full_name, dni, is_active, "
+                     "valid_until, batido_credits, horario, turno, sede)")
+        conn.execute("CREATE INDEX IF NOT EXISTS students_dni ON students (dni)")
+        conn.execute("CREATE INDEX IF NOT EXISTS students_nombre ON students (full_name, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS credentials (id PRIMARY KEY, code, student_id, is_active)")
+        conn.execute("CREATE INDEX IF NOT EXISTS credentials_code ON credentials (code)")
+        conn.execute("CREATE TABLE IF NOT EXISTS entrenadores (id PRIMARY KEY, nombre, token, is_active)")
+        conn.execute("CREATE INDEX IF NOT EXISTS entrenadores_token ON entrenadores (token)")
+        # Las asistencias propias llegan sin id: la clave es (alumno, instante)
+        conn.execute("CREATE TABLE IF NOT EXISTS attendance (id, student_id, created_at, _ts REAL, "
+                     "PRIMARY KEY (student_id, _ts))")
+        conn.execute("CREATE INDEX IF NOT EXISTS attendance_ts ON attendance (_ts)")
+        conn.execute("CREATE TABLE IF NOT EXISTS biometria (id PRIMARY KEY, student_id, fecha, talla, peso, "
+                     "created_at, _ts REAL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS biometria_alumno ON biometria (student_id, _ts)")
+        self._synced_at = {r["name"]: r["synced_at"] or 0.0
+                           for r in conn.execute("SELECT name, synced_at FROM _meta")}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replica-write")
+        self._conn = conn
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+        with self._readers_lock:
+            for r in self._readers:
+                r.close()
+            self._readers = []
+        self._local = threading.local()
+
+    def _reader(self) -> sqlite3.Connection:
+        """Conexión de solo lectura de este hilo (WAL: no espera a las escrituras)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    # ── ESCRITURA LOCAL ──────────────────────────────────
+    @staticmethod
+    def _epoch(value) -> Optional[float]:
+        try:
+            return parse_ts(value).timestamp()
+        except (ValueError, TypeError):
+            return None
+
+    def _values(self, spec: TableSpec, row: dict) -> tuple:
+        vals = tuple(row.get(c) for c in spec.columns)
+        if "created_at" in spec.columns:
+            vals += (self._epoch(row.get("created_at")),)
+        return vals
+
+    def _upsert(self, table: str, rows: list):
+        """INSERT OR REPLACE; llamar dentro de _write (hilo escritor)."""
+        if not rows:
+            return
+        spec = TABLES[table]
+        cols = spec.columns + (("_ts",) if "created_at" in spec.columns else ())
+        sql = f"INSERT OR REPLACE INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})"
+        if table == "attendance":
+            # Un pull trae con id una fila que ya estaba sin id (escritura propia): se completa
+            sql = ("INSERT INTO attendance (id, student_id, created_at, _ts) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT (student_id, _ts) DO UPDATE SET id = COALESCE(excluded.id, id)")
+        self._conn.executemany(sql, [self._values(spec, r) for r in rows])
+
+    def _write(self, fn):
+        """Corre en el hilo escritor: `fn()` dentro de una transacción."""
+        if self._conn is None:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                fn()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _submit(self, fn, log: bool = True) -> Optional[Future]:
+        """Encola `fn` en el hilo escritor sin esperar (None si la réplica está cerrada).
+        log=False: el error lo maneja quien espera el Future."""
+        if self._conn is None:
+            return None
+        try:
+            fut = self._writer.submit(self._write, fn)
+        except RuntimeError:            # apagando
+            return None
+        if log:
+            fut.add_done_callback(self._log_error)
+        return fut
+
+    def _log_error(self, fut: Future):
+        if not fut.cancelled() and fut.exception() is not None:
+            self.failures += 1
+            print(f"[replica] Error escribiendo: {fut.exception()}")
+
+    def _wakeup(self):
+        if self._wake is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _check_late(self, table: str, rows: list):
+        """Escritura propia con created_at anterior a la marca del pull (menos OVERLAP):
+        si el pull va por created_at, las de otros workers/instancias en ese rango
+        no llegarían nunca, así que se adelanta la relectura completa. Hilo escritor."""
+        if self._cursor_column.get(table) != "created_at":
+            return
+        r = self._conn.execute("SELECT watermark FROM _meta WHERE name = ?", (table,)).fetchone()
+        if r is None or r["watermark"] is None:
+            return
+        limite = (parse_ts(r["watermark"]) - OVERLAP).timestamp()
+        if any((self._epoch(f.get("created_at")) or limite) < limite for f in rows):
+            self._conn.execute("UPDATE _meta SET full_at = 0 WHERE name = ?", (table,))
+            self._wakeup()
+
+    def record_attendance(self, rows: list):
+        """Asistencias recién insertadas (vía services.events)."""
+        def aplicar():
+            self._upsert("attendance", [r for r in rows if self._epoch(r.get("created_at"))])
+            self._check_late("attendance", rows)
+        self._submit(aplicar)
+
+    def record_biometria(self, row: dict):
+        def aplicar():
+            self._upsert("biometria", [row])
+            self._check_late("biometria", [row])
+        self._submit(aplicar)
+
+    def delete_biometria(self, rows: list):
+        self._submit(lambda: self._conn.executemany("DELETE FROM biometria WHERE id = ?",
+                                                    [(r.get("id"),) for r in rows]))
+
+    def mark_dirty(self, table: str, row_id: Optional[str] = None):
+        """La fila cambió en Supabase: se vuelve a pedir (None = toda la tabla)."""
+        if self._conn is None:
+            return
+        if row_id is None:
+            # Relectura completa en el próximo ciclo; hasta entonces no se lee de la réplica
+            self._synced_at[table] = 0.0
+            self._submit(lambda: self._conn.execute(
+                "UPDATE _meta SET full_at = 0, synced_at = 0 WHERE name = ?", (table,)))
+        else:
+            with self._dirty_lock:
+                self._dirty[table].add(row_id)
+        self._wakeup()
+
+    # ── SINCRONIZACIÓN ───────────────────────────────────
+    def _meta(self, table: str, with_cursor: bool = False) -> tuple:
+        r = self._reader().execute("SELECT watermark, synced_at, full_at, cursor FROM _meta WHERE name = ?",
+                                   (table,)).fetchone()
+        meta = (r["watermark"], r["synced_at"] or 0.0, r["full_at"] or 0.0) if r else (None, 0.0, 0.0)
+        return meta + ((r["cursor"] if r else None),) if with_cursor else meta
+
+    def _set_meta(self, table: str, watermark: Optional[str], full: bool, cursor: Optional[str]):
+        ahora = time.time()
+        self._conn.execute(
+            "INSERT INTO _meta (name, watermark, synced_at, full_at, cursor) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET watermark = excluded.watermark, synced_at = excluded.synced_at, "
+            "cursor = excluded.cursor, "
+            "full_at = CASE WHEN ? THEN excluded.full_at ELSE _meta.full_at END",
+            (table, watermark, ahora, ahora if full else 0.0, cursor, full))
+        self._synced_at[table] = ahora
+
+    @staticmethod
+    def _max_mark(rows: list, column: str, actual: Optional[str]) -> Optional[str]:
+        marcas = [parse_ts(r[column]) for r in rows if r.get(column)]
+        if actual:
+            marcas.append(parse_ts(actual))
+        return max(marcas).isoformat() if marcas else actual
+
+    async def _probe_cursor(self, spec: TableSpec) -> Optional[str]:
+        """Columna del pull incremental: 'updated_at' (editables) o 'inserted_at' (solo altas)
+        si la tabla la tiene con valores; si no None en las editables y 'created_at' en las otras."""
+        if spec.name not in self._cursor_column:
+            columna = "updated_at" if spec.mutable else "inserted_at"
+            try:
+                res = await db_execute(lambda db: db.table(spec.name).select(f"id, {columna}").limit(1))
+                tiene = bool(res.data) and res.data[0].get(columna) is not None
+            except Exception:
+                tiene = False
+            self._cursor_column[spec.name] = columna if tiene else (None if spec.mutable else "created_at")
+        return self._cursor_column[spec.name]
+
+    def _window_start(self, spec: TableSpec) -> Optional[str]:
+        if spec.window_days is None:
+            return None
+        return (datetime.now(timezone.utc) - timedelta(days=spec.window_days)).isoformat()
+
+    async def _wait_write(self, fn):
+        """Como _submit(), pero el ciclo de sincronización espera (sin bloquear el loop) a que termine."""
+        fut = self._submit(fn, log=False)
+        if fut is not None:
+            await asyncio.wrap_future(fut)
+
+    async def _sync_table(self, spec: TableSpec):
+        watermark, _, full_at, cursor_previo = self._meta(spec.name, with_cursor=True)
+        select = ", ".join(spec.columns)
+        cursor = await self._probe_cursor(spec)
+        # Una marca tomada con otra columna (p. ej. recién se agregó inserted_at) no sirve
+        completa = (cursor is None or watermark is None or cursor != cursor_previo
+                    or time.time() - full_at > REPLICA_FULL_SECONDS)
+        cols = select if cursor is None or cursor in spec.columns else f"{select}, {cursor}"
+
+        if completa:
+            desde = self._window_start(spec)
+            if desde is not None:
+                rows = await db_fetch_all(lambda db: db.table(spec.name).select(cols)
+                                          .gte("created_at", desde).order("id"))
+            else:
+                rows = await db_fetch_all(lambda db: db.table(spec.name).select(cols).order("id"))
+            marca = self._max_mark(rows, cursor, None) if cursor else None
+
+            def reemplazar():
+                self._conn.execute(f"DELETE FROM {spec.name}")
+                self._upsert(spec.name, rows)
+                self._set_meta(spec.name, marca, full=True, cursor=cursor)
+            await self._wait_write(reemplazar)
+        else:
+            desde = (parse_ts(watermark) - OVERLAP).isoformat()
+            rows = await db_fetch_all(lambda db: db.table(spec.name).select(cols)
+                                      .gte(cursor, desde).order(cursor).order("id"))
+            marca = self._max_mark(rows, cursor, watermark)
+            limite = self._window_start(spec)
+
+            def agregar():
+                self._upsert(spec.name, rows)
+                if limite is not None:
+                    self._conn.execute(f"DELETE FROM {spec.name} WHERE _ts < ?", (parse_ts(limite).timestamp(),))
+                self._set_meta(spec.name, marca, full=False, cursor=cursor)
+            await self._wait_write(agregar)
+        self.pulls += 1
+
+    async def _sync_dirty(self, spec: TableSpec):
+        with self._dirty_lock:
+            ids, self._dirty[spec.name] = self._dirty[spec.name], set()
+        if not ids:
+            return
+        try:
+            res = await db_execute(lambda db: db.table(spec.name).select(", ".join(spec.columns))
+                                   .in_("id", list(ids)))
+        except Exception:
+            with self._dirty_lock:
+                self._dirty[spec.name] |= ids
+            raise
+        rows = res.data or []
+        faltan = ids - {r["id"] for r in rows}
+
+        def aplicar():
+            self._upsert(spec.name, rows)
+            self._conn.executemany(f"DELETE FROM {spec.name} WHERE id = ?", [(i,) for i in faltan])
+        await self._wait_write(aplicar)
+
+    async def sync_once(self):
+        for spec in TABLES.values():
+            if spec.mutable:
+                await self._sync_dirty(spec)
+            if time.time() - self._synced_at.get(spec.name, 0.0) >= REPLICA_SYNC_SECONDS:
+                await self._sync_table(spec)
+
+    async def run(self):
+        """Tarea de fondo (ver main.py): sincroniza cada REPLICA_SYNC_SECONDS o al marcar sucio."""
+        if self._conn is None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as e:
+                self.failures += 1
+                print(f"[replica] Error sincronizando: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=REPLICA_SYNC_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    # ── LECTURA ──────────────────────────────────────────
+    def lag_seconds(self, table: str) -> Optional[float]:
+        if self._conn is None:
+            return None
+        synced_at = self._synced_at.get(table)
+        return time.time() - synced_at if synced_at else None
+
+    def ready(self, *tables: str) -> bool:
+        """¿Se puede leer de la réplica? (sincronizada hace poco y sin filas propias pendientes)"""
+        if self._conn is None:
+            return False
+        for t in tables:
+            lag = self.lag_seconds(t)
+            if lag is None or lag > REPLICA_MAX_LAG or self._dirty[t]:
+                return False
+        return True
+
+    def _rows(self, table: str, sql: str, params: tuple = ()) -> List[dict]:
+        bools = TABLES[table].bools
+        cur = self._reader().execute(sql, params)
+        nombres = [d[0] for d in cur.description]
+        filas = cur.fetchall()
+        out = []
+        for f in filas:
+            d = dict(zip(nombres, f))
+            d.pop("_ts", None)
+            for b in bools:
+                if d.get(b) is not None:
+                    d[b] = bool(d[b])
+            out.append(d)
+        return out
+
+    def attendance_since(self, since: str) -> List[dict]:
+        """[{student_id, created_at}] desde `since` (ISO), en el orden del índice."""
+        return self._rows("attendance", "SELECT student_id, created_at FROM attendance WHERE _ts >= ?",
+                          (parse_ts(since).timestamp(),))
+
+    def student_by(self, column: str, value: str, active_only: bool = True) -> Optional[dict]:
+        assert column in ("id", "dni")
+        filas = self._rows("students", f"SELECT * FROM students WHERE {column} = ?"
+                           + (" AND is_active" if active_only else "") + " LIMIT 1", (value,))
+        return filas[0] if filas else None
+
+    def students_page(self, columns: list, active_only: bool, after: Optional[tuple],
+                      limit: Optional[int]) -> List[dict]:
+        """
+        Alumnos en orden (full_name, id) con NULLs al final; `after` = (full_name, id)
+        del cursor. columns ⊆ TABLES['students']. full_name se compara con BINARY,
+        no con la collation de Postgres: los cursores de acá no sirven en PostgREST
+        (services/student_listing.py los marca).
+        """
+        where, params = [], []
+        if active_only:
+            where.append("is_active")
+        if after is not None:
+            nombre, sid = after
+            if nombre is None:
+                where.append("full_name IS NULL AND id > ?")
+                params.append(sid)
+            else:
+                where.append("(full_name > ? OR (full_name = ? AND id > ?) OR full_name IS NULL)")
+                params += [nombre, nombre, sid]
+        sql = (f"SELECT {', '.join(columns)} FROM students"
+               + (f" WHERE {' AND '.join(where)}" if where else "")
+               + " ORDER BY full_name IS NULL, full_name, id"
+               + (" LIMIT ?" if limit is not None else ""))
+        if limit is not None:
+            params.append(limit)
+        return self._rows("students", sql, tuple(params))
+
+    def biometria_for(self, student_id: str, limit: int) -> List[dict]:
+        return self._rows("biometria", "SELECT fecha, talla, peso FROM biometria WHERE student_id = ? "
+                          "ORDER BY _ts DESC LIMIT ?", (student_id, limit))
+
+    def trainer_by_token(self, token: str) -> Optional[dict]:
+        filas = self._rows("entrenadores", "SELECT id, nombre, is_active FROM entrenadores WHERE token = ?",
+                           (token,))
+        return filas[0] if filas else None
+
+    def credential_by_code(self, code: str) -> Optional[dict]:
+        filas = self._rows("credentials", "SELECT id, student_id FROM credentials "
+                           "WHERE code = ? AND is_active", (code,))
+        return filas[0] if filas else None
+
+    def stats(self) -> dict:
+        if self._conn is None:
+            return {"enabled": False}
+        return {
+            "enabled":  True,
+            "pulls":    self.pulls,
+            "failures": self.failures,
+            "lag_seconds": {t: round(self.lag_seconds(t) or -1, 1) for t in TABLES},
+            "dirty":    {t: len(ids) for t, ids in self._dirty.items() if ids},
+        }
+
+
+replica = LocalReplica()
+
+
+def _lag_gauge() -> dict:
+    lags = {t: replica.lag_seconds(t) for t in TABLES}
+    return {(("table", t),): lag for t, lag in lags.items() if lag is not None}
+
+
+metrics.register_gauge("emblema_replica_lag_seconds", "Segundos desde la última sincronización de cada tabla",
+                       _lag_gauge)
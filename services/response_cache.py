@@ -0,0 +1,177 @@
+# services/response_cache.py — Caché TTL/LRU de respuestas públicas con single-flight
+import os
+import time
+import threading
+import functools
+from collections import OrderedDict
+from typing import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+from services.metrics import metrics
+from services.invalidation_bus import invalidation_bus
+
+PUBLIC_CACHE_TTL = int(os.getenv("PUBLIC_CACHE_TTL", "30"))
+PUBLIC_CACHE_MAXSIZE = int(os.getenv("PUBLIC_CACHE_MAXSIZE", "1024"))
+
+
+class _Flight:
+    """Un cálculo en curso: los demás pedidos de la misma clave esperan su resultado."""
+    __slots__ = ("done", "entry", "error", "stale")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+        self.stale = False          # invalidado por clave mientras calculaba
+
+
+class ResponseCache:
+    """
+    (ruta, parámetros) → cuerpo JSON ya serializado, con TTL y desalojo LRU.
+
+    - Single-flight: si llegan N pedidos iguales sin entrada vigente, solo el
+      primero calcula; el resto espera ese mismo resultado (o su excepción,
+      p. ej. el 404). Los errores no se guardan.
+    - `invalidate(ruta, ...)` descarta las entradas de esas rutas. Un cálculo
+      que empezó antes de la invalidación entrega su resultado a quienes ya
+      lo esperaban, pero no se guarda ni lo reciben los pedidos nuevos.
+    - `invalidate_keys(ruta, param, valores)` hace lo mismo solo con las
+      claves de esa ruta cuyo parámetro está en `valores` (p. ej. la ficha
+      de los alumnos que acaban de marcar asistencia).
+    - Pensado para rutas síncronas (corren en el threadpool, donde esperar
+      un Event no bloquea el event loop).
+    """
+
+    def __init__(self, ttl: int = PUBLIC_CACHE_TTL, maxsize: int = PUBLIC_CACHE_MAXSIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # clave → (vence monotonic, cuerpo bytes)
+        self._inflight = {}             # clave → _Flight
+        self._generations = {}          # ruta → contador de invalidaciones
+        self._epoch = 0                 # invalidaciones totales
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key: tuple, compute: Callable[[], bytes]) -> tuple:
+        """(vence, cuerpo) de la clave; `compute()` corre a lo sumo una vez a la vez por clave."""
+        ruta = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.collapsed += 1
+                lider = False
+            else:
+                flight = self._inflight[key] = _Flight()
+                generation = (self._epoch, self._generations.get(ruta, 0))
+                self.misses += 1
+                lider = True
+
+        if not lider:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        try:
+            flight.entry = (time.monotonic() + self.ttl, compute())
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                if flight.error is None and not flight.stale and (self._epoch, self._generations.get(ruta, 0)) == generation:
+                    self._entries[key] = flight.entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+            flight.done.set()
+        return flight.entry
+
+    def invalidate(self, *routes: str, broadcast: bool = True):
+        """Descarta las entradas de `routes` (todas si no se pasa ninguna).
+        broadcast=False: solo este worker (el llamador ya avisa a los demás por otro tópico)."""
+        with self._lock:
+            todas = not routes
+            for key in [k for k in self._entries if todas or k[0] in routes]:
+                del self._entries[key]
+            # Los pedidos que lleguen desde ahora no se suman a cálculos viejos
+            for key in [k for k in self._inflight if todas or k[0] in routes]:
+                del self._inflight[key]
+            # ...y los cálculos en curso de esas rutas no se guardan al terminar
+            if todas:
+                self._epoch += 1
+            for ruta in routes:
+                self._generations[ruta] = self._generations.get(ruta, 0) + 1
+            self.invalidations += 1
+        if broadcast:
+            invalidation_bus.publish("public_cache", list(routes))
+
+    def invalidate_keys(self, route: str, param: str, values, broadcast: bool = True):
+        """Descarta solo las entradas de `route` cuyo parámetro `param` está en `values`."""
+        values = {str(v) for v in values if v is not None}
+        if not values:
+            return
+
+        def coincide(key) -> bool:
+            return key[0] == route and str(dict(key[1]).get(param)) in values
+
+        with self._lock:
+            for key in [k for k in self._entries if coincide(k)]:
+                del self._entries[key]
+            for key in [k for k in self._inflight if coincide(k)]:
+                self._inflight.pop(key).stale = True
+            self.invalidations += 1
+        if broadcast:
+            invalidation_bus.publish("public_cache_keys", [route, param, sorted(values)])
+
+    def cached(self, route: str, private: bool = False):
+        """
+        Decorador para una ruta síncrona que devuelve JSON. La clave es la ruta
+        más los parámetros con que FastAPI llama al handler (path y query).
+
+        private=True (datos de un alumno): el navegador y los proxies no la
+        reutilizan sin volver a pedirla, porque la invalidación al escribir
+        solo alcanza a esta caché.
+        """
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(**params):
+                key = (route, tuple(sorted(params.items())))
+                vence, body = self.get_or_compute(
+                    key, lambda: JSONResponse(jsonable_encoder(fn(**params))).body)
+                if private:
+                    control = "private, no-cache"
+                else:
+                    control = f"public, max-age={max(0, int(vence - time.monotonic()))}"
+                return Response(body, media_type="application/json", headers={"Cache-Control": control})
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        return {
+            "size":          len(self._entries),
+            "hits":          self.hits,
+            "misses":        self.misses,
+            "collapsed":     self.collapsed,
+            "invalidations": self.invalidations,
+        }
+
+
+public_cache = ResponseCache()
+invalidation_bus.subscribe("public_cache", lambda routes: public_cache.invalidate(*routes))
+invalidation_bus.subscribe("public_cache_keys", lambda p: public_cache.invalidate_keys(*p))
+
+metrics.register_gauge("emblema_public_cache", "Caché de respuestas públicas (hits, misses, colapsados)",
+                       lambda: {(("stat", k),): v for k, v in public_cache.stats().items()})
@@ -0,0 +1,154 @@
+# services/scan_dedup.py — Índice en memoria de scans recientes (dedup de 12 horas)
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import db_fetch_all
+from services.invalidation_bus import invalidation_bus
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+VENTANA = timedelta(hours=12)
+# Historia que se conserva en memoria (suficiente para los ±12h de sync-batch)
+RETENCION = timedelta(hours=36)
+
+
+def parse_ts(value) -> datetime:
+    """ISO8601 → datetime con zona (los timestamps sin zona se asumen UTC)."""
+    ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+class RecentScans:
+    """
+    Timestamps de asistencia por alumno desde `covered_from`.
+
+    Mientras una ventana de consulta empiece en o después de `covered_from`,
+    el índice tiene TODAS las asistencias de esa ventana y puede responder
+    "Ya registrado" sin ir a la BD. Si no (índice frío o ventana más antigua),
+    los métodos devuelven None y el llamador consulta `attendance` como antes.
+
+    - `warm()` lo llena al arrancar con la asistencia del día (y las últimas 12h).
+    - `claim()` comprueba y reserva el scan en una sola operación atómica,
+      así dos scans simultáneos del mismo alumno no pasan ambos.
+    - `record()` se llama tras cada INSERT (vía services.events).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._times = {}            # student_id → lista ordenada de datetimes
+        self.covered_from: Optional[datetime] = None
+        self._records = 0
+
+    # ── CARGA ────────────────────────────────────────────
+    async def warm(self):
+        ahora = datetime.now(timezone.utc)
+        inicio_dia = datetime.now(PERU_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+        desde = min(inicio_dia.astimezone(timezone.utc), ahora - VENTANA)
+        rows = await db_fetch_all(lambda db: db.table("attendance").select("student_id, created_at")
+                                  .gte("created_at", desde.isoformat()).order("id"))
+        times = {}
+        for r in rows:
+            try:
+                times.setdefault(r["student_id"], []).append(parse_ts(r["created_at"]))
+            except (ValueError, TypeError):
+                continue
+        for lista in times.values():
+            lista.sort()
+        with self._lock:
+            # Lo registrado durante la carga también cuenta
+            for sid, lista in self._times.items():
+                for ts in lista:
+                    self._add(times.setdefault(sid, []), ts)
+            self._times = times
+            self.covered_from = desde
+
+    # ── CONSULTA ─────────────────────────────────────────
+    def _authoritative(self, desde: datetime) -> bool:
+        return self.covered_from is not None and desde >= self.covered_from
+
+    def _any_between(self, sid: str, lo: datetime, hi: Optional[datetime]) -> bool:
+        lista = self._times.get(sid) or []
+        i = bisect_left(lista, lo)
+        return i < len(lista) and (hi is None or lista[i] <= hi)
+
+    def times_since(self, sid: str, lo: datetime) -> Optional[list]:
+        """Copia de los timestamps del alumno desde `lo`, o None si el índice no lo cubre."""
+        with self._lock:
+            if not self._authoritative(lo):
+                return None
+            lista = self._times.get(sid) or []
+            return lista[bisect_left(lista, lo):]
+
+    def claim(self, sid: str, ts: datetime) -> Optional[bool]:
+        """
+        Regla del scan: duplicado si hay asistencia desde ts - 12h.
+        True → no había y queda reservado; False → "Ya registrado"; None → consultar BD.
+        """
+        with self._lock:
+            if not self._authoritative(ts - VENTANA):
+                return None
+            if self._any_between(sid, ts - VENTANA, None):
+                return False
+            self._add(self._times.setdefault(sid, []), ts)
+        # Los demás workers ven la reserva antes del INSERT (o del vaciado del diario)
+        invalidation_bus.publish("scan_claim", {"student_id": sid, "created_at": ts.isoformat()})
+        return True
+
+    def release(self, sid: str, ts: datetime):
+        """Deshace un claim() cuyo INSERT falló."""
+        with self._lock:
+            lista = self._times.get(sid) or []
+            i = bisect_left(lista, ts)
+            if i < len(lista) and lista[i] == ts:
+                lista.pop(i)
+        invalidation_bus.publish("scan_release", {"student_id": sid, "created_at": ts.isoformat()})
+
+    # ── ACTUALIZACIÓN ────────────────────────────────────
+    @staticmethod
+    def _add(lista: list, ts: datetime):
+        i = bisect_left(lista, ts)
+        if i < len(lista) and lista[i] == ts:
+            return
+        insort(lista, ts)
+
+    def _prune(self):
+        limite = datetime.now(timezone.utc) - RETENCION
+        if self.covered_from is None or self.covered_from >= limite:
+            return
+        for sid in list(self._times):
+            lista = self._times[sid]
+            del lista[:bisect_left(lista, limite)]
+            if not lista:
+                del self._times[sid]
+        self.covered_from = limite
+
+    def record(self, rows: list):
+        """rows: asistencias recién insertadas ({student_id, created_at})."""
+        with self._lock:
+            for r in rows:
+                try:
+                    ts = parse_ts(r["created_at"])
+                except (KeyError, ValueError, TypeError):
+                    continue
+                self._add(self._times.setdefault(r["student_id"], []), ts)
+            self._records += len(rows)
+            if self._records % 500 < len(rows):
+                self._prune()
+
+    def stats(self) -> dict:
+        return {
+            "students":     len(self._times),
+            "covered_from": self.covered_from.isoformat() if self.covered_from else None,
+        }
+
+
+recent_scans = RecentScans()
+invalidation_bus.subscribe("scan_claim", lambda p: recent_scans.record([p]))
+invalidation_bus.subscribe("scan_release", lambda p: recent_scans.release(p["student_id"], parse_ts(p["created_at"])))
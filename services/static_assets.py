@@ -0,0 +1,183 @@
+# services/static_assets.py — frontend/ en memoria, precomprimido (gzip/zstd) y con URLs versionadas
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+import threading
+from typing import Optional
+
+import zstandard
+from fastapi import Request
+from fastapi.responses import Response
+
+STATIC_ROOT = "frontend"
+STATIC_PREFIX = "/static/"
+# STATIC_DEV=1 → relee un archivo del disco si cambió (para editar el frontend sin reiniciar)
+STATIC_DEV = os.getenv("STATIC_DEV", "0") == "1"
+
+_COMPRESSIBLE = {".html", ".js", ".css", ".svg", ".json", ".txt", ".ico"}
+_MIN_COMPRESS = 512
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# /static/admin/admin.js en los HTML → /static/admin/admin.<hash>.js
+_STATIC_REF = re.compile(r'(?P<attr>href|src)="/static/(?P<path>[^"?#]+)"')
+# admin.0123456789.js → admin.js
+_FINGERPRINT = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{10})(?P<ext>\.[^./]+)$")
+
+
+class Asset:
+    __slots__ = ("path", "media_type", "etag", "fingerprint", "mtime", "bodies")
+
+    def __init__(self, path: str, data: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha256(data).hexdigest()
+        self.etag = digest[:32]
+        self.fingerprint = digest[:10]
+        self.bodies = {"identity": data}
+        if os.path.splitext(path)[1] in _COMPRESSIBLE and len(data) >= _MIN_COMPRESS:
+            gz = gzip.compress(data, compresslevel=9, mtime=0)
+            zst = zstandard.ZstdCompressor(level=19).compress(data)
+            if len(gz) < len(data):
+                self.bodies["gzip"] = gz
+            if len(zst) < len(data):
+                self.bodies["zstd"] = zst
+
+    def versioned_url(self) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{STATIC_PREFIX}{stem}.{self.fingerprint}{ext}"
+
+
+class StaticAssets:
+    """
+    Todo `frontend/` se lee y comprime una vez al arrancar (`load()`).
+
+    - Cada archivo tiene gzip y zstd precalculados; se elige según Accept-Encoding.
+    - ETag fuerte (hash del contenido) por representación; If-None-Match → 304.
+    - En los HTML, las referencias /static/x.js se reescriben a /static/x.<hash>.js:
+      esas URLs cambian con el contenido y se sirven con Cache-Control immutable.
+      Las páginas y las URLs sin hash se revalidan siempre (no-cache + ETag).
+    """
+
+    def __init__(self, root: str = STATIC_ROOT):
+        self.root = root
+        self._lock = threading.Lock()
+        self._assets = {}           # ruta relativa → Asset
+
+    # ── CARGA ────────────────────────────────────────────
+    def _read(self, rel: str) -> Optional[Asset]:
+        full = os.path.join(self.root, rel)
+        try:
+            mtime = os.path.getmtime(full)
+            with open(full, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return Asset(rel, data, mtime)
+
+    def _rewrite_html(self, asset: Asset) -> Asset:
+        texto = asset.bodies["identity"].decode("utf-8")
+
+        def versionar(m):
+            ref = self._assets.get(m.group("path"))
+            url = ref.versioned_url() if ref else f"{STATIC_PREFIX}{m.group('path')}"
+            return f'{m.group("attr")}="{url}"'
+
+        return Asset(asset.path, _STATIC_REF.sub(versionar, texto).encode("utf-8"), asset.mtime)
+
+    def load(self):
+        assets = {}
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                asset = self._read(rel)
+                if asset is not None:
+                    assets[rel] = asset
+        with self._lock:
+            self._assets = assets
+            # Los HTML al final: necesitan el hash de lo que referencian
+            for rel, asset in assets.items():
+                if rel.endswith(".html"):
+                    assets[rel] = self._rewrite_html(asset)
+
+    def _get(self, rel: str) -> Optional[Asset]:
+        with self._lock:
+            asset = self._assets.get(rel)
+        if asset is None or STATIC_DEV:
+            try:
+                changed = asset is None or os.path.getmtime(os.path.join(self.root, rel)) != asset.mtime
+            except OSError:
+                return asset
+            if changed:
+                fresh = self._read(rel)
+                if fresh is None:
+                    return None
+                with self._lock:
+                    if rel.endswith(".html"):
+                        fresh = self._rewrite_html(fresh)
+                    self._assets[rel] = fresh
+                asset = fresh
+        return asset
+
+    # ── RESPUESTAS ───────────────────────────────────────
+    @staticmethod
+    def _encoding(request: Request, asset: Asset) -> str:
+        aceptadas = {p.split(";")[0].strip() for p in request.headers.get("accept-encoding", "").split(",")}
+        for enc in ("zstd", "gzip"):
+            if enc in aceptadas and enc in asset.bodies:
+                return enc
+        return "identity"
+
+    def _respond(self, request: Request, asset: Asset, cache_control: str) -> Response:
+        enc = self._encoding(request, asset)
+        etag = f'"{asset.etag}"' if enc == "identity" else f'"{asset.etag}-{enc}"'
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+        enviados = request.headers.get("if-none-match", "")
+        if enviados and (enviados.strip() == "*" or f'"{asset.etag}' in enviados):
+            return Response(status_code=304, headers=headers)
+
+        if enc != "identity":
+            headers["Content-Encoding"] = enc
+        return Response(asset.bodies[enc], media_type=asset.media_type, headers=headers)
+
+    def page(self, rel: str, request: Request) -> Response:
+        """Página HTML (rutas /, /admin, ...): siempre se revalida."""
+        asset = self._get(rel)
+        if asset is None:
+            return Response(status_code=404)
+        return self._respond(request, asset, REVALIDATE)
+
+    def serve(self, path: str, request: Request) -> Response:
+        """/static/{path}: con hash en el nombre → immutable; sin hash → revalidar."""
+        if ".." in path.split("/") or path.startswith("/"):
+            return Response(status_code=404)
+        m = _FINGERPRINT.match(path)
+        if m:
+            asset = self._get(m.group("stem") + m.group("ext"))
+            if asset is not None and asset.fingerprint == m.group("hash"):
+                return self._respond(request, asset, IMMUTABLE)
+            # Hash viejo (HTML cacheado de un deploy anterior): servir lo actual sin fijarlo
+            if asset is not None:
+                return self._respond(request, asset, REVALIDATE)
+        asset = self._get(path)
+        if asset is None:
+            return Response(status_code=404)
+        return self._respond(request, asset, REVALIDATE)
+
+    def stats(self) -> dict:
+        with self._lock:
+            assets = list(self._assets.values())
+        return {
+            "files":          len(assets),
+            "bytes":          sum(len(a.bodies["identity"]) for a in assets),
+            "bytes_gzip":     sum(len(a.bodies.get("gzip", a.bodies["identity"])) for a in assets),
+            "bytes_zstd":     sum(len(a.bodies.get("zstd", a.bodies["identity"])) for a in assets),
+        }
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,148 @@
+# services/streaks.py — Racha de asistencia precalculada por alumno
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+from database import fetch_all
+
+PERU_TZ = ZoneInfo("America/Lima")
+
+# Gap permitido: ≤ 4 días (cubre fines de semana + horario LMV/MJS)
+GAP_MAX = 4
+# Solo cuentan las sesiones de los últimos 90 días
+WINDOW_DAYS = 90
+
+
+def _lima_day(created_at):
+    ts = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(PERU_TZ).date()
+
+
+def _chain(days: Iterable) -> deque:
+    """Días (ascendente) de la cadena vigente: desde la sesión más reciente hacia atrás
+    mientras el gap entre dos sesiones sea ≤ GAP_MAX."""
+    ordenados = sorted(set(days), reverse=True)
+    cadena = deque()
+    for dia in ordenados:
+        if cadena and (cadena[0] - dia).days > GAP_MAX:
+            break
+        cadena.appendleft(dia)
+    return cadena
+
+
+class StreakIndex:
+    """
+    Estado de racha por alumno: los días de la cadena vigente dentro de la ventana.
+
+    - `record()` aplica un scan en O(1): mismo día → nada; gap ≤ 4 → se alarga
+      la cadena; gap mayor → la cadena empieza de nuevo.
+    - Un registro más antiguo que la última sesión (sync offline, backfill)
+      no se puede aplicar en orden: el alumno queda marcado para recálculo.
+    - `rebuild_all()` / `recompute()` rehacen el estado desde `attendance`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chains = {}           # student_id → deque de días (ascendente)
+        self._dirty = set()
+        self._loaded = False
+
+    # ── RECÁLCULO COMPLETO ───────────────────────────────
+    def _window_start(self):
+        return datetime.now(PERU_TZ) - timedelta(days=WINDOW_DAYS)
+
+    def _load(self, student_ids=None) -> dict:
+        desde = self._window_start().isoformat()
+
+        def build(db):
+            q = db.table("attendance").select("student_id, created_at").gte("created_at", desde)
+            if student_ids is not None:
+                q = q.in_("student_id", list(student_ids))
+            return q.order("id")
+
+        dias = {}
+        for r in fetch_all(build):
+            try:
+                dias.setdefault(r["student_id"], []).append(_lima_day(r["created_at"]))
+            except (ValueError, TypeError):
+                continue
+        return {sid: _chain(d) for sid, d in dias.items()}
+
+    def rebuild_all(self):
+        """Job completo: recalcula la racha de todos los alumnos (arranque / backfills)."""
+        chains = self._load()
+        with self._lock:
+            self._chains = chains
+            self._dirty.clear()
+            self._loaded = True
+
+    def recompute(self, student_ids):
+        ids = set(student_ids)
+        if not ids:
+            return
+        chains = self._load(ids)
+        with self._lock:
+            for sid in ids:
+                if sid in chains:
+                    self._chains[sid] = chains[sid]
+                else:
+                    self._chains.pop(sid, None)
+            self._dirty.difference_update(ids)
+
+    def recompute_dirty(self):
+        """Job para después de un sync offline: recalcula solo los alumnos marcados."""
+        with self._lock:
+            ids = set(self._dirty)
+        self.recompute(ids)
+
+    # ── ACTUALIZACIÓN O(1) ───────────────────────────────
+    def record(self, rows: list):
+        """rows: asistencias recién insertadas ({student_id, created_at})."""
+        with self._lock:
+            if not self._loaded:
+                return                      # la primera carga ya las incluirá
+            for r in rows:
+                sid = r["student_id"]
+                try:
+                    dia = _lima_day(r["created_at"])
+                except (KeyError, ValueError, TypeError):
+                    continue
+                cadena = self._chains.get(sid)
+                if not cadena:
+                    self._chains[sid] = deque([dia])
+                elif dia == cadena[-1]:
+                    continue
+                elif dia > cadena[-1]:
+                    if (dia - cadena[-1]).days <= GAP_MAX:
+                        cadena.append(dia)
+                    else:
+                        self._chains[sid] = deque([dia])
+                else:
+                    self._dirty.add(sid)
+
+    # ── LECTURA ──────────────────────────────────────────
+    def get(self, student_id: str) -> int:
+        """Racha vigente del alumno (sesiones consecutivas en los últimos 90 días)."""
+        if not self._loaded:
+            self.rebuild_all()
+        if student_id in self._dirty:
+            self.recompute([student_id])
+        limite = self._window_start().date()
+        with self._lock:
+            cadena = self._chains.get(student_id)
+            if not cadena:
+                return 0
+            while cadena and cadena[0] < limite:
+                cadena.popleft()
+            return len(cadena)
+
+
+streak_index = StreakIndex()
@@ -0,0 +1,238 @@
+# services/student_cache.py — Directorio de alumnos en memoria (TTL + invalidación)
+import os
+import time
+import threading
+from typing import Optional, List
+
+from database import fetch_all, db_fetch_all, db_execute, supabase
+from services.metrics import metrics
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
+from services.response_cache import public_cache
+
+# Ficha pública cacheada por id o por DNI (main.py)
+INFO_ROUTE = "/public/student/{dni_or_id}/info"
+
+# Columnas que necesitan los caminos calientes (scan, caja, panel del entrenador)
+STUDENT_FIELDS = "id, full_name, dni, is_active, valid_until, batido_credits, horario, turno, sede"
+
+
+def _all_students(db):
+    return db.table("students").select(STUDENT_FIELDS).order("id")
+
+
+class StudentDirectory:
+    """
+    Copia en memoria de la tabla `students` compartida por scan, caja y entrenador.
+
+    - La tabla completa se recarga cuando vence el TTL (consulta paginada).
+    - `invalidate(id)` marca un alumno como sucio: la siguiente lectura lo
+      vuelve a pedir a Supabase por id, sin recargar el resto.
+    - `invalidate()` sin argumentos fuerza la recarga completa.
+
+    `get`/`active` son para rutas síncronas; `aget`/`aactive` para las async
+    (los fallos consultan vía db_execute sin bloquear el event loop).
+
+    `generation` sube cada vez que el contenido cambia de verdad, para que
+    las vistas derivadas (snapshot offline, índices) sepan cuándo rehacerse.
+
+    Las consultas corren sin el lock. Cada invalidación sube `_version`; al
+    guardar el resultado solo se limpian las marcas anteriores a la consulta:
+    una invalidación que llega mientras tanto deja la fila sucia.
+    """
+
+    def __init__(self, ttl: int = 60):
+        self.ttl = ttl
+        self._rows = {}
+        self._loaded_at = 0.0
+        self._stale = {}            # student_id → _version al marcarlo sucio
+        self._version = 0           # invalidaciones recibidas
+        self._full_version = 0      # _version de la última invalidación completa
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.invalidations = 0
+        self.generation = 0
+
+    # ── ESTADO INTERNO ───────────────────────────────────
+    def _expired(self) -> bool:
+        return time.monotonic() - self._loaded_at > self.ttl
+
+    def _store_all(self, rows: list, version: int):
+        """Guarda una recarga completa consultada cuando `_version` valía `version`."""
+        nuevos = {r["id"]: r for r in rows}
+        if nuevos != self._rows:
+            self.generation += 1
+        self._rows = nuevos
+        self._stale = {sid: v for sid, v in self._stale.items() if v > version}
+        # Una invalidación completa durante la consulta obliga a recargar de nuevo
+        self._loaded_at = time.monotonic() if self._full_version <= version else 0.0
+        self.reloads += 1
+
+    def _store_some(self, ids: list, rows: list, version: int):
+        found = {r["id"]: r for r in rows}
+        for sid in ids:
+            if found.get(sid) == self._rows.get(sid):
+                continue
+            self.generation += 1
+            if sid in found:
+                self._rows[sid] = found[sid]
+            else:
+                self._rows.pop(sid, None)
+        for sid in ids:
+            if self._stale.get(sid, version + 1) <= version:
+                del self._stale[sid]
+
+    def _plan_get(self, student_id: str) -> str:
+        """'hit', 'all' (recargar tabla) u 'one' (pedir solo ese alumno)."""
+        if self._expired():
+            self.misses += 1
+            return "all"
+        if student_id in self._stale or student_id not in self._rows:
+            self.misses += 1
+            return "one"
+        self.hits += 1
+        return "hit"
+
+    def _plan_all(self, allow_expired: bool = False) -> str:
+        """'hit', 'all' o 'stale' (pedir solo los alumnos sucios)."""
+        if self._expired() and not (allow_expired and self._loaded_at):
+            self.misses += 1
+            return "all"
+        if self._stale:
+            self.misses += 1
+            return "stale"
+        self.hits += 1
+        return "hit"
+
+    @staticmethod
+    def _active_sorted(rows: List[dict]) -> List[dict]:
+        activos = [r for r in rows if r.get("is_active")]
+        activos.sort(key=lambda r: r.get("full_name") or "")
+        return activos
+
+    # ── LECTURA (rutas síncronas) ────────────────────────
+    def get(self, student_id: str) -> Optional[dict]:
+        """Devuelve la fila del alumno (o None si no existe)."""
+        with self._lock:
+            plan = self._plan_get(student_id)
+            version = self._version
+        if plan == "all":
+            rows = fetch_all(_all_students)
+            with self._lock:
+                self._store_all(rows, version)
+        elif plan == "one":
+            res = supabase.table("students").select(STUDENT_FIELDS).eq("id", student_id).execute()
+            with self._lock:
+                self._store_some([student_id], res.data or [], version)
+        return self._rows.get(student_id)
+
+    def all(self) -> List[dict]:
+        """Todos los alumnos (activos e inactivos), refrescando lo vencido o sucio."""
+        with self._lock:
+            plan = self._plan_all()
+            ids = list(self._stale)
+            version = self._version
+        if plan == "all":
+            rows = fetch_all(_all_students)
+            with self._lock:
+                self._store_all(rows, version)
+        elif plan == "stale":
+            res = supabase.table("students").select(STUDENT_FIELDS).in_("id", ids).execute()
+            with self._lock:
+                self._store_some(ids, res.data or [], version)
+        with self._lock:
+            return list(self._rows.values())
+
+    def active(self) -> List[dict]:
+        """Alumnos activos ordenados por nombre (equivale a eq('is_active', True).order('full_name'))."""
+        return self._active_sorted(self.all())
+
+    # ── LECTURA (rutas async) ────────────────────────────
+    async def aget(self, student_id: str) -> Optional[dict]:
+        with self._lock:
+            plan = self._plan_get(student_id)
+            version = self._version
+        if plan == "all":
+            rows = await db_fetch_all(_all_students)
+            with self._lock:
+                self._store_all(rows, version)
+        elif plan == "one":
+            res = await db_execute(lambda db: db.table("students").select(STUDENT_FIELDS).eq("id", student_id))
+            with self._lock:
+                self._store_some([student_id], res.data or [], version)
+        return self._rows.get(student_id)
+
+    async def aall(self, allow_expired: bool = False) -> List[dict]:
+        """
+        allow_expired=True no recarga la tabla solo porque venció el TTL (sí lo
+        hace si nunca se cargó o hubo una invalidación completa); los alumnos
+        sucios se piden igual.
+        """
+        with self._lock:
+            plan = self._plan_all(allow_expired)
+            ids = list(self._stale)
+            version = self._version
+        if plan == "all":
+            rows = await db_fetch_all(_all_students)
+            with self._lock:
+                self._store_all(rows, version)
+        elif plan == "stale":
+            res = await db_execute(lambda db: db.table("students").select(STUDENT_FIELDS).in_("id", ids))
+            with self._lock:
+                self._store_some(ids, res.data or [], version)
+        with self._lock:
+            return list(self._rows.values())
+
+    async def aactive(self) -> List[dict]:
+        return self._active_sorted(await self.aall())
+
+    def peek(self, student_id: str) -> Optional[dict]:
+        """La fila en memoria, sin consultar la BD (None si no está cargada)."""
+        return self._rows.get(student_id)
+
+    # ── INVALIDACIÓN ─────────────────────────────────────
+    def invalidate(self, student_id: Optional[str] = None):
+        """Llamar desde cada ruta que escribe en `students`."""
+        with self._lock:
+            self.invalidations += 1
+            self._version += 1
+            if student_id is None:
+                self._loaded_at = 0.0
+                self._full_version = self._version
+            else:
+                self._stale[student_id] = self._version
+            fila = self._rows.get(student_id) if student_id else None
+        replica.mark_dirty("students", student_id)
+        # La ficha pública del alumno (por id y por el DNI que tenía) deja de valer;
+        # si no está en memoria no sabemos su DNI y se descarta la ruta entera.
+        # Solo local: los demás workers lo hacen al recibir el aviso "students".
+        if fila is None:
+            public_cache.invalidate(INFO_ROUTE, broadcast=False)
+        else:
+            public_cache.invalidate_keys(INFO_ROUTE, "dni_or_id", [student_id, fila.get("dni")],
+                                         broadcast=False)
+        invalidation_bus.publish("students", student_id)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size":          len(self._rows),
+            "ttl":           self.ttl,
+            "hits":          self.hits,
+            "misses":        self.misses,
+            "hit_ratio":     round(self.hits / total, 4) if total else 0.0,
+            "reloads":       self.reloads,
+            "invalidations": self.invalidations,
+            "generation":    self.generation,
+        }
+
+
+student_directory = StudentDirectory(ttl=int(os.getenv("STUDENT_CACHE_TTL", "60")))
+
+# Una escritura atendida por otro worker marca la misma fila como sucia aquí
+invalidation_bus.subscribe("students", student_directory.invalidate)
+
+metrics.register_gauge("emblema_student_cache", "Directorio de alumnos en memoria (hits, misses, tamaño)",
+                       lambda: {(("stat", k),): v for k, v in student_directory.stats().items()})
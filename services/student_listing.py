@@ -0,0 +1,174 @@
+# services/student_listing.py — Listados de alumnos paginados por cursor (keyset), con proyección y NDJSON
+import json
+import base64
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from database import supabase, db_execute, fetch_all, PAGE_SIZE
+from services.replica import replica, TABLES
+
+MAX_LIMIT = 1000
+# Columnas de `students` que se pueden pedir con fields= (una desconocida sería un 500 de PostgREST)
+STUDENT_COLUMNS = frozenset((
+    "id", "created_at", "updated_at", "full_name", "dni", "fecha_nacimiento", "horario", "sede",
+    "turno", "grupo", "is_active", "batido_credits", "valid_until", "tarifa_mensual",
+    "parent_name", "parent_phone",
+))
+
+
+# ── PROYECCIÓN ───────────────────────────────────────────
+def parse_fields(fields: Optional[str], default: str) -> tuple:
+    """
+    `fields=id,full_name,dni` → (select para PostgREST, claves a devolver o None).
+    El select siempre incluye id y full_name porque el cursor se arma con ellos.
+    """
+    if not fields:
+        if default.strip() == "*":
+            return "*", None
+        pedidas = [c.strip() for c in default.split(",")]
+    else:
+        pedidas = [c.strip() for c in fields.split(",") if c.strip()]
+        invalidas = [c for c in pedidas if c not in STUDENT_COLUMNS]
+        if invalidas:
+            raise HTTPException(status_code=400, detail=f"Campos inválidos: {', '.join(invalidas)}")
+    select = list(dict.fromkeys(pedidas + ["id", "full_name"]))
+    extra = len(select) > len(set(pedidas))
+    return ", ".join(select), (pedidas if extra else None)
+
+
+def _project(rows: list, keys: Optional[list]) -> list:
+    if keys is None:
+        return rows
+    return [{k: r.get(k) for k in keys} for r in rows]
+
+
+# ── CURSOR (full_name, id) ───────────────────────────────
+# SQLite (BINARY) y Postgres no ordenan full_name igual: el cursor lleva su
+# origen y la página siguiente sale del mismo lado que la anterior.
+_DE_REPLICA = "r"
+
+
+def encode_cursor(row: dict, from_replica: bool = False) -> str:
+    datos = [row.get("full_name"), row["id"]] + ([_DE_REPLICA] if from_replica else [])
+    raw = json.dumps(datos, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """→ ((full_name, id), viene_de_la_réplica)."""
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        nombre, sid = datos[0], datos[1]
+        origen = datos[2] if len(datos) > 2 else None
+        if len(datos) > 3 or origen not in (None, _DE_REPLICA):
+            raise ValueError(cursor)
+        return (nombre, str(sid)), origen == _DE_REPLICA
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+
+def _quote(value) -> str:
+    """Valor entre comillas para filtros or=() de PostgREST (soporta comas, paréntesis, puntos)."""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _after(q, cursor: Optional[tuple]):
+    """Filas estrictamente después de (full_name, id) en el orden full_name, id."""
+    q = q.order("full_name").order("id")
+    if cursor is None:
+        return q
+    nombre, sid = cursor
+    if nombre is None:
+        # Los nombres NULL van al final: solo quedan otros NULL con id mayor
+        return q.is_("full_name", "null").gt("id", sid)
+    return q.or_(f"full_name.gt.{_quote(nombre)},"
+                 f"and(full_name.eq.{_quote(nombre)},id.gt.{_quote(sid)}),"
+                 f"full_name.is.null")
+
+
+# ── RESPUESTAS ───────────────────────────────────────────
+def list_students(build: Callable, default_fields: str, fields: Optional[str],
+                  cursor: Optional[str], limit: Optional[int], format: Optional[str],
+                  replica_active: Optional[bool] = None):
+    """
+    Punto de entrada común de /students, /admin/alumnos y /admin/students.
+    `build(db, select)` devuelve el query builder con los filtros propios del endpoint.
+    `replica_active` (True = solo activos, False = todos) permite servir el
+    listado desde la réplica local cuando está al día y tiene esas columnas.
+
+    - Sin cursor/limit/format: arreglo JSON completo, como siempre (paginando
+      por debajo para no cortarse en las 1000 filas de PostgREST).
+    - `limit` y/o `cursor`: {"items": [...], "next_cursor": str | null}.
+    - `format=ndjson`: una fila por línea, en streaming, página por página.
+    """
+    select, keys = parse_fields(fields, default_fields)
+    if format not in (None, "", "json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format debe ser json o ndjson")
+
+    columnas = [c.strip() for c in select.split(",")]
+    after, de_replica = decode_cursor(cursor) if cursor else (None, None)
+    puede_replica = (replica_active is not None and set(columnas) <= set(TABLES["students"].columns)
+                     and replica.ready("students"))
+    if de_replica and not puede_replica:
+        # Seguir en Supabase con un cursor del orden de SQLite saltearía o repetiría filas
+        raise HTTPException(status_code=409, detail="El cursor ya no es válido, volver a la primera página")
+    if puede_replica and de_replica is not False:
+        return _list_replica(columnas, keys, replica_active, after, limit, format)
+
+    if format == "ndjson":
+        return _stream_ndjson(build, select, keys)
+
+    if cursor is None and limit is None:
+        rows = fetch_all(lambda db: build(db, select).order("full_name").order("id"))
+        return _project(rows, keys)
+
+    limit = max(1, min(limit or 100, MAX_LIMIT))
+    rows = _after(build(supabase, select), after).limit(limit + 1).execute().data or []
+    siguiente = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": _project(rows[:limit], keys), "next_cursor": siguiente}
+
+
+def _list_replica(columnas: list, keys: Optional[list], active_only: bool,
+                  after: Optional[tuple], limit: Optional[int], format: Optional[str]):
+    """Mismas tres formas de respuesta que list_students(), leyendo de SQLite."""
+    if format == "ndjson":
+        def lineas():
+            after = None
+            while True:
+                rows = replica.students_page(columnas, active_only, after, PAGE_SIZE)
+                if rows:
+                    yield "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n"
+                                  for r in _project(rows, keys)).encode("utf-8")
+                if len(rows) < PAGE_SIZE:
+                    return
+                after = (rows[-1].get("full_name"), rows[-1]["id"])
+
+        return StreamingResponse(lineas(), media_type="application/x-ndjson",
+                                 headers={"Cache-Control": "no-store"})
+
+    if after is None and limit is None:
+        return _project(replica.students_page(columnas, active_only, None, None), keys)
+
+    limit = max(1, min(limit or 100, MAX_LIMIT))
+    rows = replica.students_page(columnas, active_only, after, limit + 1)
+    siguiente = encode_cursor(rows[limit - 1], from_replica=True) if len(rows) > limit else None
+    return {"items": _project(rows[:limit], keys), "next_cursor": siguiente}
+
+
+def _stream_ndjson(build: Callable, select: str, keys: Optional[list]) -> StreamingResponse:
+    async def lineas():
+        after = None
+        while True:
+            res = await db_execute(lambda db: _after(build(db, select), after).limit(PAGE_SIZE))
+            rows = res.data or []
+            if rows:
+                yield "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n"
+                              for r in _project(rows, keys)).encode("utf-8")
+            if len(rows) < PAGE_SIZE:
+                return
+            after = (rows[-1].get("full_name"), rows[-1]["id"])
+
+    return StreamingResponse(lineas(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-store"})
@@ -0,0 +1,110 @@
+# services/trainer_tokens.py — Caché de magic tokens de entrenadores + last_used_at diferido
+import os
+import asyncio
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+from cachetools import TTLCache
+
+from database import db_execute
+from services.invalidation_bus import invalidation_bus
+from services.replica import replica
+
+TOKEN_CACHE_TTL = int(os.getenv("TRAINER_TOKEN_CACHE_TTL", "30"))
+# Cada cuántos segundos se escriben en bloque los last_used_at pendientes
+LAST_USED_FLUSH_SECONDS = int(os.getenv("TRAINER_LAST_USED_FLUSH_SECONDS", "30"))
+
+
+class TrainerTokens:
+    """
+    token → {id, nombre, is_active} con TTL corto.
+
+    - `toggle_entrenador` llama a `invalidate_trainer()` para que revocar el
+      acceso tenga efecto inmediato y no al vencer el TTL.
+    - `touch()` solo anota el uso en memoria (al segundo); `flush()` escribe
+      los last_used_at pendientes con un UPDATE ... WHERE id IN (...) por
+      cada instante distinto, así cada entrenador guarda su propio último uso.
+    """
+
+    def __init__(self, ttl: int = TOKEN_CACHE_TTL):
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=512, ttl=ttl)
+        self._pending = {}          # entrenador_id → último uso (datetime UTC)
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    # ── LECTURA ──────────────────────────────────────────
+    async def lookup(self, token: str) -> Optional[dict]:
+        """Fila del entrenador dueño del token (activo o no), o None si no existe."""
+        with self._lock:
+            ent = self._cache.get(token)
+        if ent is not None:
+            self.hits += 1
+            return ent
+
+        self.misses += 1
+        # Un token que no está en la réplica puede ser recién creado: ese sí va a Supabase
+        ent = replica.trainer_by_token(token) if replica.ready("entrenadores") else None
+        if ent is None:
+            res = await db_execute(lambda db: db.table("entrenadores")
+                                   .select("id, nombre, is_active")
+                                   .eq("token", token))
+            if not res.data:
+                return None
+            ent = res.data[0]
+        with self._lock:
+            self._cache[token] = ent
+        return ent
+
+    def invalidate_trainer(self, ent_id: str):
+        with self._lock:
+            for token in [t for t, e in self._cache.items() if e.get("id") == ent_id]:
+                self._cache.pop(token, None)
+        replica.mark_dirty("entrenadores", ent_id)
+        invalidation_bus.publish("trainer", ent_id)
+
+    # ── last_used_at (write-behind) ──────────────────────
+    def touch(self, ent_id: str):
+        with self._lock:
+            self._pending[ent_id] = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        por_instante = {}
+        for ent_id, ts in pending.items():
+            por_instante.setdefault(ts, []).append(ent_id)
+        for ts, ids in por_instante.items():
+            try:
+                await db_execute(lambda db, ts=ts, ids=ids: db.table("entrenadores")
+                                 .update({"last_used_at": ts.isoformat()})
+                                 .in_("id", ids))
+                self.flushes += 1
+            except Exception as e:
+                print(f"[trainer-tokens] Error escribiendo last_used_at ({len(ids)}): {e}")
+                # Reencolar sin pisar usos más nuevos anotados mientras tanto
+                with self._lock:
+                    for ent_id in ids:
+                        self._pending.setdefault(ent_id, ts)
+
+    async def run_flusher(self, interval: int = LAST_USED_FLUSH_SECONDS):
+        """Tarea de fondo (se lanza en el arranque de main.py)."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "hits":    self.hits,
+            "misses":  self.misses,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+        }
+
+
+trainer_tokens = TrainerTokens()
+invalidation_bus.subscribe("trainer", trainer_tokens.invalidate_trainer)
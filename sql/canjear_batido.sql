@@ -0,0 +1,43 @@
+-- sql/canjear_batido.sql — Canje atómico de batidos (lo usa POST /batidos/canjear)
+--
+-- Ejecutar una vez en el SQL Editor de Supabase. El UPDATE condicional toma el
+-- lock de la fila del alumno, así dos kioscos que canjean a la vez se
+-- serializan y nunca dejan el saldo negativo. Descuento + registro del canje
+-- ocurren en la misma transacción y en un solo round trip.
+
+create or replace function public.canjear_batido(
+    p_student_id   uuid,
+    p_batido_name  text,
+    p_credits_used integer,
+    p_emoji        text default '🥤'
+)
+returns json
+language plpgsql
+as $$
+declare
+    v_nombre text;
+    v_saldo  integer;
+begin
+    if p_credits_used is null or p_credits_used <= 0 then
+        return json_build_object('ok', false, 'error', 'creditos_invalidos');
+    end if;
+
+    update students
+       set batido_credits = coalesce(batido_credits, 0) - p_credits_used
+     where id = p_student_id
+       and coalesce(batido_credits, 0) >= p_credits_used
+    returning full_name, batido_credits into v_nombre, v_saldo;
+
+    if not found then
+        if exists (select 1 from students where id = p_student_id) then
+            return json_build_object('ok', false, 'error', 'saldo_insuficiente');
+        end if;
+        return json_build_object('ok', false, 'error', 'no_encontrado');
+    end if;
+
+    insert into batido_canjes (student_id, batido_name, credits_used, emoji)
+    values (p_student_id, p_batido_name, p_credits_used, p_emoji);
+
+    return json_build_object('ok', true, 'alumno', v_nombre, 'saldo_restante', v_saldo);
+end;
+$$;
@@ -0,0 +1,14 @@
+-- sql/replica_inserted_at.sql — Columna inserted_at para la réplica local (READ_REPLICA=1)
+--
+-- Ejecutar una vez en el SQL Editor de Supabase. attendance y biometria se
+-- replican pidiendo las filas nuevas desde la última marca; por created_at se
+-- pierden las que llegan tarde con un created_at viejo (subidas offline de
+-- /attendance/sync-batch, el diario write-behind vaciándose después de una
+-- caída). inserted_at es la hora real del INSERT, así que nunca queda atrás
+-- de la marca. Sin esta columna services/replica.py sigue usando created_at.
+
+alter table public.attendance add column if not exists inserted_at timestamptz not null default now();
+alter table public.biometria  add column if not exists inserted_at timestamptz not null default now();
+
+create index if not exists attendance_inserted_at_idx on public.attendance (inserted_at);
+create index if not exists biometria_inserted_at_idx  on public.biometria (inserted_at);
@@ -0,0 +1,44 @@
+-- sql/replica_updated_at.sql — Columna updated_at para la réplica local (READ_REPLICA=1)
+--
+-- Ejecutar una vez en el SQL Editor de Supabase. Con updated_at, services/replica.py
+-- pide solo las filas editadas desde la última sincronización; sin ella relee
+-- la tabla completa en cada ciclo. El trigger la mantiene en cada UPDATE,
+-- incluidas las ediciones hechas a mano desde el panel de Supabase.
+
+create or replace function public.touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := now();
+    return new;
+end;
+$$;
+
+alter table public.students     add column if not exists updated_at timestamptz not null default now();
+alter table public.credentials  add column if not exists updated_at timestamptz not null default now();
+alter table public.entrenadores add column if not exists updated_at timestamptz not null default now();
+
+drop trigger if exists students_touch_updated_at on public.students;
+create trigger students_touch_updated_at
+    before update on public.students
+    for each row execute function public.touch_updated_at();
+
+drop trigger if exists credentials_touch_updated_at on public.credentials;
+create trigger credentials_touch_updated_at
+    before update on public.credentials
+    for each row execute function public.touch_updated_at();
+
+-- last_used_at se escribe seguido: solo cuentan los cambios que la réplica copia
+drop trigger if exists entrenadores_touch_updated_at on public.entrenadores;
+create trigger entrenadores_touch_updated_at
+    before update of nombre, token, is_active on public.entrenadores
+    for each row execute function public.touch_updated_at();
+
+create index if not exists students_updated_at_idx     on public.students (updated_at);
+create index if not exists credentials_updated_at_idx  on public.credentials (updated_at);
+create index if not exists entrenadores_updated_at_idx on public.entrenadores (updated_at);
+
+-- attendance y biometria solo se leen por created_at (ya indexado por los reportes)
+create index if not exists attendance_created_at_idx on public.attendance (created_at);
+create index if not exists biometria_created_at_idx  on public.biometria (created_at);
@@ -0,0 +1,28 @@
+# tests/conftest.py — La app contra el Supabase en memoria de bench/ (sin red)
+import random
+
+import pytest
+
+import bench.run as bench
+
+# Antes de importar la app: database.py crea el cliente al importarse
+FAKE = bench._install_fake(0)
+STUDENTS = bench._seed(FAKE, 20, 200, random.Random(1))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def students():
+    return STUDENTS
+
+
+@pytest.fixture
+def admin_headers():
+    return bench._admin_headers()
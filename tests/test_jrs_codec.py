@@ -0,0 +1,29 @@
+# tests/test_jrs_codec.py — Parseo de payloads JRS
+from bench.run import _jrs
+from services import jrs_codec
+
+
+def test_parse_valido(students):
+    st = students[0]
+    datos = jrs_codec.parse(_jrs(st))
+    assert datos == {"student_id": st["id"], "valid_date": st["valid_until"].replace("-", ""),
+                     "name": st["full_name"]}
+
+
+def test_parse_firma_no_ascii_es_invalido():
+    assert jrs_codec.parse("JRS:a:b:YQ:ñññ") is None
+
+
+def test_parse_malformado_es_invalido():
+    for code in ("JRS:", "JRS:a:b:c", "JRS:a:b:%%%:0000", "STU-ABC"):
+        assert jrs_codec.parse(code) is None
+
+
+def test_scan_firma_no_ascii_responde_400(client):
+    res = client.post("/attendance/scan", json={"code": "JRS:a:b:YQ:ñññ"})
+    assert res.status_code == 400
+
+
+def test_nfc_firma_no_ascii_no_es_500(client):
+    res = client.get("/batidos/nfc/JRS:a:b:YQ:ñññ")
+    assert res.status_code < 500
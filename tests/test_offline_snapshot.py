@@ -0,0 +1,47 @@
+# tests/test_offline_snapshot.py — Versiones iguales entre workers y sin recargas por TTL
+import asyncio
+from datetime import date
+
+import services.offline_snapshot as osnap
+import services.student_cache as sc
+
+
+def test_misma_vista_misma_version_en_cualquier_worker(students):
+    hoy = date(2026, 1, 15)
+    a, b = osnap.OfflineSnapshot(), osnap.OfflineSnapshot()
+    a._rebuild(students, (1, hoy))
+    b._rebuild(list(reversed(students)), (7, hoy))
+    assert a.version and a.version == b.version
+    assert a.full_body() == b.full_body()
+
+
+def test_delta_contra_version_de_otro_worker(students):
+    hoy = date(2026, 1, 15)
+    a, b = osnap.OfflineSnapshot(), osnap.OfflineSnapshot()
+    a._rebuild(students, (1, hoy))
+    b._rebuild(students, (1, hoy))
+    v0 = a.version
+
+    cambiados = [dict(students[0], full_name="Otro Nombre")] + students[2:]
+    b._rebuild(cambiados, (2, hoy))
+    delta = b.delta(v0)
+    assert delta["version"] == b.version != v0
+    assert list(delta["students"]) == [students[0]["id"]]
+    assert delta["removed"] == [students[1]["id"]]
+
+    # Una versión que este worker nunca tuvo → snapshot completo
+    assert osnap.OfflineSnapshot().delta(v0) is None
+
+
+def test_refresh_no_recarga_la_tabla_por_ttl(monkeypatch, students):
+    d = sc.StudentDirectory(ttl=0)
+    monkeypatch.setattr(osnap, "student_directory", d)
+    snap = osnap.OfflineSnapshot()
+    asyncio.run(snap.refresh())
+    asyncio.run(snap.refresh())
+    assert d.reloads == 1
+
+    # Los alumnos sucios sí se refrescan (sin recargar la tabla)
+    d.invalidate(students[0]["id"])
+    asyncio.run(snap.refresh())
+    assert d.reloads == 1 and not d._stale
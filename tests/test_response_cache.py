@@ -0,0 +1,38 @@
+# tests/test_response_cache.py — La ficha pública del alumno no sobrevive a sus escrituras
+def _activo(students):
+    return next(s for s in students if s.get("is_active") and s.get("dni"))
+
+
+def test_ficha_es_privada(client, students):
+    res = client.get(f"/public/student/{_activo(students)['dni']}/info")
+    assert res.status_code == 200
+    assert res.headers["cache-control"].startswith("private")
+
+
+def test_actualizar_alumno_invalida_su_ficha(client, students, admin_headers):
+    alumno = _activo(students)
+    urls = [f"/public/student/{alumno['dni']}/info", f"/public/student/{alumno['id']}/info"]
+    for url in urls:
+        assert client.get(url).json()["full_name"] == alumno["full_name"]
+
+    res = client.patch(f"/admin/alumnos/{alumno['id']}", json={"full_name": "Nombre Nuevo"},
+                       headers=admin_headers)
+    assert res.status_code == 200
+    for url in urls:
+        assert client.get(url).json()["full_name"] == "Nombre Nuevo"
+
+
+def test_con_directorio_cargado_solo_cae_la_ficha_del_alumno(client, students, admin_headers):
+    from services.response_cache import public_cache
+    from services.student_cache import student_directory, INFO_ROUTE
+
+    activos = [s for s in students if s.get("is_active") and s.get("dni")]
+    alumno, otro = activos[1], activos[2]
+    student_directory.all()
+    client.get(f"/public/student/{alumno['dni']}/info")
+    client.get(f"/public/student/{otro['dni']}/info")
+
+    client.patch(f"/admin/alumnos/{alumno['id']}", json={"full_name": "Otro Nombre"}, headers=admin_headers)
+    claves = {dict(k[1])["dni_or_id"] for k in public_cache._entries if k[0] == INFO_ROUTE}
+    assert alumno["dni"] not in claves and otro["dni"] in claves
+    assert client.get(f"/public/student/{alumno['dni']}/info").json()["full_name"] == "Otro Nombre"
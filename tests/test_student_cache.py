@@ -0,0 +1,42 @@
+# tests/test_student_cache.py — Invalidaciones que llegan mientras se consulta
+import asyncio
+
+import services.student_cache as sc
+
+
+def _invalidar_durante_consultas(monkeypatch, d, sid):
+    """Cada consulta del directorio recibe un invalidate(sid) antes de volver."""
+    real_execute, real_fetch_all = sc.db_execute, sc.fetch_all
+
+    async def execute(build):
+        d.invalidate(sid)
+        return await real_execute(build)
+
+    def fetch_all(build):
+        d.invalidate(sid)
+        return real_fetch_all(build)
+
+    monkeypatch.setattr(sc, "db_execute", execute)
+    monkeypatch.setattr(sc, "fetch_all", fetch_all)
+
+
+def test_invalidacion_durante_aget_no_se_pierde(monkeypatch, students):
+    sid = students[0]["id"]
+    d = sc.StudentDirectory(ttl=60)
+    asyncio.run(d.aall())
+    d.invalidate(sid)
+    _invalidar_durante_consultas(monkeypatch, d, sid)
+    asyncio.run(d.aget(sid))
+    assert sid in d._stale
+
+
+def test_invalidacion_durante_recarga_completa_no_se_pierde(monkeypatch, students):
+    sid = students[1]["id"]
+    d = sc.StudentDirectory(ttl=60)
+    _invalidar_durante_consultas(monkeypatch, d, sid)
+    d.all()
+    assert sid in d._stale
+    # Sin invalidaciones en vuelo, la siguiente lectura lo vuelve a pedir y queda limpio
+    monkeypatch.undo()
+    assert d.get(sid)["id"] == sid
+    assert sid not in d._stale
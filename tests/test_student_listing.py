@@ -0,0 +1,15 @@
+# tests/test_student_listing.py — Proyección fields= de los listados de alumnos
+import pytest
+
+
+@pytest.mark.parametrize("ruta", ["/students", "/admin/alumnos", "/admin/students"])
+def test_campo_desconocido_es_400(client, admin_headers, ruta):
+    res = client.get(ruta, params={"fields": "id,nonexistent"}, headers=admin_headers)
+    assert res.status_code == 400
+    assert "nonexistent" in res.json()["detail"]
+
+
+def test_campos_conocidos_proyectan(client, admin_headers):
+    res = client.get("/admin/alumnos", params={"fields": "id,dni", "limit": 5}, headers=admin_headers)
+    assert res.status_code == 200
+    assert all(set(r) == {"id", "dni"} for r in res.json()["items"])